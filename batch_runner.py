@@ -0,0 +1,330 @@
+"""
+Batch runs of the K-means approach over many configuration files, on a shared process pool.
+
+    python batch_runner.py configs/fleet/                      # every *.txt config of a directory
+    python batch_runner.py fleet.manifest --workers 8          # one config per line
+    python batch_runner.py configs/fleet/ --data-cache --job-args "--bootstrap 1000" --summary fleet.json
+
+A manifest lists one config path per line (relative to the manifest), optionally followed by options of
+kmeans_clustring_approch1.py for that config only. Blank lines and lines starting with # are ignored.
+
+Every config is planned in the parent process without reading its input. Configs whose file_path is the
+same CSV are grouped: the worker that runs a group loads the CSV once, with the union of the columns its
+configs need, and runs every config of the group on that DataFrame (main(argv, data=...), as
+`selector_weight.py all` does for the kmeans and gpt approaches). When there are fewer groups than
+workers, the largest groups are split, each part loading its own copy. Configs that stream their input
+(chunksize > 0) are not grouped and load it themselves.
+
+Each config is an independent job: an invalid config, a missing input or an exception fails that job
+only. A worker process that dies (e.g. killed for memory) breaks the pool; the tasks it took down are
+then replayed one at a time in a fresh pool, so only the task that crashes again fails. The run ends
+with a summary of every job (status, seconds, output) and of the total wall time.
+"""
+import argparse
+import json
+import logging
+import os
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SUFFIX = ".txt"
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+def read_manifest(path: str) -> List[Tuple[str, List[str]]]:
+    """
+    Reads a manifest: one config path per line, optionally followed by options for that config.
+
+    Returns:
+        (absolute config path, extra options) pairs, in manifest order.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries: List[Tuple[str, List[str]]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            config_path, *options = shlex.split(line)
+            entries.append((os.path.join(base_dir, config_path), options))
+    return entries
+
+
+def list_configs(source: str, suffix: str = DEFAULT_SUFFIX) -> List[Tuple[str, List[str]]]:
+    """
+    Lists the configs of a directory (files ending with suffix, sorted by name) or of a manifest file.
+    """
+    if not os.path.isdir(source):
+        return read_manifest(source)
+    names = sorted(name for name in os.listdir(source) if name.endswith(suffix))
+    return [(os.path.abspath(os.path.join(source, name)), []) for name in names]
+
+
+def plan_job(index: int, config_path: str, argv: List[str]) -> Dict[str, Any]:
+    """
+    Loads one config and resolves the options of its job, without reading its input.
+
+    Returns:
+        The job: config, argv of kmeans_clustring_approch1.main, output path, and the input file and
+        columns to load for it when it can share a load (None otherwise). "error" is set when the
+        config or its options are invalid.
+    """
+    from kmeans_clustring_approch1 import ENGINE_KMEANS, parse_args
+    from utils import load_config
+
+    job: Dict[str, Any] = {"index": index, "config": config_path, "argv": ["--config", config_path] + argv,
+                           "output": None, "input": None, "columns": None, "error": None}
+    try:
+        options = parse_args(job["argv"])
+    except SystemExit:
+        job["error"] = f"invalid options: {shlex.join(argv)}"
+        return job
+    config = load_config(script_dir, config_path)
+    if config is None or 'num_clusters' not in config:
+        job["error"] = "invalid K-means configuration (see the log)"
+        return job
+
+    job["output"] = os.path.join(script_dir, 'weights', config['output_file'])
+    chunksize = options.chunksize if options.chunksize is not None else config.get('chunksize', 0)
+    if chunksize <= 0:
+        # Colonnes lues par main() pour ce moteur : toutes les colonnes du CSV pour l'ajustement sklearn
+        engine = options.engine or config.get('engine')
+        columns = config['columns_csv'] if engine == ENGINE_KMEANS or options.check_engines else config['prop_columns']
+        segments = options.segment_by if options.segment_by is not None else config.get('segment_by', [])
+        job["input"] = os.path.abspath(config['file_path'])
+        job["columns"] = list(dict.fromkeys(segments + columns))
+    return job
+
+
+def plan_jobs(entries: List[Tuple[str, List[str]]], job_args: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Plans every config; a config writing the same output file as an earlier one is rejected.
+    """
+    jobs: List[Dict[str, Any]] = []
+    outputs: Dict[str, str] = {}
+    for index, (config_path, options) in enumerate(entries):
+        job = plan_job(index, config_path, (job_args or []) + options)
+        if job["error"] is None:
+            if job["output"] in outputs:
+                job["error"] = f"same output file as {outputs[job['output']]}"
+            else:
+                outputs[job["output"]] = config_path
+        jobs.append(job)
+    return jobs
+
+
+def make_tasks(jobs: List[Dict[str, Any]], workers: int) -> List[List[Dict[str, Any]]]:
+    """
+    Groups the runnable jobs into pool tasks: one task per shared input, one per non-shared job.
+
+    Returns:
+        Tasks (lists of jobs), largest first.
+    """
+    tasks: List[List[Dict[str, Any]]] = []
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        if job["error"] is not None:
+            continue
+        if job["input"] is None:
+            tasks.append([job])
+        else:
+            groups.setdefault(job["input"], []).append(job)
+    tasks.extend(groups.values())
+    # Moins de tâches que de processus : couper le plus gros groupe en deux (chaque moitié charge son entrée)
+    while 0 < len(tasks) < workers:
+        largest = max(range(len(tasks)), key=lambda i: len(tasks[i]))
+        if len(tasks[largest]) < 2:
+            break
+        task = tasks.pop(largest)
+        tasks.extend([task[:len(task) // 2], task[len(task) // 2:]])
+    # Les plus grosses tâches d'abord, pour ne pas finir sur une longue tâche seule
+    tasks.sort(key=len, reverse=True)
+    return tasks
+
+
+class _LastError(logging.Handler):
+    """Keeps the last error logged while a job runs, to report it in the summary."""
+
+    def __init__(self) -> None:
+        super().__init__(level=logging.ERROR)
+        self.message: Optional[str] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.message = record.getMessage()
+
+
+def run_job(job: Dict[str, Any], data: Any = None) -> Dict[str, Any]:
+    """
+    Runs kmeans_clustring_approch1.main for one job and reports its status, never raising.
+    """
+    import kmeans_clustring_approch1
+
+    last_error = _LastError()
+    logging.getLogger().addHandler(last_error)
+    start = time.perf_counter()
+    error = None
+    try:
+        status = kmeans_clustring_approch1.main(job["argv"], data=data)
+        if status:
+            error = last_error.message or f"exit status {status} (see the log)"
+    except (Exception, SystemExit) as e:
+        error = repr(e)
+    finally:
+        logging.getLogger().removeHandler(last_error)
+    return {"index": job["index"], "config": job["config"], "status": STATUS_OK if error is None else STATUS_FAILED,
+            "seconds": round(time.perf_counter() - start, 3), "output": job["output"], "error": error,
+            "shared_load": data is not None}
+
+
+def run_task(jobs: List[Dict[str, Any]], use_cache: bool = False) -> Dict[str, Any]:
+    """
+    Worker task: loads the shared input once (when several jobs read it), then runs every job.
+
+    Returns:
+        {"load_seconds": time of the shared load, "results": one result per job}.
+    """
+    from utils import load_data
+
+    data = None
+    load_seconds = 0.0
+    if len(jobs) > 1 and jobs[0]["input"] is not None:
+        start = time.perf_counter()
+        columns = list(dict.fromkeys(column for job in jobs for column in job["columns"]))
+        # En cas d'échec (colonne absente...), chaque config charge elle-même son entrée et rapporte sa propre erreur
+        data = load_data(jobs[0]["input"], usecols=columns, use_cache=use_cache)
+        load_seconds = time.perf_counter() - start
+    return {"load_seconds": round(load_seconds, 3), "results": [run_job(job, data) for job in jobs]}
+
+
+def failed_task(jobs: List[Dict[str, Any]], error: str) -> Dict[str, Any]:
+    return {"load_seconds": 0.0,
+            "results": [{"index": job["index"], "config": job["config"], "status": STATUS_FAILED, "seconds": 0.0,
+                         "output": job["output"], "error": error, "shared_load": False} for job in jobs]}
+
+
+def run_tasks(tasks: List[List[Dict[str, Any]]], workers: int, use_cache: bool = False) -> List[Dict[str, Any]]:
+    """
+    Runs the tasks on a process pool; tasks lost to a dead worker are replayed alone in a fresh pool.
+    """
+    outcomes: List[Dict[str, Any]] = []
+    broken: List[List[Dict[str, Any]]] = []
+    total = sum(len(task) for task in tasks)
+    done = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+        futures = {pool.submit(run_task, task, use_cache): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                outcomes.append(future.result())
+            except BrokenProcessPool:
+                broken.append(task)
+                continue
+            except Exception as e:
+                outcomes.append(failed_task(task, repr(e)))
+            done += len(task)
+            logging.info(f"Batch progress: {done}/{total} configs done.")
+
+    for task in broken:
+        # Un seul processus par pool : si la tâche fait encore tomber son processus, elle seule échoue
+        logging.warning(f"Replaying {len(task)} config(s) after a worker process died.")
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            try:
+                outcomes.append(pool.submit(run_task, task, use_cache).result())
+            except Exception as e:
+                outcomes.append(failed_task(task, f"worker process died: {e!r}"))
+    return outcomes
+
+
+def run_batch(entries: List[Tuple[str, List[str]]], workers: int, job_args: Optional[List[str]] = None,
+              use_cache: bool = False) -> Dict[str, Any]:
+    """
+    Plans, groups and runs every config.
+
+    Returns:
+        The batch report: per-job results in input order, shared loads and timings.
+    """
+    start = time.perf_counter()
+    job_args = list(job_args or [])
+    if use_cache:
+        job_args.append("--data-cache")
+    jobs = plan_jobs(entries, job_args)
+    tasks = make_tasks(jobs, workers)
+    shared = [task for task in tasks if len(task) > 1 and task[0]["input"] is not None]
+    logging.info(f"Planned {len(jobs)} configs: {len(tasks)} tasks, {len(shared)} shared input loads "
+                 f"for {sum(len(task) for task in shared)} configs, {workers} workers.")
+    outcomes = run_tasks(tasks, workers, use_cache)
+
+    results = [failed_task([job], job["error"])["results"][0] for job in jobs if job["error"] is not None]
+    for outcome in outcomes:
+        results.extend(outcome["results"])
+    results.sort(key=lambda result: result["index"])
+    job_seconds = sum(result["seconds"] for result in results) + sum(outcome["load_seconds"] for outcome in outcomes)
+    return {"configs": len(results),
+            "ok": sum(1 for result in results if result["status"] == STATUS_OK),
+            "failed": sum(1 for result in results if result["status"] == STATUS_FAILED),
+            "workers": workers,
+            "shared_loads": len(shared),
+            "wall_seconds": round(time.perf_counter() - start, 3),
+            "job_seconds": round(job_seconds, 3),
+            "results": [{key: value for key, value in result.items() if key != "index"} for result in results]}
+
+
+def format_summary(report: Dict[str, Any]) -> str:
+    columns = ("config", "status", "seconds", "result")
+    rows = [{"config": os.path.basename(result["config"]), "status": result["status"], "seconds": result["seconds"],
+             "result": result["error"] or result["output"]} for result in report["results"]]
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)) for row in rows]
+    lines.append(f"{report['ok']}/{report['configs']} configs succeeded, {report['failed']} failed; "
+                 f"{report['shared_loads']} shared input loads; wall time {report['wall_seconds']}s "
+                 f"for {report['job_seconds']}s of work on {report['workers']} workers.")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the K-means approach for many configs on a process pool.")
+    parser.add_argument("source", help="Directory of config files, or manifest listing one config per line "
+                                       "(optionally followed by options for that config)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--suffix", default=DEFAULT_SUFFIX,
+                        help=f"Extension of the config files of a directory (default: {DEFAULT_SUFFIX})")
+    parser.add_argument("--job-args", default="",
+                        help="Options of kmeans_clustring_approch1.py passed to every config (quoted)")
+    parser.add_argument("--data-cache", action="store_true",
+                        help="Use the columnar binary cache of the parsed CSV inputs")
+    parser.add_argument("--summary", default=None, metavar="JSON", help="Also write the batch report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be positive.")
+
+    try:
+        entries = list_configs(args.source, args.suffix)
+    except (OSError, ValueError) as e:
+        logging.error(f"Cannot read the configs of {args.source}: {e}")
+        return 1
+    if not entries:
+        logging.error(f"No config found in {args.source}.")
+        return 1
+
+    report = run_batch(entries, args.workers, shlex.split(args.job_args), args.data_cache)
+    print(format_summary(report))
+    if args.summary:
+        tmp_path = f"{args.summary}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, args.summary)
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+"""
+Benchmark harness: times and memory-profiles each pipeline stage on synthetic inputs of growing size.
+
+    python benchmark.py --rows 1000 100000 1000000 --output benchmarks/baseline.json
+    python benchmark.py --rows 1000 100000 1000000 --compare benchmarks/baseline.json
+
+Stages: load_data, preprocess_properties, apply_kmeans, apply_exact, combine_weights,
+write_to_properties_file and process_xpaths. Each stage records wall time, CPU time,
+the tracemalloc peak of its own allocations, the process peak RSS and its throughput.
+Results are written as JSON so baselines can be compared across versions.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from instrumentation import peak_rss_bytes
+from synthetic_data import default_properties, generate_elements_csv, generate_xpath_list
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = ("load_data", "preprocess_properties", "apply_kmeans", "apply_exact", "combine_weights",
+          "write_to_properties_file", "process_xpaths")
+# apply_kmeans ajuste un KMeans sklearn par colonne : au-delà, le temps n'est plus raisonnable
+DEFAULT_KMEANS_MAX_ROWS = 1_000_000
+BENCHMARK_FORMAT_VERSION = 1
+
+
+def measure(stage: str, n_items: int, func: Callable[..., Any], *args: Any,
+            trace_memory: bool = True) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Runs func(*args) once and records its timings and memory use.
+
+    Args:
+        stage: Stage name stored in the result.
+        n_items: Rows (or XPath lines) processed, used for the throughput.
+        func: Stage function.
+        *args: Arguments passed to func.
+        trace_memory: Track the stage's peak Python/numpy allocations with tracemalloc (slows Python-heavy stages).
+
+    Returns:
+        The function's return value and the result record.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    value = func(*args)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    record = {
+        "stage": stage,
+        "rows": n_items,
+        "wall_s": round(wall, 6),
+        "cpu_s": round(cpu, 6),
+        "tracemalloc_peak_bytes": traced_peak,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "rows_per_s": round(n_items / wall, 1) if wall > 0 else None,
+    }
+    logging.info(f"[{n_items} rows] {stage}: {wall:.3f}s wall, {cpu:.3f}s cpu"
+                 + (f", {traced_peak / 2**20:.1f} MiB traced peak" if traced_peak is not None else ""))
+    return value, record
+
+
+def run_size(n_rows: int, n_xpath_lines: int, workdir: str, stages: List[str],
+             kmeans_max_rows: int, trace_memory: bool, seed: int) -> List[Dict[str, Any]]:
+    """
+    Generates the inputs for one size and benchmarks the selected stages on them.
+    """
+    from kmeans_clustring_approch1 import (preprocess_properties, apply_kmeans, apply_exact,
+                                           combine_weights, write_to_properties_file)
+    from pure_python_approch3 import process_xpaths
+    from utils import load_config, load_data
+
+    config = load_config(script_dir, 'config_kmeans.txt')
+    properties_map, prop_columns = config['properties_dict'], config['prop_columns']
+    num_clusters, columns_csv = config['num_clusters'], config['columns_csv']
+
+    csv_path = os.path.join(workdir, f"data_{n_rows}.csv")
+    xpath_path = os.path.join(workdir, f"xpath_{n_xpath_lines}.txt")
+    properties_path = os.path.join(workdir, f"weights_{n_rows}.properties")
+    if not os.path.exists(csv_path):
+        generate_elements_csv(csv_path, n_rows, default_properties(script_dir), seed=seed)
+    if "process_xpaths" in stages and not os.path.exists(xpath_path):
+        generate_xpath_list(xpath_path, n_xpath_lines, seed=seed)
+
+    records = []
+
+    def run(stage, n_items, func, *args):
+        value, record = measure(stage, n_items, func, *args, trace_memory=trace_memory)
+        records.append(record)
+        return value
+
+    # Chaque étape a besoin de la sortie de la précédente : elles s'exécutent toutes, seules les sélectionnées sont mesurées
+    def step(stage, n_items, func, *args):
+        if stage in stages:
+            return run(stage, n_items, func, *args)
+        return func(*args)
+
+    data = step("load_data", n_rows, load_data, csv_path, columns_csv)
+    processed = step("preprocess_properties", n_rows, preprocess_properties, data, properties_map, prop_columns)
+    list_weights = None
+    if "apply_kmeans" in stages:
+        import sklearn.cluster  # Importé d'avance pour ne pas compter l'import dans la mesure
+        if n_rows <= kmeans_max_rows:
+            list_weights, _ = run("apply_kmeans", n_rows, apply_kmeans, processed, prop_columns, num_clusters)
+        else:
+            logging.info(f"[{n_rows} rows] apply_kmeans skipped (more than {kmeans_max_rows} rows).")
+    if "apply_exact" in stages:
+        list_weights, _ = run("apply_exact", n_rows, apply_exact, processed, prop_columns, num_clusters)
+    if list_weights is None:
+        list_weights, _ = apply_exact(processed, prop_columns, num_clusters)
+    final_weights = step("combine_weights", n_rows, combine_weights, list_weights)
+    step("write_to_properties_file", n_rows, write_to_properties_file,
+         final_weights, properties_map, properties_path, 'n')
+    if "process_xpaths" in stages:
+        run("process_xpaths", n_xpath_lines, process_xpaths, xpath_path, properties_path + ".xpath")
+    return records
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Describes the interpreter, platform, library versions and git commit the results were measured on.
+    """
+    versions = {}
+    for module in ("numpy", "pandas", "sklearn"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=script_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+        "versions": versions,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """
+    Logs the wall-time ratio of each (rows, stage) against a baseline results file.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["rows"], r["stage"]): r for r in json.load(f)["results"]}
+    for record in results:
+        reference = baseline.get((record["rows"], record["stage"]))
+        if reference is None or not reference["wall_s"]:
+            continue
+        ratio = record["wall_s"] / reference["wall_s"]
+        logging.info(f"[{record['rows']} rows] {record['stage']}: {reference['wall_s']:.3f}s -> "
+                     f"{record['wall_s']:.3f}s (x{ratio:.2f})")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Input sizes (element rows and XPath lines) to benchmark, e.g. 1000 1000000 100000000")
+    parser.add_argument("--xpath-lines", type=int, nargs="+", default=None,
+                        help="XPath list sizes, one per --rows value (default: same as --rows)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="Stages to measure (default: all)")
+    parser.add_argument("--kmeans-max-rows", type=int, default=DEFAULT_KMEANS_MAX_ROWS,
+                        help=f"Skip apply_kmeans above this size (default: {DEFAULT_KMEANS_MAX_ROWS})")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="Do not trace allocations (lower overhead, peak RSS only)")
+    parser.add_argument("--workdir", default=None,
+                        help="Directory for generated inputs; reused across runs if given (default: temporary)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None,
+                        help="JSON results file (default: benchmarks/bench_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Baseline JSON results file to compare against")
+    args = parser.parse_args(argv)
+
+    xpath_lines = args.xpath_lines or args.rows
+    if len(xpath_lines) != len(args.rows):
+        parser.error("--xpath-lines needs one value per --rows value.")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="selector_weight_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    results: List[Dict[str, Any]] = []
+    try:
+        for n_rows, n_lines in zip(args.rows, xpath_lines):
+            results.extend(run_size(n_rows, n_lines, workdir, args.stages, args.kmeans_max_rows,
+                                    not args.no_tracemalloc, args.seed))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(script_dir, "benchmarks", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    logging.info(f"Benchmark results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Bootstrap confidence intervals for weights, computed from the aggregated counts alone.
+
+Resampling the input rows n times and recounting would cost n full passes over the data. Since the
+weights only depend on the count vector, a bootstrap resample of the rows has the same distribution
+as a multinomial draw with the observed total and proportions: all resamples are drawn in one NumPy
+call, normalized exactly as the weights, and the intervals are percentiles of the resampled weights.
+The cost is O(resamples x vocabulary), independent of the number of input rows.
+
+For the K-means approach each property column is resampled independently from its own counts (the
+joint distribution of the columns of a row is not kept in the aggregated counts).
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_RESAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+INTERVALS_SUFFIX = ".ci.json"
+# Nombre maximal de comptes tirés par lot : borne la mémoire à quelques centaines de Mo quel que soit le vocabulaire
+MAX_BATCH_VALUES = 8_000_000
+
+
+def resample_counts(counts: np.ndarray, n_resamples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws multinomial resamples of count vectors.
+
+    Args:
+        counts: (..., K) array of counts; every vector of the last axis is resampled with its own total.
+        n_resamples: Number of resamples.
+        rng: NumPy random generator.
+
+    Returns:
+        A (n_resamples, ..., K) int64 array; each resample keeps the totals of counts.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    totals = counts.sum(axis=-1, keepdims=True)
+    # Un vecteur vide reste vide : n = 0 avec des probabilités quelconques (mais valides)
+    safe_totals = np.where(totals == 0, 1, totals)
+    pvals = np.where(totals == 0, 1.0 / counts.shape[-1], counts / safe_totals)
+    return rng.multinomial(totals[..., 0], pvals, size=(n_resamples,) + counts.shape[:-1])
+
+
+def sqrt_weights(counts: np.ndarray, factors: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Vectorized pure_python_approch3.compute_weights (and compute_selectivity_weights with factors):
+    round(sqrt(count) * factor / max * 100) over the last axis, 0 where every score is 0.
+    """
+    scores = np.sqrt(counts)
+    if factors is not None:
+        scores = scores * factors
+    max_scores = scores.max(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.round(scores / max_scores * 100.0)
+    return np.where(max_scores > 0, weights, 0.0)
+
+
+def percentage_weights(counts: np.ndarray) -> np.ndarray:
+    """
+    Vectorized kmeans_clustring_approch1 weights: per-column percentages (weights_from_counts) of
+    (..., n_columns, K) counts, summed over the columns (combine_weights).
+    """
+    totals = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.round(counts / totals * 100.0)
+    return np.where(totals == 0, 0.0, weights).sum(axis=-2)
+
+
+def bootstrap_intervals(counts: np.ndarray, normalize: Callable[[np.ndarray], np.ndarray],
+                        n_resamples: int = DEFAULT_RESAMPLES, confidence: float = DEFAULT_CONFIDENCE,
+                        seed: int = BOOTSTRAP_SEED) -> Dict[str, np.ndarray]:
+    """
+    Computes percentile bootstrap intervals of the weights derived from counts.
+
+    Args:
+        counts: Count vector (K,) or matrix (n_columns, K) passed to normalize.
+        normalize: Maps a batch of resampled counts (B, ...) to weights (B, K), e.g. sqrt_weights.
+        n_resamples: Number of multinomial resamples.
+        confidence: Central coverage of the intervals (0.95 gives the 2.5th and 97.5th percentiles).
+        seed: Seed of the random generator, so that the intervals are reproducible.
+
+    Returns:
+        Dictionary of (K,) arrays: "low", "high" (interval bounds) and "std" (bootstrap standard deviation).
+    """
+    if n_resamples < 1:
+        raise ValueError(f"n_resamples must be at least 1, got {n_resamples}.")
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must lie in (0, 1), got {confidence}.")
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, MAX_BATCH_VALUES // max(int(np.size(counts)), 1))
+    batches: List[np.ndarray] = []
+    for start in range(0, n_resamples, batch_size):
+        resampled = resample_counts(counts, min(batch_size, n_resamples - start), rng)
+        batches.append(normalize(resampled).astype(np.float32))
+    weights = np.concatenate(batches)
+    alpha = (1.0 - confidence) / 2
+    low, high = np.quantile(weights, [alpha, 1.0 - alpha], axis=0)
+    return {"low": low, "high": high, "std": weights.std(axis=0)}
+
+
+def write_intervals(path: str, key_indices: Dict[str, int], weights: Dict[str, float],
+                    intervals: Dict[str, np.ndarray], n_resamples: int, confidence: float,
+                    seed: int = BOOTSTRAP_SEED) -> None:
+    """
+    Writes the point weights and their intervals as JSON, atomically (temporary file, then rename).
+
+    Args:
+        path: Output file, usually the properties file path + INTERVALS_SUFFIX.
+        key_indices: Attribute name -> position in the interval arrays (e.g. its code).
+        weights: Point weights written to the properties file, by attribute.
+        intervals: Result of bootstrap_intervals.
+    """
+    entries: Dict[str, Any] = {}
+    for key, index in key_indices.items():
+        entries[key] = {
+            "weight": weights[key],
+            "low": round(float(intervals["low"][index]), 2),
+            "high": round(float(intervals["high"][index]), 2),
+            "std": round(float(intervals["std"][index]), 3),
+        }
+    report = {"method": "multinomial bootstrap", "resamples": n_resamples, "confidence": confidence,
+              "seed": seed, "weights": dict(sorted(entries.items(), key=lambda item: -item[1]["weight"]))}
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
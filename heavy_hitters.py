@@ -0,0 +1,108 @@
+import heapq
+from typing import Dict, List, Mapping, Tuple
+
+# Approximate peak memory of one tracked item: dict slots for the count and the error, the key string and two
+# ints, plus the transient copies made while pruning (measured at ~440 bytes for 15-character names)
+ENTRY_BYTES = 448
+
+
+def capacity_for_budget(memory_bytes: int) -> int:
+    """
+    Returns the number of items a SpaceSaving summary can track within a memory budget.
+    """
+    return max(1, memory_bytes // ENTRY_BYTES)
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the most frequent items of a stream, in bounded memory.
+
+    At most `capacity` items are tracked. Each tracked item has an estimated count that never
+    underestimates its true count, and an error bound: the true count lies in
+    [count - error, count]. Any item whose true count exceeds total / capacity is guaranteed to be tracked.
+
+    The summary is fed with exact partial counts (e.g. one Counter per block of input) and
+    summaries can be merged, following the mergeable Space-Saving construction: an item missing
+    from a full summary is assumed to have that summary's minimum count.
+
+    Args:
+        capacity: Maximum number of tracked items.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}.")
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.total = 0
+
+    def floor(self) -> int:
+        """
+        Returns the count assumed for untracked items: the minimum count once the summary is full, else 0.
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def update(self, partial_counts: Mapping[str, int]) -> None:
+        """
+        Folds in the exact counts of a block of the stream (items absent from the block occurred 0 times).
+        """
+        floor = self.floor()
+        counts, errors = self.counts, self.errors
+        for item, count in partial_counts.items():
+            if item in counts:
+                counts[item] += count
+            else:
+                counts[item] = floor + count
+                errors[item] = floor
+        self.total += sum(partial_counts.values())
+        self._prune()
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """
+        Folds another summary into this one; the result tracks at most self.capacity items.
+        """
+        own_floor, other_floor = self.floor(), other.floor()
+        counts, errors = self.counts, self.errors
+        for item in counts:
+            if item not in other.counts:
+                counts[item] += other_floor
+                errors[item] += other_floor
+        for item, count in other.counts.items():
+            if item in counts:
+                counts[item] += count
+                errors[item] += other.errors[item]
+            else:
+                counts[item] = own_floor + count
+                errors[item] = own_floor + other.errors[item]
+        self.total += other.total
+        self._prune()
+
+    def _prune(self) -> None:
+        if len(self.counts) <= self.capacity:
+            return
+        kept = set(heapq.nlargest(self.capacity, self.counts, key=self.counts.get))
+        # Les éléments gardés conservent leur ordre de première apparition (ordre de sortie à poids égal)
+        self.counts = {item: count for item, count in self.counts.items() if item in kept}
+        self.errors = {item: self.errors[item] for item in self.counts}
+
+    def max_error(self) -> float:
+        """
+        Returns the worst-case overestimation of any count: total / capacity.
+        """
+        return self.total / self.capacity
+
+    def top(self, n: int) -> List[Tuple[str, int, int, bool]]:
+        """
+        Returns the n items with the highest estimated counts, most frequent first.
+
+        Returns:
+            (item, count, error, guaranteed) tuples; guaranteed is True when the item's lower bound
+            (count - error) is at least the (n + 1)-th estimated count, i.e. it is certainly in the true top n.
+        """
+        ranked = sorted(self.counts, key=self.counts.get, reverse=True)
+        threshold = self.counts[ranked[n]] if len(ranked) > n else self.floor()
+        return [(item, self.counts[item], self.errors[item], self.counts[item] - self.errors[item] >= threshold)
+                for item in ranked[:n]]
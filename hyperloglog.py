@@ -0,0 +1,100 @@
+import hashlib
+import math
+from typing import Iterable, Optional
+
+# 2^12 registers of one byte: 4 KiB per sketch, about 1.6% standard error on the distinct count
+DEFAULT_PRECISION = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+HASH_BITS = 64
+
+# 2^-rank for every possible register value, so estimate() does no exponentiation
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(HASH_BITS + 1)]
+
+
+def hash64(value: bytes) -> int:
+    """
+    Returns a stable 64-bit hash of value (BLAKE2b), identical across processes and runs.
+    """
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of distinct values added, in fixed memory.
+
+    Sketches with the same precision can be merged (e.g. the partial sketches of worker processes);
+    the merge estimates the distinct count of the union.
+
+    Args:
+        precision: Number of index bits p; the sketch holds 2^p one-byte registers and its
+                   standard error is about 1.04 / sqrt(2^p).
+        registers: Existing registers to restore (e.g. from to_bytes()).
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[bytes] = None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precision must lie in [{MIN_PRECISION}, {MAX_PRECISION}], got {precision}.")
+        self.precision = precision
+        self.n_registers = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.n_registers)
+        elif len(registers) != self.n_registers:
+            raise ValueError(f"Expected {self.n_registers} registers, got {len(registers)}.")
+        else:
+            self.registers = bytearray(registers)
+
+    def add(self, value: bytes) -> None:
+        self.update((value,))
+
+    def update(self, values: Iterable[bytes]) -> None:
+        """
+        Adds every value of an iterable (duplicates do not change the sketch).
+        """
+        registers = self.registers
+        value_bits = HASH_BITS - self.precision
+        mask = (1 << value_bits) - 1
+        blake2b, from_bytes = hashlib.blake2b, int.from_bytes
+        for value in values:
+            # Même calcul que hash64, sans appel de fonction par valeur
+            h = from_bytes(blake2b(value, digest_size=8).digest(), "big")
+            index = h >> value_bits
+            # Rang = position du premier bit à 1 dans les bits restants (value_bits + 1 s'ils sont tous nuls)
+            rank = value_bits - (h & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """
+        Folds another sketch of the same precision into this one (register-wise maximum).
+        """
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge sketches of precision {self.precision} and {other.precision}.")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> float:
+        """
+        Returns the estimated number of distinct values added so far.
+        """
+        m = self.n_registers
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Petites cardinalités : comptage linéaire des registres vides, plus précis
+            return m * math.log(m / zeros)
+        return raw
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """
+        Restores a sketch from to_bytes(); the precision is deduced from the number of registers.
+        """
+        precision = len(data).bit_length() - 1
+        return cls(precision, data)
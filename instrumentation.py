@@ -0,0 +1,184 @@
+"""
+Lightweight per-stage instrumentation for the weight pipelines.
+
+Enabled with the --metrics / --profile options of the scripts, or with environment variables:
+
+    SELECTOR_WEIGHT_METRICS=metrics.json   write per-stage metrics to this JSON file
+    SELECTOR_WEIGHT_PROFILE=1              also dump a cProfile of the slowest stage (metrics.json.prof)
+    SELECTOR_WEIGHT_TRACE_MEMORY=1         also record tracemalloc deltas/peaks (slower)
+
+When disabled, stage() returns a shared no-op context manager, so the cost is one method call per stage.
+"""
+import cProfile
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource  # Indisponible sous Windows : le pic RSS n'est alors pas mesuré
+except ImportError:
+    resource = None
+
+ENV_METRICS = "SELECTOR_WEIGHT_METRICS"
+ENV_PROFILE = "SELECTOR_WEIGHT_PROFILE"
+ENV_TRACE_MEMORY = "SELECTOR_WEIGHT_TRACE_MEMORY"
+METRICS_FORMAT_VERSION = 1
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process so far, in bytes (None if unavailable).
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en kilo-octets sous Linux, en octets sous macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class _NullStage:
+    """Shared no-op context manager returned by a disabled recorder."""
+
+    def __enter__(self) -> Dict[str, Any]:
+        return {}
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageRecorder:
+    """
+    Records wall time, CPU time, peak RSS, optional tracemalloc delta/peak and throughput per stage.
+
+    Usage:
+        recorder = recorder_from_env("kmeans", args.metrics, args.profile)
+        with recorder.stage("load_data") as stage:
+            data = load_data(...)
+            stage["items"] = len(data)   # rows/attributes processed, for the throughput
+        recorder.finish()               # writes the metrics file
+
+    Args:
+        run_name: Name of the pipeline, stored in the metrics file.
+        metrics_path: JSON file written by finish(); None disables the recorder.
+        profile: Profile every stage with cProfile and dump the slowest one next to the metrics file.
+        trace_memory: Record tracemalloc allocation delta and peak per stage.
+    """
+
+    def __init__(self, run_name: str, metrics_path: Optional[str], profile: bool = False,
+                 trace_memory: bool = False):
+        self.run_name = run_name
+        self.metrics_path = metrics_path
+        self.enabled = metrics_path is not None
+        self.profile = profile and self.enabled
+        self.trace_memory = trace_memory and self.enabled
+        self.stages: List[Dict[str, Any]] = []
+        self._hottest_profile: Optional[cProfile.Profile] = None
+        self._hottest_stage: Optional[str] = None
+        self._hottest_wall = -1.0
+        self._started = time.time()
+        self._wall_start = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name: str):
+        """
+        Returns a context manager timing one stage; it yields a dict where the caller may set "items".
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._record(name)
+
+    @contextmanager
+    def _record(self, name: str) -> Iterator[Dict[str, Any]]:
+        info: Dict[str, Any] = {}
+        profiler = cProfile.Profile() if self.profile else None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        status = "ok"
+        try:
+            yield info
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            record: Dict[str, Any] = {
+                "stage": name,
+                "status": status,
+                "wall_s": round(wall, 6),
+                "cpu_s": round(cpu, 6),
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["tracemalloc_delta_bytes"] = current - traced_start
+                record["tracemalloc_peak_bytes"] = peak - traced_start
+            items = info.get("items")
+            if items is not None:
+                record["items"] = items
+                record["items_per_s"] = round(items / wall, 1) if wall > 0 else None
+            self.stages.append(record)
+            if profiler is not None and wall > self._hottest_wall:
+                self._hottest_wall, self._hottest_profile = wall, profiler
+                self._hottest_stage = name
+
+    def finish(self) -> None:
+        """
+        Writes the metrics file (and the cProfile dump of the slowest stage) if the recorder is enabled.
+        """
+        if not self.enabled:
+            return
+        metrics = {
+            "format_version": METRICS_FORMAT_VERSION,
+            "run": self.run_name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+            "total_wall_s": round(time.perf_counter() - self._wall_start, 6),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": self.stages,
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+            if self._hottest_profile is not None:
+                profile_path = f"{self.metrics_path}.prof"
+                self._hottest_profile.dump_stats(profile_path)
+                metrics["profile"] = {"stage": self._hottest_stage, "path": profile_path}
+            tmp_path = f"{self.metrics_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metrics, f, indent=2)
+            os.replace(tmp_path, self.metrics_path)
+            logging.info(f"Metrics written to {self.metrics_path}")
+        except OSError as e:
+            logging.warning(f"Failed to write metrics file {self.metrics_path}: {e}")
+
+
+def recorder_from_env(run_name: str, metrics_path: Optional[str] = None,
+                      profile: bool = False) -> StageRecorder:
+    """
+    Builds a recorder from explicit options, falling back to the SELECTOR_WEIGHT_* environment variables.
+
+    Args:
+        run_name: Name of the pipeline.
+        metrics_path: Metrics file path (default: $SELECTOR_WEIGHT_METRICS; disabled if neither is set).
+        profile: Dump a cProfile of the slowest stage (default: $SELECTOR_WEIGHT_PROFILE == "1").
+
+    Returns:
+        A StageRecorder, disabled unless a metrics path is configured.
+    """
+    metrics_path = metrics_path or os.environ.get(ENV_METRICS) or None
+    profile = profile or os.environ.get(ENV_PROFILE) == "1"
+    trace_memory = os.environ.get(ENV_TRACE_MEMORY) == "1"
+    return StageRecorder(run_name, metrics_path, profile=profile, trace_memory=trace_memory)
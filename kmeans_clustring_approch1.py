@@ -1,15 +1,20 @@
 # import packages
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
 from collections import Counter, OrderedDict
+import argparse
 import configparser
+import hashlib
+import json
 import os
+import re
+import sys
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
 
 # Assuming utils.py exists and provides these functions
 try:
-    from utils import load_config, load_data
+    from utils import load_config, load_data, load_data_chunks
     # Import the config types for type checking
     from utils import KmeansConfig, GptConfig # Assuming GptConfig might be used elsewhere or for future proofing
 except ImportError as e:
@@ -28,6 +33,8 @@ except ImportError as e:
         print("Warning: Using dummy load_config returning None")
         return None
 
+from instrumentation import recorder_from_env
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -35,6 +42,25 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 KMEANS_RANDOM_STATE = 0
 KMEANS_N_INIT = 1 # Specific initialization strategy might require n_init=1
 
+# Weight computation engines
+ENGINE_EXACT = 'exact'   # Vectorized frequency count over all property columns (default)
+ENGINE_KMEANS = 'kmeans' # Original per-column sklearn KMeans fit (opt-in)
+ENGINE_ELEMENTS = 'elements'  # Element-level clustering of sparse one-hot rows with MiniBatchKMeans (opt-in)
+ENGINES = (ENGINE_EXACT, ENGINE_KMEANS, ENGINE_ELEMENTS)
+
+# Element-level engine
+ELEMENT_CLUSTERS = 8               # Default number of element clusters
+ELEMENT_BATCH_ROWS = 100_000       # Rows per partial_fit call (chunks are split or buffered to this size)
+ELEMENT_CENTROID_THRESHOLD = 0.5   # A property defines a cluster when at least this share of its elements carry it
+
+# Property vocabulary sources
+VOCABULARY_CONFIG = 'config'      # properties_dict from the config file (default)
+VOCABULARY_DISCOVER = 'discover'  # Discovered from the data in one pass and persisted as a codebook
+VOCABULARIES = (VOCABULARY_CONFIG, VOCABULARY_DISCOVER)
+CODEBOOK_VERSION = 1
+CODEBOOK_SUFFIX = '.codebook.json'
+MISSING_SEGMENT = 'missing'  # Segment value used for empty Langage/Tag cells
+
 # current folder
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -90,6 +116,9 @@ def apply_kmeans(data: pd.DataFrame, prop_columns: List[str], num_clusters: int)
         KeyError: If a column in prop_columns is not found in the DataFrame.
         ValueError: If data in a property column is not suitable for K-means (e.g., non-numeric, NaN).
     """
+    # Imported here so that the default exact engine does not require scikit-learn
+    from sklearn.cluster import KMeans
+
     # Initialize cluster centers based on the assumption that properties are mapped 0 to num_clusters-1
     # This forces initial centroids to these specific values.
     initial_centers = [[i] for i in range(num_clusters)]
@@ -139,6 +168,744 @@ def apply_kmeans(data: pd.DataFrame, prop_columns: List[str], num_clusters: int)
     return list_dict_weights, cluster_labels
 
 
+def property_dtype(properties_map: Dict[Any, int]) -> pd.CategoricalDtype:
+    """
+    Returns the categorical dtype with the fixed categories of properties_map.
+
+    Passing it to load_data / load_data_chunks makes pandas parse the property columns
+    directly into small integer category codes instead of Python string objects.
+    """
+    return pd.CategoricalDtype(categories=list(properties_map))
+
+
+def smallest_code_dtype(max_code: int) -> np.dtype:
+    """
+    Returns the smallest signed integer dtype able to hold codes up to max_code (int8, int16 or int32).
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_code <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"Too many property codes ({max_code}).")
+
+
+def encode_properties(data: pd.DataFrame, properties_map: Dict[Any, int], prop_columns: List[str],
+                      unknown_code: int) -> np.ndarray:
+    """
+    Encodes property columns into a compact integer code matrix, without copying the DataFrame.
+
+    Values are converted to a Categorical with the fixed categories of properties_map (a no-op
+    for columns read with property_dtype), then translated to their properties_map code through
+    a lookup table. Values missing from properties_map get unknown_code instead of NaN.
+
+    Args:
+        data: DataFrame holding the raw property columns.
+        properties_map: Dictionary mapping original property values to integer codes.
+        prop_columns: List of column names to encode.
+        unknown_code: Reserved code for values not found in properties_map.
+
+    Returns:
+        A (n_rows, n_columns) array of codes in the smallest fitting integer dtype (int8 for up to 127 codes).
+
+    Raises:
+        KeyError: If a column in prop_columns is not found in the DataFrame.
+        ValueError: If a properties_map code lies outside [0, unknown_code).
+    """
+    # Un code >= unknown_code tomberait dans la case réservée aux inconnues, ou dans le bloc de la colonne suivante
+    out_of_range = {key: code for key, code in properties_map.items() if not 0 <= code < unknown_code}
+    if out_of_range:
+        raise ValueError(f"Property codes must lie in [0, {unknown_code}), found {out_of_range}. "
+                         f"Check num_clusters and properties_dict.")
+    categories = list(properties_map)
+    dtype = smallest_code_dtype(max([unknown_code, *properties_map.values()]))
+    # Category index -> code; index -1 (value outside the categories) hits the last slot: unknown_code
+    lookup = np.array([properties_map[c] for c in categories] + [unknown_code], dtype=dtype)
+
+    codes = np.empty((len(data), len(prop_columns)), dtype=dtype)
+    for col_index, prop in enumerate(prop_columns):
+        if prop not in data.columns:
+            raise KeyError(f"Property column '{prop}' not found in DataFrame.")
+        column = data[prop]
+        if isinstance(column.dtype, pd.CategoricalDtype) and list(column.cat.categories) == categories:
+            category_codes = column.cat.codes.to_numpy()
+        else:
+            category_codes = pd.Categorical(column, categories=categories).codes
+        codes[:, col_index] = lookup[category_codes]
+
+    n_unknown = int(np.count_nonzero(codes == unknown_code))
+    if n_unknown:
+        logging.warning(f"{n_unknown} property values are not in properties_map; "
+                        f"they are counted under the reserved unknown code {unknown_code} "
+                        f"(use --vocabulary {VOCABULARY_DISCOVER} to weight them).")
+    return codes
+
+
+def count_properties(data: pd.DataFrame, properties_map: Dict[Any, int], prop_columns: List[str],
+                     num_clusters: int) -> np.ndarray:
+    """
+    Encodes raw property columns and counts every code, with the unknown code as an extra last bin.
+
+    Args:
+        data: DataFrame holding the raw property columns.
+        properties_map: Dictionary mapping original property values to integer codes.
+        prop_columns: List of property column names.
+        num_clusters: Number of distinct codes; code num_clusters is reserved for unknown values.
+
+    Returns:
+        A (n_columns, num_clusters + 1) int64 array of counts.
+    """
+    codes = encode_properties(data, properties_map, prop_columns, unknown_code=num_clusters)
+    return count_property_codes(codes, num_clusters + 1)
+
+
+def trim_unknown(counts: np.ndarray, num_clusters: int) -> np.ndarray:
+    """
+    Drops the unknown bin of counts from count_properties when no unknown value was seen.
+
+    Unknown values are still part of the column totals (and therefore of the percentages)
+    when present; the unknown cluster index is simply never written to the properties file.
+    """
+    if counts[:, num_clusters:].any():
+        return counts
+    return counts[:, :num_clusters]
+
+
+def encode_property_codes(data: pd.DataFrame, prop_columns: List[str], num_clusters: int) -> np.ndarray:
+    """
+    Stacks the mapped property columns into a single integer code matrix.
+
+    Args:
+        data: DataFrame whose property columns have been mapped to integers (see preprocess_properties).
+        prop_columns: List of column names to encode.
+        num_clusters: Number of distinct codes; every value must lie in [0, num_clusters).
+
+    Returns:
+        A (n_rows, n_columns) int64 array of property codes.
+
+    Raises:
+        KeyError: If a column in prop_columns is not found in the DataFrame.
+        ValueError: If a column is non-numeric, contains NaN, or holds codes outside [0, num_clusters).
+    """
+    for prop in prop_columns:
+        if prop not in data.columns:
+            raise KeyError(f"Column '{prop}' not found in DataFrame for counting.")
+        if not pd.api.types.is_numeric_dtype(data[prop]):
+            raise ValueError(f"Column '{prop}' must be numeric for counting.")
+
+    values = data[prop_columns].to_numpy()
+    if values.dtype.kind == 'f':
+        if np.isnan(values).any():
+            bad = [prop for prop in prop_columns if data[prop].isnull().any()]
+            raise ValueError(f"Columns {bad} contain NaN values, cannot count codes. Handle NaNs first.")
+        if not np.array_equal(values, np.floor(values)):
+            raise ValueError("Property codes must be integers.")
+    codes = values.astype(np.int64, copy=False)
+
+    if codes.size and (codes.min() < 0 or codes.max() >= num_clusters):
+        raise ValueError(f"Property codes must lie in [0, {num_clusters}), "
+                         f"found range [{codes.min()}, {codes.max()}]. Check num_clusters and properties_dict.")
+    return codes
+
+
+def count_property_codes(codes: np.ndarray, num_clusters: int) -> np.ndarray:
+    """
+    Counts the occurrences of every code in every column with a single bincount.
+
+    Each column is shifted into its own block of num_clusters bins so that one
+    np.bincount call over the flattened matrix yields all per-column counts.
+
+    Args:
+        codes: (n_rows, n_columns) integer code matrix from encode_property_codes.
+        num_clusters: Number of distinct codes.
+
+    Returns:
+        A (n_columns, num_clusters) int64 array of counts.
+
+    Raises:
+        ValueError: If a code lies outside [0, num_clusters): it would be counted in another column's bins.
+    """
+    if codes.size and (codes.min() < 0 or codes.max() >= num_clusters):
+        raise ValueError(f"Property codes must lie in [0, {num_clusters}), "
+                         f"found range [{codes.min()}, {codes.max()}]. Check num_clusters and properties_dict.")
+    n_columns = codes.shape[1]
+    offsets = np.arange(n_columns, dtype=np.int64) * num_clusters
+    flat = (codes + offsets).ravel()
+    return np.bincount(flat, minlength=n_columns * num_clusters).reshape(n_columns, num_clusters)
+
+
+def weights_from_counts(counts: np.ndarray) -> np.ndarray:
+    """
+    Converts per-column code counts into rounded percentage weights.
+
+    Uses the same formula as apply_kmeans: round((count / total) * 100) per column,
+    with round-half-to-even like Python's round().
+
+    Args:
+        counts: (n_columns, num_clusters) array of counts.
+
+    Returns:
+        A (n_columns, num_clusters) float64 array of weights. Columns with no rows get 0 everywhere.
+    """
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.round((counts / totals) * 100.0)
+    return np.where(totals == 0, 0.0, weights)
+
+
+def apply_exact(data: pd.DataFrame, prop_columns: List[str], num_clusters: int) -> Tuple[List[Dict[int, float]], Dict[str, pd.Series]]:
+    """
+    Calculates cluster weights by exact frequency counting, without fitting KMeans.
+
+    Since apply_kmeans initializes one-dimensional centers on the integer codes themselves,
+    each cluster is exactly the set of rows holding that code. This engine computes the
+    same weights directly from code counts, for all columns at once.
+
+    Args:
+        data: DataFrame containing the data to analyze. Specified columns must be numeric.
+        prop_columns: List of column names to count.
+        num_clusters: Number of clusters (distinct codes).
+
+    Returns:
+        The same tuple as apply_kmeans:
+        - list_dict_weights: List of dictionaries, each holding cluster weights (percentage) for a specific column.
+        - cluster_labels: Dictionary mapping 'cluster_<column>' to the Series of cluster labels (the codes).
+
+    Raises:
+        KeyError: If a column in prop_columns is not found in the DataFrame.
+        ValueError: If data in a property column is not a valid code.
+    """
+    codes = encode_property_codes(data, prop_columns, num_clusters)
+    weight_matrix = weights_from_counts(count_property_codes(codes, num_clusters))
+
+    list_dict_weights = weights_to_dicts(weight_matrix, prop_columns)
+    cluster_labels: Dict[str, pd.Series] = {
+        f'cluster_{prop}': pd.Series(codes[:, col_index], index=data.index)
+        for col_index, prop in enumerate(prop_columns)
+    }
+    return list_dict_weights, cluster_labels
+
+
+def weights_to_dicts(weight_matrix: np.ndarray, prop_columns: List[str]) -> List[Dict[int, float]]:
+    """
+    Converts a weight matrix into the per-column dictionaries used by combine_weights.
+
+    Args:
+        weight_matrix: (n_columns, num_clusters) array from weights_from_counts.
+        prop_columns: Column names, in the same order as the matrix rows.
+
+    Returns:
+        List of dictionaries mapping every cluster index to its weight, one per column.
+    """
+    list_dict_weights: List[Dict[int, float]] = []
+    for prop, row in zip(prop_columns, weight_matrix):
+        full_weights = {i: float(w) for i, w in enumerate(row)}
+        list_dict_weights.append(full_weights)
+        logging.info(f"Calculated weights for '{prop}': {full_weights}")
+    return list_dict_weights
+
+
+def encode_elements(data: pd.DataFrame, properties_map: Dict[Any, int], prop_columns: List[str],
+                    num_clusters: int, excluded_codes: Iterable[int] = ()) -> Any:
+    """
+    Encodes every element (row) as a sparse binary vector over the property vocabulary.
+
+    Entry (row, code) is 1 when the element carries the property of that code in any property
+    column. Unknown values and excluded codes (e.g. the filler 'n') are left out, so memory is
+    proportional to the number of properties actually present.
+
+    Args:
+        data: DataFrame holding the raw property columns.
+        properties_map: Dictionary mapping original property values to integer codes.
+        prop_columns: List of property column names.
+        num_clusters: Number of distinct codes (vector length).
+        excluded_codes: Codes that are not properties (e.g. the code of the filler).
+
+    Returns:
+        A (n_rows, num_clusters) scipy.sparse CSR float32 matrix.
+    """
+    from scipy import sparse
+
+    codes = encode_properties(data, properties_map, prop_columns, unknown_code=num_clusters)
+    rows = np.repeat(np.arange(codes.shape[0], dtype=np.int64), codes.shape[1])
+    cols = codes.ravel().astype(np.int64)
+    keep = cols != num_clusters
+    for code in excluded_codes:
+        keep &= cols != code
+    matrix = sparse.csr_matrix((np.ones(int(keep.sum()), dtype=np.float32), (rows[keep], cols[keep])),
+                               shape=(codes.shape[0], num_clusters))
+    # Une même propriété dans deux colonnes compte une seule fois
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def iter_element_batches(chunks: Iterable[pd.DataFrame], properties_map: Dict[Any, int], prop_columns: List[str],
+                         num_clusters: int, excluded_codes: Iterable[int] = (),
+                         batch_rows: int = ELEMENT_BATCH_ROWS) -> Iterator[Any]:
+    """
+    Yields CSR batches of batch_rows elements (the last one may be smaller); elements without any property
+    are skipped. Rows are buffered across chunks, so the batches do not depend on --chunksize: a small
+    chunk size, or a first chunk of mostly empty rows, still gives a first batch large enough to fit.
+    """
+    from scipy import sparse
+
+    excluded_codes = list(excluded_codes)
+    pending: List[Any] = []
+    n_pending = 0
+    for chunk in chunks:
+        matrix = encode_elements(chunk, properties_map, prop_columns, num_clusters, excluded_codes)
+        matrix = matrix[matrix.getnnz(axis=1) > 0]
+        if matrix.shape[0] == 0:
+            continue
+        pending.append(matrix)
+        n_pending += matrix.shape[0]
+        if n_pending < batch_rows:
+            continue
+        buffered = sparse.vstack(pending, format='csr') if len(pending) > 1 else pending[0]
+        full_rows = n_pending - n_pending % batch_rows
+        for start in range(0, full_rows, batch_rows):
+            yield buffered[start:start + batch_rows]
+        pending = [buffered[full_rows:]] if full_rows < n_pending else []
+        n_pending -= full_rows
+    if n_pending:
+        yield sparse.vstack(pending, format='csr') if len(pending) > 1 else pending[0]
+
+
+def cluster_elements(make_batches: Callable[[], Iterable[Any]], num_clusters: int,
+                     n_element_clusters: int = ELEMENT_CLUSTERS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters elements with MiniBatchKMeans.partial_fit, then measures every cluster in a second pass.
+
+    Args:
+        make_batches: Returns a fresh iterable of CSR batches (the data is read twice: fit, then assign).
+        num_clusters: Number of property codes (vector length).
+        n_element_clusters: Number of element clusters.
+
+    Returns:
+        A tuple (sizes, prevalence): the number of elements of every cluster, and the
+        (n_element_clusters, num_clusters) share of each cluster's elements carrying each property.
+
+    Raises:
+        ValueError: If there are fewer elements in the first batch than clusters.
+    """
+    # Imported here so that the default exact engine does not require scikit-learn
+    from scipy import sparse
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=n_element_clusters, random_state=KMEANS_RANDOM_STATE, n_init=3)
+    n_elements = 0
+    for batch in make_batches():
+        if n_elements == 0 and batch.shape[0] < n_element_clusters:
+            raise ValueError(f"The first batch holds {batch.shape[0]} elements, "
+                             f"fewer than the {n_element_clusters} requested clusters.")
+        model.partial_fit(batch)
+        n_elements += batch.shape[0]
+    if n_elements == 0:
+        raise ValueError("No element carries any property.")
+
+    # Les centres de MiniBatchKMeans sont des moyennes glissantes : tailles et centres exacts recalculés
+    sizes = np.zeros(n_element_clusters, dtype=np.int64)
+    sums = np.zeros((n_element_clusters, num_clusters), dtype=np.float64)
+    for batch in make_batches():
+        labels = model.predict(batch)
+        sizes += np.bincount(labels, minlength=n_element_clusters)
+        membership = sparse.csr_matrix((np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                                       shape=(n_element_clusters, len(labels)))
+        sums += (membership @ batch).toarray()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prevalence = np.where(sizes[:, None] > 0, sums / sizes[:, None], 0.0)
+    logging.info(f"Clustered {n_elements} elements into {n_element_clusters} clusters of sizes {sizes.tolist()}.")
+    return sizes, prevalence
+
+
+def element_weights(sizes: np.ndarray, prevalence: np.ndarray, properties_map: Optional[Dict[str, int]] = None,
+                    threshold: float = ELEMENT_CENTROID_THRESHOLD) -> Dict[int, float]:
+    """
+    Derives property weights from element clusters.
+
+    A property defines a cluster when its prevalence in the cluster centroid reaches threshold.
+    Its weight is the percentage of elements that belong to clusters it defines: properties
+    that characterize large groups of similar elements weigh most, while a property frequent
+    overall but scattered across heterogeneous elements weighs less than its raw frequency.
+
+    Args:
+        sizes: Number of elements of every cluster, from cluster_elements.
+        prevalence: Share of each cluster's elements carrying each property, from cluster_elements.
+        properties_map: Property value -> code, only used to log the clusters by property name.
+        threshold: Minimum prevalence for a property to define a cluster.
+
+    Returns:
+        Dictionary mapping every code to its weight (0-100), in the format of combine_weights.
+    """
+    names = {code: value for value, code in (properties_map or {}).items()}
+    defining = prevalence >= threshold
+    weights = np.round((sizes[:, None] * defining).sum(axis=0) / max(int(sizes.sum()), 1) * 100.0)
+    for cluster, (size, row) in enumerate(zip(sizes, prevalence)):
+        top = np.argsort(-row)[:3]
+        logging.info(f"Cluster {cluster} ({size} elements): "
+                     + ", ".join(f"{names.get(code, code)} in {row[code]:.0%}" for code in top if row[code] > 0))
+    return {code: float(weight) for code, weight in enumerate(weights)}
+
+
+def accumulate_chunk_counts(chunks: Iterable[pd.DataFrame], properties_map: Dict[Any, int],
+                            prop_columns: List[str], num_clusters: int) -> np.ndarray:
+    """
+    Accumulates per-column code counts over a stream of DataFrame chunks.
+
+    Each chunk is encoded and counted independently, then discarded, so memory use is
+    bounded by the chunk size. Since the exact weights only depend on the counts, the
+    result is identical to counting the whole file at once.
+
+    Args:
+        chunks: Iterable of DataFrames holding (at least) the property columns, e.g. from load_data_chunks.
+        properties_map: Dictionary mapping original property values to integer codes.
+        prop_columns: List of property column names.
+        num_clusters: Number of distinct codes.
+
+    Returns:
+        A (n_columns, num_clusters + 1) int64 array of running totals, the last bin holding unknown values.
+
+    Raises:
+        KeyError: If a column in prop_columns is missing from a chunk.
+    """
+    totals = np.zeros((len(prop_columns), num_clusters + 1), dtype=np.int64)
+    n_rows = 0
+    for chunk in chunks:
+        totals += count_properties(chunk, properties_map, prop_columns, num_clusters)
+        n_rows += len(chunk)
+    logging.info(f"Accumulated code counts over {n_rows} rows.")
+    return totals
+
+
+def factorize_segments(data: pd.DataFrame, segment_columns: List[str]) -> Tuple[np.ndarray, List[Tuple[str, ...]]]:
+    """
+    Assigns a dense segment id to every row from the values of the segment columns.
+
+    Args:
+        data: DataFrame holding the segment columns (e.g. Langage, Tag).
+        segment_columns: Columns defining a segment; missing values become MISSING_SEGMENT.
+
+    Returns:
+        The (n_rows,) int64 array of segment ids and the segment keys (one tuple of values per id, sorted).
+
+    Raises:
+        KeyError: If a segment column is not found in the DataFrame.
+    """
+    for column in segment_columns:
+        if column not in data.columns:
+            raise KeyError(f"Segment column '{column}' not found in DataFrame.")
+    values = data[segment_columns].astype(object).fillna(MISSING_SEGMENT).astype(str)
+    segment_ids, keys = pd.factorize(pd.MultiIndex.from_frame(values), sort=True)
+    return segment_ids.astype(np.int64), list(keys)
+
+
+def count_segments(data: pd.DataFrame, properties_map: Dict[Any, int], prop_columns: List[str],
+                   segment_columns: List[str], num_clusters: int) -> Dict[Tuple[str, ...], np.ndarray]:
+    """
+    Counts every property code of every column for every segment with a single bincount.
+
+    Each (segment, column) pair is shifted into its own block of num_clusters + 1 bins, like
+    count_property_codes does for columns, so all segments are counted in one vectorized call.
+
+    Args:
+        data: DataFrame holding the raw property columns and the segment columns.
+        properties_map: Dictionary mapping original property values to integer codes.
+        prop_columns: List of property column names.
+        segment_columns: Columns defining a segment (e.g. ['Langage'] or ['Langage', 'Tag']).
+        num_clusters: Number of distinct codes; code num_clusters is reserved for unknown values.
+
+    Returns:
+        A dictionary mapping each segment key to its (n_columns, num_clusters + 1) int64 count array.
+    """
+    codes = encode_properties(data, properties_map, prop_columns, unknown_code=num_clusters).astype(np.int64)
+    segment_ids, keys = factorize_segments(data, segment_columns)
+    n_bins, n_columns = num_clusters + 1, len(prop_columns)
+    blocks = segment_ids[:, None] * n_columns + np.arange(n_columns, dtype=np.int64)
+    flat = (blocks * n_bins + codes).ravel()
+    counts = np.bincount(flat, minlength=len(keys) * n_columns * n_bins).reshape(len(keys), n_columns, n_bins)
+    return {key: counts[i] for i, key in enumerate(keys)}
+
+
+def accumulate_segment_counts(chunks: Iterable[pd.DataFrame], properties_map: Dict[Any, int],
+                              prop_columns: List[str], segment_columns: List[str],
+                              num_clusters: int) -> Dict[Tuple[str, ...], np.ndarray]:
+    """
+    Accumulates count_segments over a stream of DataFrame chunks (segments are merged by key).
+    """
+    totals: Dict[Tuple[str, ...], np.ndarray] = {}
+    n_rows = 0
+    for chunk in chunks:
+        for key, counts in count_segments(chunk, properties_map, prop_columns, segment_columns, num_clusters).items():
+            if key in totals:
+                totals[key] += counts
+            else:
+                totals[key] = counts.copy()
+        n_rows += len(chunk)
+    logging.info(f"Counted {len(totals)} segments of {segment_columns} over {n_rows} rows.")
+    return dict(sorted(totals.items()))
+
+
+def segment_file_path(output_file_path: str, segment_columns: List[str], key: Tuple[str, ...]) -> str:
+    """
+    Returns the properties file of one segment, next to the global one,
+    e.g. weights/x.Langage-Angular-JS.Tag-div.properties.
+    """
+    stem, extension = os.path.splitext(output_file_path)
+    parts = [f"{column}-{re.sub(r'[^A-Za-z0-9_-]+', '-', value).strip('-') or MISSING_SEGMENT}"
+             for column, value in zip(segment_columns, key)]
+    return f"{stem}.{'.'.join(parts)}{extension}"
+
+
+def segment_file_paths(output_file_path: str, segment_columns: List[str],
+                       keys: Iterable[Tuple[str, ...]]) -> Dict[Tuple[str, ...], str]:
+    """
+    Returns the properties file of every segment (see segment_file_path).
+
+    Distinct values can give the same file name once sanitised ('Angular/JS' and 'Angular JS'), or names
+    that differ only by case (the same file on a case-insensitive file system): every segment of such a
+    collision gets a short hash of its raw values appended, so that no segment overwrites another.
+    """
+    paths = {key: segment_file_path(output_file_path, segment_columns, key) for key in keys}
+    by_name: Dict[str, List[Tuple[str, ...]]] = {}
+    for key, path in paths.items():
+        by_name.setdefault(path.lower(), []).append(key)
+    for colliding in by_name.values():
+        if len(colliding) < 2:
+            continue
+        for key in colliding:
+            digest = hashlib.sha256("\x1f".join(map(str, key)).encode("utf-8")).hexdigest()[:8]
+            stem, extension = os.path.splitext(paths[key])
+            paths[key] = f"{stem}.{digest}{extension}"
+        logging.warning(f"Segments {colliding} map to the same file name; a hash of their values is appended.")
+    return paths
+
+
+def write_segment_files(segment_counts: Dict[Tuple[str, ...], np.ndarray], properties_map: Dict[str, int],
+                        prop_columns: List[str], segment_columns: List[str], num_clusters: int,
+                        output_file_path: str, key_to_exclude: Optional[str] = None) -> List[str]:
+    """
+    Computes the weights of every segment and writes one properties file per segment.
+
+    Returns:
+        The paths of the written files.
+    """
+    paths = []
+    segment_paths = segment_file_paths(output_file_path, segment_columns, segment_counts)
+    for key, counts in segment_counts.items():
+        logging.info(f"Segment {dict(zip(segment_columns, key))}: {int(counts[0].sum()) if len(counts) else 0} rows.")
+        list_weights = weights_to_dicts(weights_from_counts(trim_unknown(counts, num_clusters)), prop_columns)
+        path = segment_paths[key]
+        write_to_properties_file(combine_weights(list_weights), properties_map, path, key_to_exclude)
+        paths.append(path)
+    return paths
+
+
+def discover_value_counts(chunks: Iterable[pd.DataFrame], prop_columns: List[str],
+                          filler: str) -> List[Counter[str]]:
+    """
+    Counts every distinct property value of every column in a single pass over a stream of chunks.
+
+    Missing values (NaN) are counted as the filler value. Reading the chunks with a 'category'
+    dtype keeps the per-chunk work proportional to the number of distinct values.
+
+    Args:
+        chunks: Iterable of DataFrames holding (at least) the property columns.
+        prop_columns: List of property column names.
+        filler: Value standing for "no property" (e.g. 'n').
+
+    Returns:
+        One Counter of value -> occurrences per column, in prop_columns order.
+
+    Raises:
+        KeyError: If a column in prop_columns is missing from a chunk.
+    """
+    value_counts: List[Counter[str]] = [Counter() for _ in prop_columns]
+    n_rows = 0
+    for chunk in chunks:
+        for col_counts, prop in zip(value_counts, prop_columns):
+            if prop not in chunk.columns:
+                raise KeyError(f"Property column '{prop}' not found in DataFrame.")
+            for value, count in chunk[prop].value_counts(dropna=False, sort=False).items():
+                if count:
+                    col_counts[filler if pd.isna(value) else str(value)] += int(count)
+        n_rows += len(chunk)
+    n_values = len(set().union(*value_counts)) if value_counts else 0
+    logging.info(f"Discovered {n_values} distinct property values over {n_rows} rows.")
+    return value_counts
+
+
+def build_codebook(value_counts: List[Counter[str]], filler: str,
+                   previous: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Assigns dense integer codes to the discovered property values.
+
+    Codes of a previous codebook are kept so that codes stay stable across runs; new values
+    get the next free codes, most frequent first (ties broken by name). The filler gets code 0.
+
+    Args:
+        value_counts: Per-column value counts from discover_value_counts.
+        filler: Value standing for "no property", excluded from the output file.
+        previous: Codebook of an earlier run, if any.
+
+    Returns:
+        A dictionary mapping every property value to its code, codes in [0, len(codebook)).
+    """
+    codebook: Dict[str, int] = dict(previous) if previous else {}
+    codebook.setdefault(filler, 0)
+    totals: Counter[str] = sum(value_counts, Counter())
+    new_values = sorted((v for v in totals if v not in codebook), key=lambda v: (-totals[v], v))
+    next_code = max(codebook.values()) + 1
+    for offset, value in enumerate(new_values):
+        codebook[value] = next_code + offset
+    if sorted(codebook.values()) != list(range(len(codebook))):
+        raise ValueError("Codebook codes must be distinct and dense (0..n-1); delete the codebook file to rebuild it.")
+    logging.info(f"Codebook: {len(codebook)} codes ({len(new_values)} new).")
+    return codebook
+
+
+def counts_from_value_counts(value_counts: List[Counter[str]], codebook: Dict[str, int]) -> np.ndarray:
+    """
+    Builds the (n_columns, len(codebook)) count matrix used by weights_from_counts from per-column value counts.
+    """
+    counts = np.zeros((len(value_counts), len(codebook)), dtype=np.int64)
+    for col_index, col_counts in enumerate(value_counts):
+        for value, count in col_counts.items():
+            counts[col_index, codebook[value]] += count
+    return counts
+
+
+def default_codebook_path(output_file_path: str) -> str:
+    """
+    Returns the codebook path stored next to the properties file (e.g. weights/x.codebook.json).
+    """
+    return os.path.splitext(output_file_path)[0] + CODEBOOK_SUFFIX
+
+
+def load_codebook(path: str) -> Optional[Dict[str, int]]:
+    """
+    Loads a codebook written by save_codebook.
+
+    Returns:
+        The value -> code dictionary, or None if the file is missing or unreadable (a new one is then built).
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable codebook {path}: {e}")
+        return None
+    if not isinstance(payload, dict) or payload.get('version') != CODEBOOK_VERSION:
+        logging.warning(f"Ignoring codebook {path} with an unsupported format.")
+        return None
+    return {str(k): int(v) for k, v in payload['codes'].items()}
+
+
+def save_codebook(path: str, codebook: Dict[str, int], filler: str) -> None:
+    """
+    Writes the codebook atomically (temporary file, then rename), codes in increasing order.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    payload = {
+        'version': CODEBOOK_VERSION,
+        'filler': filler,
+        'codes': dict(sorted(codebook.items(), key=lambda item: item[1])),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    logging.info(f"Codebook written to {path}")
+
+
+def write_weight_intervals(counts: np.ndarray, final_weights: Dict[int, float], properties_map: Dict[str, int],
+                           output_file_path: str, n_resamples: int, confidence: float,
+                           key_to_exclude: Optional[str] = None) -> str:
+    """
+    Writes bootstrap confidence intervals of the combined weights next to the properties file.
+
+    Each column's count vector is resampled with multinomial draws and normalized like the
+    written weights (per-column percentages summed over columns), so the cost depends on the
+    vocabulary size only, not on the number of rows.
+
+    Args:
+        counts: (n_columns, n_codes) count matrix the weights were computed from.
+        final_weights: Combined weights by code, as written to the properties file.
+        properties_map: Dictionary mapping output keys to codes.
+        output_file_path: Path of the properties file; the intervals go to this path + '.ci.json'.
+        n_resamples: Number of multinomial resamples.
+        confidence: Central coverage of the intervals.
+        key_to_exclude: Optional key left out, as in write_to_properties_file.
+
+    Returns:
+        The path of the intervals file.
+    """
+    from bootstrap import INTERVALS_SUFFIX, bootstrap_intervals, percentage_weights, write_intervals
+
+    intervals = bootstrap_intervals(counts, percentage_weights, n_resamples, confidence)
+    key_indices = {key: code for key, code in properties_map.items() if key != key_to_exclude and code < counts.shape[1]}
+    weights = {key: int(final_weights.get(code, 0)) for key, code in key_indices.items()}
+    intervals_path = output_file_path + INTERVALS_SUFFIX
+    write_intervals(intervals_path, key_indices, weights, intervals, n_resamples, confidence)
+    logging.info(f"Bootstrap intervals ({n_resamples} resamples, {confidence:.0%}) written to {intervals_path}")
+    return intervals_path
+
+
+def compute_weights(data: pd.DataFrame, prop_columns: List[str], num_clusters: int,
+                    engine: str = ENGINE_EXACT) -> Tuple[List[Dict[int, float]], Dict[str, pd.Series]]:
+    """
+    Calculates per-column cluster weights with the selected engine.
+
+    Args:
+        data: DataFrame whose property columns have been mapped to integers.
+        prop_columns: List of property column names.
+        num_clusters: Number of clusters (distinct codes).
+        engine: ENGINE_EXACT (vectorized counting) or ENGINE_KMEANS (per-column sklearn KMeans).
+
+    Returns:
+        The (list_dict_weights, cluster_labels) tuple returned by apply_exact / apply_kmeans.
+
+    Raises:
+        ValueError: If the engine is unknown, or on invalid data (see apply_exact / apply_kmeans).
+    """
+    if engine == ENGINE_EXACT:
+        return apply_exact(data, prop_columns, num_clusters)
+    if engine == ENGINE_KMEANS:
+        return apply_kmeans(data, prop_columns, num_clusters)
+    raise ValueError(f"Unknown engine '{engine}'. Expected one of {ENGINES}.")
+
+
+def check_engines(data: pd.DataFrame, prop_columns: List[str], num_clusters: int) -> bool:
+    """
+    Runs both engines on the same data and checks that they produce identical weights.
+
+    Args:
+        data: DataFrame whose property columns have been mapped to integers.
+        prop_columns: List of property column names.
+        num_clusters: Number of clusters (distinct codes).
+
+    Returns:
+        True if per-column and combined weights are identical, False otherwise (differences are logged).
+    """
+    exact_weights, _ = apply_exact(data, prop_columns, num_clusters)
+    kmeans_weights, _ = apply_kmeans(data, prop_columns, num_clusters)
+
+    identical = True
+    for prop, exact_w, kmeans_w in zip(prop_columns, exact_weights, kmeans_weights):
+        if exact_w != kmeans_w:
+            identical = False
+            logging.error(f"Engines disagree on '{prop}': exact={exact_w} kmeans={kmeans_w}")
+    if combine_weights(exact_weights) != combine_weights(kmeans_weights):
+        identical = False
+        logging.error("Engines disagree on combined weights.")
+
+    if identical:
+        logging.info(f"Engines '{ENGINE_EXACT}' and '{ENGINE_KMEANS}' produce identical weights.")
+    return identical
+
+
 def combine_weights(list_weights: List[Dict[int, float]]) -> OrderedDict[int, float]:
     """
     Combines cluster weights from multiple dictionaries into a single sorted dictionary.
@@ -169,6 +936,8 @@ def write_to_properties_file(
     """
     Writes the final weights to a properties file using a provided mapping.
 
+    The file is written atomically (temporary file, then rename).
+
     Args:
         final_weights: Dictionary containing the final combined weights (cluster_index -> weight).
         output_map: Dictionary mapping the desired output keys (e.g., original property values)
@@ -205,38 +974,101 @@ def write_to_properties_file(
             logging.error(f"Failed to create output directory '{output_dir}': {e}")
             raise IOError(f"Cannot create output directory '{output_dir}'") from e
 
-    # Write to the file
+    # Write to a temporary file, then rename it so readers never see a partial file
+    tmp_path = f"{file_path}.tmp"
     try:
-        with open(file_path, 'w') as file:
+        with open(tmp_path, 'w') as file:
             for key, value in final_dict_poids.items():
                 # Convertir la valeur en entier avant de l'écrire
                 file.write(f"{key}={int(value)}\n")
+        os.replace(tmp_path, file_path)
         logging.info(f"Successfully wrote weights to {file_path}")
     except IOError as e:
         logging.error(f"Failed to write to properties file '{file_path}': {e}")
         raise IOError(f"Cannot write to file '{file_path}'") from e
 
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses command line options for the K-means workflow.
+
+    Args:
+        argv: Optional list of arguments (defaults to sys.argv[1:]).
+
+    Returns:
+        The parsed arguments namespace.
+    """
+    parser = argparse.ArgumentParser(description="Compute property weights from the K-means configuration.")
+    parser.add_argument("--config", default=None, metavar="PATH",
+                        help="Configuration file (default: config_kmeans.txt); relative paths are resolved "
+                             "from the configs/ directory.")
+    parser.add_argument("--engine", choices=ENGINES, default=None,
+                        help="Weight computation engine (default: 'engine' from the config, else 'exact').")
+    parser.add_argument("--element-clusters", type=int, default=None,
+                        help=f"Number of element clusters of the '{ENGINE_ELEMENTS}' engine "
+                             f"(default: 'element_clusters' from the config, else {ELEMENT_CLUSTERS}).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Stream the CSV in chunks of this many rows (exact and elements engines; "
+                             "default: 'chunksize' from the config, 0 loads the whole file).")
+    parser.add_argument("--data-cache", action="store_true",
+                        help="Keep a binary columnar cache of the parsed CSV (.cache/parsed next to the input) "
+                             "and memory-map it on later runs instead of re-parsing.")
+    parser.add_argument("--vocabulary", choices=VOCABULARIES, default=None,
+                        help="Property vocabulary: 'config' uses properties_dict and num_clusters, 'discover' finds "
+                             "every value in the data in one pass and persists the codes in a codebook "
+                             "(default: 'vocabulary' from the config, else 'config').")
+    parser.add_argument("--codebook", default=None, metavar="PATH",
+                        help="Codebook file for --vocabulary discover (default: 'codebook_file' from the config, "
+                             "else next to the output file with a .codebook.json extension).")
+    parser.add_argument("--segment-by", nargs="+", default=None, metavar="COLUMN",
+                        help="Also write one properties file per segment of these columns (e.g. Langage Tag), "
+                             "counted in the same pass (default: [segment_by] columns from the config).")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="Also write confidence intervals of the weights, from N multinomial resamples of the "
+                             "counts, to the output file + '.ci.json' (exact engine; default: 0, disabled).")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Coverage of the --bootstrap intervals (default: 0.95).")
+    parser.add_argument("--check-engines", action="store_true",
+                        help="Run both engines on the input and check that they produce the same weights.")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="Write per-stage timing and memory metrics to this JSON file "
+                             "(default: $SELECTOR_WEIGHT_METRICS, disabled if unset).")
+    parser.add_argument("--profile", action="store_true",
+                        help="With --metrics, also dump a cProfile of the slowest stage to PATH.prof.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None, data: Optional[pd.DataFrame] = None) -> int:
     """
     Main function to execute the K-means clustering workflow.
+
+    Args:
+        argv: Optional list of command line arguments (defaults to sys.argv[1:]).
+        data: Optional already loaded DataFrame (e.g. shared with the other approaches by
+              selector_weight.py); when given, file_path is not read.
+
+    Returns:
+        The exit status: 0 if the weights were written, 1 if an error was logged.
     """
-    config_filename = 'config_kmeans.txt'
+    args = parse_args(argv)
+    config_filename = args.config or 'config_kmeans.txt'
     weights_subdir = 'weights'
     key_to_exclude_from_output = 'n' # Make exclusion explicit
+    recorder = recorder_from_env("kmeans_clustring_approch1", args.metrics, args.profile)
 
     try:
         # Load configuration
-        config_data = load_config(script_dir, config_filename)
+        with recorder.stage("load_config"):
+            config_data = load_config(script_dir, config_filename)
 
         # Check if configuration loading was successful
         if config_data is None:
             logging.error("Failed to load configuration. Exiting.")
-            return
+            return 1
         # Check if the loaded config is the expected type for this script
         if not isinstance(config_data, dict) or 'num_clusters' not in config_data: # Basic check for KmeansConfig structure
             logging.error(f"Loaded configuration is not the expected K-Means config format. Exiting.")
-            return
+            return 1
 
         # Extract values from the config dictionary
         file_path: str = config_data['file_path']
@@ -245,35 +1077,198 @@ def main():
         prop_columns: List[str] = config_data['prop_columns']
         num_clusters: int = config_data['num_clusters']
         output_filename: str = config_data['output_file']
+        engine: str = args.engine or config_data.get('engine', ENGINE_EXACT)
+        chunksize: int = args.chunksize if args.chunksize is not None else config_data.get('chunksize', 0)
+        element_clusters: int = args.element_clusters or config_data.get('element_clusters', ELEMENT_CLUSTERS)
+        vocabulary: str = args.vocabulary or config_data.get('vocabulary', VOCABULARY_CONFIG)
+        segment_columns: List[str] = args.segment_by if args.segment_by is not None else config_data.get('segment_by', [])
+        output_file_path = os.path.join(script_dir, weights_subdir, output_filename)
         logging.info("Configuration loaded successfully.")
         logging.info(f"Input file: {file_path}")
         logging.info(f"Property columns for K-means: {prop_columns}")
-        logging.info(f"Number of clusters: {num_clusters}")
+        if vocabulary == VOCABULARY_DISCOVER:
+            logging.info("Property vocabulary: discovered from the data (properties_dict and num_clusters are ignored).")
+        else:
+            logging.info(f"Number of clusters: {num_clusters}")
+        logging.info(f"Engine: {engine}")
+        if engine == ENGINE_ELEMENTS:
+            logging.info(f"Element clusters: {element_clusters}")
+        if chunksize > 0:
+            logging.info(f"Streaming input in chunks of {chunksize} rows.")
+        if segment_columns:
+            logging.info(f"Segmented weights by: {segment_columns}")
+            missing = [column for column in segment_columns if column not in columns_csv]
+            if missing:
+                logging.error(f"Segment columns {missing} are not listed in columns_csv. Exiting.")
+                return 1
+            if engine != ENGINE_EXACT or args.check_engines:
+                logging.error(f"Segmented weights are only supported by the '{ENGINE_EXACT}' engine. Exiting.")
+                return 1
         logging.info(f"Output file: {output_filename}")
 
-        # Load data
-        data = load_data(file_path, usecols=columns_csv)
-        if data is None:
-            logging.error(f"Failed to load data from {file_path}. Exiting.")
-            return
-        logging.info(f"Data loaded successfully. Shape: {data.shape}")
+        preloaded = data
+        if preloaded is not None and chunksize > 0:
+            logging.info("Using the preloaded DataFrame; chunked streaming is not needed.")
+            chunksize = 0
 
-        # Preprocess properties (map to integers)
-        data_processed = preprocess_properties(data, properties_map, prop_columns)
-        logging.info("Property preprocessing completed.")
+        discovered_counts = None
+        counts: Optional[np.ndarray] = None  # Count matrix of the count-based paths, for --bootstrap
+        if vocabulary == VOCABULARY_DISCOVER:
+            # One pass over the property columns: distinct values and their per-column counts
+            codebook_path = args.codebook or config_data.get('codebook_file') or default_codebook_path(output_file_path)
+            category_dtypes = {prop: 'category' for prop in prop_columns}
+            with recorder.stage("discover_vocabulary") as stage:
+                if preloaded is not None:
+                    chunks = [preloaded[prop_columns]]
+                elif chunksize > 0:
+                    chunks = load_data_chunks(file_path, usecols=prop_columns, chunksize=chunksize,
+                                              dtype=category_dtypes)
+                else:
+                    data = load_data(file_path, usecols=prop_columns, dtype=category_dtypes,
+                                     use_cache=args.data_cache)
+                    if data is None:
+                        logging.error(f"Failed to load data from {file_path}. Exiting.")
+                        return 1
+                    chunks = [data]
+                value_counts = discover_value_counts(chunks, prop_columns, key_to_exclude_from_output)
+                properties_map = build_codebook(value_counts, key_to_exclude_from_output, load_codebook(codebook_path))
+                num_clusters = len(properties_map)
+                save_codebook(codebook_path, properties_map, key_to_exclude_from_output)
+                stage["items"] = int(sum(value_counts[0].values())) if value_counts else 0
+            if engine == ENGINE_EXACT and not args.check_engines and not segment_columns:
+                discovered_counts = counts_from_value_counts(value_counts, properties_map)
 
-        # Apply K-means and calculate weights
-        list_weights, cluster_labels_dict = apply_kmeans(data_processed, prop_columns, num_clusters)
+        prop_dtypes = {prop: property_dtype(properties_map) for prop in prop_columns}
+        if segment_columns:
+            # One grouped count gives every segment; the global counts are their sum
+            usecols = segment_columns + [prop for prop in prop_columns if prop not in segment_columns]
+            segment_dtypes = {**{column: 'category' for column in segment_columns}, **prop_dtypes}
+            with recorder.stage("count_segments") as stage:
+                if preloaded is not None:
+                    chunks = [preloaded[usecols]]
+                elif chunksize > 0:
+                    chunks = load_data_chunks(file_path, usecols=usecols, chunksize=chunksize, dtype=segment_dtypes)
+                else:
+                    data = load_data(file_path, usecols=usecols, dtype=segment_dtypes, use_cache=args.data_cache)
+                    if data is None:
+                        logging.error(f"Failed to load data from {file_path}. Exiting.")
+                        return 1
+                    chunks = [data]
+                segment_counts = accumulate_segment_counts(chunks, properties_map, prop_columns,
+                                                           segment_columns, num_clusters)
+                counts = sum(segment_counts.values(), np.zeros((len(prop_columns), num_clusters + 1), dtype=np.int64))
+                stage["items"] = int(counts[0].sum()) if len(prop_columns) else 0
+            with recorder.stage("write_segments") as stage:
+                write_segment_files(segment_counts, properties_map, prop_columns, segment_columns, num_clusters,
+                                    output_file_path, key_to_exclude_from_output)
+                stage["items"] = len(segment_counts)
+            with recorder.stage("compute_weights"):
+                list_weights = weights_to_dicts(weights_from_counts(trim_unknown(counts, num_clusters)), prop_columns)
+        elif discovered_counts is not None:
+            # The discovery pass already counted every value: no second read of the input
+            counts = discovered_counts
+            with recorder.stage("compute_weights"):
+                list_weights = weights_to_dicts(weights_from_counts(discovered_counts), prop_columns)
+        elif engine == ENGINE_ELEMENTS and not args.check_engines:
+            # Sparse one-hot rows, streamed twice (fit, then cluster sizes and centroids)
+            if preloaded is None and chunksize <= 0:
+                with recorder.stage("load_data") as stage:
+                    data = load_data(file_path, usecols=prop_columns, dtype=prop_dtypes, use_cache=args.data_cache)
+                    stage["items"] = len(data) if data is not None else 0
+                if data is None:
+                    logging.error(f"Failed to load data from {file_path}. Exiting.")
+                    return 1
+                preloaded = data
 
-        # Combine weights from different properties
-        final_weights = combine_weights(list_weights)
+            def make_batches():
+                if preloaded is not None:
+                    chunks = [preloaded[prop_columns]]
+                else:
+                    chunks = load_data_chunks(file_path, usecols=prop_columns, chunksize=chunksize, dtype=prop_dtypes)
+                excluded = [code for key, code in properties_map.items() if key == key_to_exclude_from_output]
+                return iter_element_batches(chunks, properties_map, prop_columns, num_clusters, excluded)
 
-        # Define the output path correctly
-        output_file_path = os.path.join(script_dir, weights_subdir, output_filename)
+            with recorder.stage("cluster_elements") as stage:
+                sizes, prevalence = cluster_elements(make_batches, num_clusters, element_clusters)
+                stage["items"] = int(sizes.sum())
+            with recorder.stage("compute_weights"):
+                list_weights = [element_weights(sizes, prevalence, properties_map)]
+        elif chunksize > 0:
+            if engine != ENGINE_EXACT or args.check_engines:
+                logging.error(f"Chunked streaming is only supported by the '{ENGINE_EXACT}' engine. Exiting.")
+                return 1
+            # Stream only the property columns and keep running counts
+            with recorder.stage("stream_counts") as stage:
+                chunks = load_data_chunks(file_path, usecols=prop_columns, chunksize=chunksize, dtype=prop_dtypes)
+                counts = accumulate_chunk_counts(chunks, properties_map, prop_columns, num_clusters)
+                stage["items"] = int(counts[0].sum()) if len(prop_columns) else 0
+            with recorder.stage("compute_weights"):
+                list_weights = weights_to_dicts(weights_from_counts(trim_unknown(counts, num_clusters)), prop_columns)
+        elif engine == ENGINE_EXACT and not args.check_engines:
+            # Read only the property columns, parsed directly as categorical codes
+            with recorder.stage("load_data") as stage:
+                if preloaded is not None:
+                    data = preloaded[prop_columns]
+                else:
+                    data = load_data(file_path, usecols=prop_columns, dtype=prop_dtypes, use_cache=args.data_cache)
+                stage["items"] = len(data) if data is not None else 0
+            if data is None:
+                logging.error(f"Failed to load data from {file_path}. Exiting.")
+                return 1
+            logging.info(f"Data loaded successfully. Shape: {data.shape}")
+            with recorder.stage("count_properties") as stage:
+                counts = count_properties(data, properties_map, prop_columns, num_clusters)
+                stage["items"] = len(data)
+            with recorder.stage("compute_weights"):
+                list_weights = weights_to_dicts(weights_from_counts(trim_unknown(counts, num_clusters)), prop_columns)
+        else:
+            # Load data
+            with recorder.stage("load_data") as stage:
+                if preloaded is not None:
+                    data = preloaded[columns_csv]
+                else:
+                    data = load_data(file_path, usecols=columns_csv, use_cache=args.data_cache)
+                stage["items"] = len(data) if data is not None else 0
+            if data is None:
+                logging.error(f"Failed to load data from {file_path}. Exiting.")
+                return 1
+            logging.info(f"Data loaded successfully. Shape: {data.shape}")
+
+            # Preprocess properties (map to integers)
+            with recorder.stage("preprocess_properties") as stage:
+                data_processed = preprocess_properties(data, properties_map, prop_columns)
+                stage["items"] = len(data)
+            logging.info("Property preprocessing completed.")
+
+            if args.check_engines:
+                if not check_engines(data_processed, prop_columns, num_clusters):
+                    logging.error("Engine check failed. Exiting without writing weights.")
+                    return 1
+                return 0
+
+            # Apply the selected engine and calculate weights
+            with recorder.stage(f"compute_weights_{engine}") as stage:
+                list_weights, cluster_labels_dict = compute_weights(data_processed, prop_columns, num_clusters, engine)
+                stage["items"] = len(data_processed)
+
+        # Combine weights from different properties
+        with recorder.stage("combine_weights"):
+            final_weights = combine_weights(list_weights)
 
         # Write weights to the properties file
         # We use properties_map here assuming it maps output keys (like 'A', 'B') to cluster indices (0, 1)
-        write_to_properties_file(final_weights, properties_map, output_file_path, key_to_exclude_from_output)
+        with recorder.stage("write_to_properties_file"):
+            write_to_properties_file(final_weights, properties_map, output_file_path, key_to_exclude_from_output)
+
+        if args.bootstrap > 0:
+            if counts is None:
+                logging.warning(f"Bootstrap intervals need the count-based '{ENGINE_EXACT}' engine; skipped.")
+            else:
+                with recorder.stage("bootstrap_intervals") as stage:
+                    write_weight_intervals(trim_unknown(counts, num_clusters), final_weights, properties_map,
+                                           output_file_path, args.bootstrap, args.confidence,
+                                           key_to_exclude_from_output)
+                    stage["items"] = args.bootstrap * int(counts.size)
 
         # Optional: Add cluster labels back to the original DataFrame for inspection
         # data_with_clusters = data.join(pd.DataFrame(cluster_labels_dict))
@@ -285,20 +1280,29 @@ def main():
         logging.info(f"Combined Final Weights (Cluster Index: Weight): {final_weights}")
         logging.info(f"Output written to: {output_file_path}")
         logging.info("Script finished successfully.")
+        return 0
 
     except FileNotFoundError as e:
         logging.error(f"Configuration or data file not found: {e}")
+        return 1
     except TypeError as e:
         logging.error(f"Type error during configuration processing or execution: {e}. Check config structure and usage.")
+        return 1
     except KeyError as e:
         logging.error(f"Data processing error: Missing key {e}")
+        return 1
     except ValueError as e:
         logging.error(f"Data processing error: Invalid value or data type - {e}")
+        return 1
     except IOError as e:
         logging.error(f"File input/output error: {e}")
+        return 1
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}", exc_info=True) # Log traceback
+        return 1
+    finally:
+        recorder.finish()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,24 +1,63 @@
-import openai
 import pandas as pd
 import configparser
 import os
-from utils import load_config,load_data
+import random
+import sys
+import asyncio
+import argparse
+from collections import Counter
+from utils import load_config,load_data,load_data_chunks,count_property_values
+from response_cache import ResponseCache, make_cache_key, DEFAULT_MAX_BYTES, DEFAULT_MAX_AGE_SECONDS
 # Lire la clé API depuis un fichier
 def read_api_key(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read().strip()
 
-# Lire la clé API depuis le fichier
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_file_api_key = os.path.join(script_dir, 'configs', 'api_key_openai.txt')
-api_key = read_api_key(config_file_api_key)
 
-# Configurer OpenAI avec la clé API lue
-openai.api_key = api_key
+def get_openai():
+    # Import et lecture de la clé API au premier appel seulement :
+    # importer ce module (ou utiliser le client stub / le cache) ne nécessite ni openai ni la clé.
+    import openai
+    if openai.api_key is None:
+        # Configurer OpenAI avec la clé API lue
+        openai.api_key = read_api_key(config_file_api_key)
+    return openai
 
-def get_response_gpt(data):
+GPT_MODEL = "gpt-4"
+GPT_MAX_TOKENS = 500
+
+# Mode par lots : taille maximale estimée (en tokens) des données envoyées dans une requête
+DEFAULT_BATCH_TOKENS = 3000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0  # secondes, doublé à chaque nouvelle tentative
+CHARS_PER_TOKEN = 4     # estimation grossière sans tokenizer
+
+# Cache disque des réponses (clé : serveur, modèle, gabarit du prompt, propriétés et données)
+DEFAULT_CACHE_DIR = os.path.join(script_dir, '.cache', 'gpt_responses')
+DEFAULT_BACKEND = "openai"  # Identité du client openai par défaut (sans --backend ni --base-url)
+
+# Propriétés à pondérer si le config n'en liste pas ([properties] list=...)
+PROPERTIES = ["data-focus", "label", "id", "profil-list", "aria-label", "class",
+              "text", "name", "for", "grid", "index"]
+
+# Encodage des données dans le prompt : lignes brutes, ou résumé des occurrences par propriété
+ENCODING_ROWS = "rows"
+ENCODING_SUMMARY = "summary"
+ROWS_INTRO = "Voici des données sur des éléments en Angular JS et Vue JS avec leurs propriétés :"
+SUMMARY_INTRO = ("Voici, pour des éléments en Angular JS et Vue JS, le nombre d'apparitions "
+                 "de chaque propriété dans les données :")
+# Taille des blocs lus pour construire le résumé (mémoire constante quelle que soit la taille du fichier)
+SUMMARY_CHUNKSIZE = 100_000
+# Colonnes de propriétés par défaut (sans [prop_columns]) : celles de [columns_csv] nommées Prop1, Prop2...
+PROP_COLUMN_PREFIX = "Prop"
+
+def build_messages(data, properties=PROPERTIES, intro=ROWS_INTRO):
     # Préparer le message pour le chat
-    messages = [
+    properties_list = "\n".join(f"        - {prop}" for prop in properties)
+    return [
         {
             "role": "system",
             "content": "Vous êtes un assistant chargé de calculer les poids des propriétés des éléments en fonction des données fournies."
@@ -26,68 +65,321 @@ def get_response_gpt(data):
         {
             "role": "user",
             "content": f"""
-            Voici des données sur des éléments en Angular JS et Vue JS avec leurs propriétés :
+            {intro}
         {data}
 
         Veuillez calculer et afficher le poids total de chaque propriété mentionnée ci-dessous en fonction de leur apparition dans les données :
 
-        - data-focus
-        - label
-        - id
-        - profil-list
-        - aria-label
-        - class
-        - text
-        - name
-        - for
-        - grid
-        - index
+{properties_list}
 
         Pour chaque propriété, affichez le poids total associé.
         """
         }
         ]
 
-        # Utiliser l'API OpenAI pour obtenir la réponse en mode chat
-    response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=500
+def serialize_data(data):
+    # Sérialisation complète (le repr d'un DataFrame est tronqué et ne peut pas servir de clé)
+    if isinstance(data, pd.DataFrame):
+        return data.to_csv(sep=";", index=False)
+    return str(data)
+
+def response_cache_key(data, properties=PROPERTIES, intro=ROWS_INTRO, backend=DEFAULT_BACKEND):
+    # backend : serveur qui a produit la réponse (backend_identity), pour ne jamais resservir celle d'un autre
+    return make_cache_key(
+        backend=backend,
+        model=GPT_MODEL,
+        max_tokens=GPT_MAX_TOKENS,
+        template=build_messages("{data}", properties, intro),
+        properties=properties,
+        data=serialize_data(data),
     )
 
-    return  response.choices[0].message.content.strip()
+def summarize_counts(counts, n_rows, properties=PROPERTIES):
+    """Résumé compact : une ligne par valeur de propriété (propriétés demandées d'abord), indépendant du nombre de lignes."""
+    lines = [f"Nombre d'éléments : {n_rows}"]
+    lines += [f"{prop}: {counts.get(prop, 0)}" for prop in properties]
+    others = [(value, count) for value, count in counts.items() if value not in properties]
+    if others:
+        lines.append("Autres propriétés :")
+        lines += [f"{value}: {count}" for value, count in others]
+    return "\n".join(lines)
 
-def save_weights(response,output_file):
-    lines = response.split('\n')
+def encode_summary(chunks, prop_columns, properties=PROPERTIES):
+    """Compte les occurrences de chaque propriété sur une suite de DataFrames (blocs du CSV ou données déjà chargées), puis construit le résumé."""
+    counts = Counter()
+    n_rows = 0
+    for chunk in chunks:
+        counts.update(count_property_values(chunk, prop_columns))
+        n_rows += len(chunk)
+    return summarize_counts(dict(counts.most_common()), n_rows, properties)
 
-    # Filtrer, formater et multiplier les poids
-    formatted_lines = []
-    for line in lines:
+def get_response_gpt(data, cache=None, properties=PROPERTIES, intro=ROWS_INTRO, client=None):
+    # client : client asynchrone de make_async_client (--backend, --base-url), sinon le client openai par défaut
+    if cache is not None:
+        key = response_cache_key(data, properties, intro, backend_identity(client))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    messages = build_messages(data, properties, intro)
+
+        # Utiliser l'API OpenAI pour obtenir la réponse en mode chat
+    if client is not None:
+        response = asyncio.run(client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=messages,
+            max_tokens=GPT_MAX_TOKENS
+        ))
+    else:
+        response = get_openai().chat.completions.create(
+            model=GPT_MODEL,
+            messages=messages,
+            max_tokens=GPT_MAX_TOKENS
+        )
+
+    content = response.choices[0].message.content.strip()
+    if cache is not None:
+        cache.put(key, content)
+    return content
+
+def parse_weights(response):
+    # Extraire les lignes "- propriété: poids" de la réponse
+    weights = {}
+    for line in response.split('\n'):
         if line.startswith("-"):
             # Enlever les tirets et extraire la propriété et le poids
             formatted_line = line.replace("- ", "").strip()
-            property_name, weight_str = formatted_line.split(': ')
-            weight = int(weight_str) * 10
-            formatted_lines.append(f"{property_name}={weight}")
+            try:
+                property_name, weight_str = formatted_line.split(': ')
+                weights[property_name] = int(weight_str)
+            except ValueError:
+                print(f"Ligne ignorée (format inattendu) : {line}")
+    return weights
+
+def write_weights(weights, output_file):
+    # Formater et multiplier les poids
+    formatted_result = "\n".join(f"{property_name}={weight * 10}" for property_name, weight in weights.items())
 
     # Afficher les résultats formatés
-    formatted_result = "\n".join(formatted_lines)
     print(formatted_result)
 
     # Si vous souhaitez également écrire les résultats dans un fichier texte
     with open(output_file, 'w', encoding='utf-8') as file:
         file.write(formatted_result)
-def main():
+
+def save_weights(response,output_file):
+    write_weights(parse_weights(response), output_file)
+
+def split_into_batches(data, batch_tokens=DEFAULT_BATCH_TOKENS):
+    """Découpe les lignes en lots dont le texte CSV tient dans environ batch_tokens tokens (au moins une ligne par lot)."""
+    header = ";".join(data.columns)
+    rows = data.astype(str).agg(";".join, axis=1).tolist()
+    budget = batch_tokens * CHARS_PER_TOKEN - len(header)
+    batches = []
+    current, current_size = [], 0
+    for row in rows:
+        if current and current_size + len(row) + 1 > budget:
+            batches.append(current)
+            current, current_size = [], 0
+        current.append(row)
+        current_size += len(row) + 1
+    if current:
+        batches.append(current)
+    # Chaque lot : (nombre de lignes, texte CSV avec en-tête)
+    return [(len(batch), "\n".join([header] + batch)) for batch in batches]
+
+async def get_response_gpt_async(client, data_text, semaphore, max_retries=DEFAULT_MAX_RETRIES, cache=None,
+                                 properties=PROPERTIES):
+    """Envoie un lot au modèle, avec au plus `concurrency` requêtes en vol et des tentatives à délai exponentiel."""
+    if cache is not None:
+        key = response_cache_key(data_text, properties, backend=backend_identity(client))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    messages = build_messages(data_text, properties)
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    model=GPT_MODEL,
+                    messages=messages,
+                    max_tokens=GPT_MAX_TOKENS
+                )
+            content = response.choices[0].message.content.strip()
+            break
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+            print(f"Échec de la requête ({e}), nouvelle tentative dans {delay:.1f}s ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+    if cache is not None:
+        cache.put(key, content)
+    return content
+
+def aggregate_weights(batch_weights):
+    """Moyenne des poids de chaque lot, pondérée par son nombre de lignes (propriété absente d'un lot = 0)."""
+    total_rows = sum(n_rows for n_rows, _ in batch_weights)
+    properties = []
+    for _, weights in batch_weights:
+        properties.extend(p for p in weights if p not in properties)
+    return {
+        prop: round(sum(n_rows * weights.get(prop, 0) for n_rows, weights in batch_weights) / total_rows)
+        for prop in properties
+    }
+
+async def get_batched_weights(data, client, batch_tokens=DEFAULT_BATCH_TOKENS,
+                              concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES, cache=None,
+                              properties=PROPERTIES):
+    """Envoie les lots en parallèle et agrège les poids obtenus pour chaque lot."""
+    batches = split_into_batches(data, batch_tokens)
+    print(f"{len(data)} lignes découpées en {len(batches)} lots (concurrence: {concurrency})")
+    semaphore = asyncio.Semaphore(concurrency)
+    responses = await asyncio.gather(*(
+        get_response_gpt_async(client, text, semaphore, max_retries, cache, properties) for _, text in batches
+    ))
+    batch_weights = [(n_rows, parse_weights(response)) for (n_rows, _), response in zip(batches, responses)]
+    return aggregate_weights(batch_weights)
+
+class StubChatClient:
+    """
+    Client local qui imite openai.AsyncOpenAI pour tester tous les modes hors ligne.
+
+    La réponse compte les cellules du CSV égales à chaque propriété listée dans le prompt (encodage
+    'rows') ou lit leurs occurrences dans le résumé (encodage 'summary'), et renvoie un poids de 0 à 10
+    proportionnel à leur fréquence, au format attendu par parse_weights.
+    """
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, model, messages, max_tokens):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise RuntimeError("stub: erreur simulée")
+        content_lines = [line.strip() for line in messages[-1]["content"].split("\n")]
+        properties = [line[2:] for line in content_lines if line.startswith("- ")]
+        rows = [line for line in content_lines if ";" in line][1:]  # La première ligne CSV est l'en-tête
+        counts = Counter(cell.strip() for row in rows for cell in row.split(";"))
+        n_rows = len(rows)
+        if not rows:
+            # Encodage 'summary' : "Nombre d'éléments : N" puis une ligne "valeur: occurrences" par propriété
+            for line in content_lines:
+                name, separator, value = line.rpartition(": ")
+                if separator and value.isdigit():
+                    if name.startswith("Nombre d'éléments"):
+                        n_rows = int(value)
+                    else:
+                        counts[name] = int(value)
+        content = "\n".join(
+            f"- {prop}: {round(10 * counts[prop] / max(n_rows, 1))}" for prop in properties
+        )
+        message = type("Message", (), {"content": content})
+        choice = type("Choice", (), {"message": message})
+        return type("Response", (), {"choices": [choice]})
+
+def backend_identity(client):
+    """Nom du serveur qui répond (faux client local ou URL de l'API), inclus dans la clé du cache des réponses."""
+    if client is None:
+        return DEFAULT_BACKEND
+    if isinstance(client, StubChatClient):
+        return "stub"
+    return f"openai:{client.base_url}"
+
+def make_async_client(backend, base_url=None):
+    if backend == "stub":
+        return StubChatClient()
+    # base_url permet aussi de viser un serveur local compatible OpenAI
+    openai = get_openai()
+    return openai.AsyncOpenAI(api_key=openai.api_key, base_url=base_url)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Calcule les poids des propriétés avec OpenAI.")
+    parser.add_argument("--encoding", choices=[ENCODING_SUMMARY, ENCODING_ROWS], default=ENCODING_SUMMARY,
+                        help="Données envoyées au modèle : résumé des occurrences par propriété (défaut) "
+                             "ou lignes brutes du CSV")
+    parser.add_argument("--batched", action="store_true",
+                        help="Découpe les lignes en lots envoyés en parallèle puis agrège les poids (encodage 'rows')")
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS,
+                        help=f"Taille maximale estimée d'un lot en tokens (défaut: {DEFAULT_BATCH_TOKENS})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Nombre maximal de requêtes simultanées (défaut: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"Nombre de nouvelles tentatives par lot en cas d'erreur (défaut: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--backend", choices=["openai", "stub"], default="openai",
+                        help="'stub' utilise un faux client local, sans réseau ni clé API (tous les modes)")
+    parser.add_argument("--base-url", default=None,
+                        help="URL d'un serveur compatible OpenAI (ex: serveur de test local)")
+    parser.add_argument("--data-cache", action="store_true",
+                        help="Garde un cache binaire (par colonne) du CSV analysé, relu en mmap aux exécutions suivantes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="N'utilise pas le cache disque des réponses")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Ignore les réponses en cache mais enregistre les nouvelles")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Répertoire du cache des réponses (défaut: .cache/gpt_responses)")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help="Taille maximale du cache en Mo (les entrées les plus anciennes sont supprimées)")
+    parser.add_argument("--cache-max-age-days", type=float, default=DEFAULT_MAX_AGE_SECONDS / 86400,
+                        help="Âge maximal d'une entrée du cache en jours")
+    return parser.parse_args(argv)
+
+def main(argv=None, data=None):
     #config_file=os.path.join(script_dir, 'configs', )
+    # data : DataFrame déjà chargé (commande 'all' de selector_weight.py), sinon lu depuis file_path
+    args = parse_args(argv)
 
-    file_path,output_file,columns_csv=load_config(script_dir,'config_gpt.txt')
-    data=load_data(file_path,columns_csv)
-    response=get_response_gpt(data)
+    config = load_config(script_dir,'config_gpt.txt')
+    file_path, output_file, columns_csv = config['file_path'], config['output_file'], config['columns_csv']
+    properties = config['properties'] or PROPERTIES
+    # Sans [prop_columns], les colonnes Prop* de [columns_csv] (convention du K-means) : ElementName, Langage
+    # ou Tag ne sont pas des propriétés et ne doivent pas être comptés dans le résumé
+    prop_columns = config['prop_columns'] or [column for column in columns_csv if column.startswith(PROP_COLUMN_PREFIX)]
+    if not prop_columns and args.encoding == ENCODING_SUMMARY and not args.batched:
+        print("❌ Erreur : config_gpt.txt ne définit pas [prop_columns] et [columns_csv] n'a aucune colonne "
+              f"'{PROP_COLUMN_PREFIX}*' : impossible de construire le résumé des propriétés.")
+        return 1
     output_file1 = os.path.join(script_dir,'weights', output_file)
     print(output_file1)
-    save_weights(response,output_file1)
-    
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024),
+                              args.cache_max_age_days * 86400, refresh=args.refresh_cache)
+    def get_data(usecols):
+        if data is not None:
+            return data[usecols]
+        return load_data(file_path,usecols,use_cache=args.data_cache)
+
+    # Le client choisi (--backend, --base-url) sert à tous les modes, pas seulement au mode par lots
+    client = make_async_client(args.backend, args.base_url)
+    if args.batched:
+        weights = asyncio.run(get_batched_weights(get_data(columns_csv), client, args.batch_tokens, args.concurrency,
+                                                  args.max_retries, cache, properties))
+        write_weights(weights, output_file1)
+    elif args.encoding == ENCODING_SUMMARY:
+        # Le prompt ne dépend que du nombre de propriétés distinctes, pas du nombre de lignes
+        if data is not None or args.data_cache:
+            chunks = [get_data(prop_columns)]
+        else:
+            chunks = load_data_chunks(file_path, prop_columns, SUMMARY_CHUNKSIZE)
+        summary = encode_summary(chunks, prop_columns, properties)
+        response=get_response_gpt(summary, cache, properties, SUMMARY_INTRO, client)
+        save_weights(response,output_file1)
+    else:
+        response=get_response_gpt(get_data(columns_csv), cache, properties, client=client)
+        save_weights(response,output_file1)
+    if cache is not None:
+        cache.log_stats()
+    return 0
+
 if __name__ == "__main__":
-    main()
-    
+    sys.exit(main())
+
 
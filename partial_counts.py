@@ -0,0 +1,309 @@
+"""
+Mergeable partial-count artifacts, to compute global weights from shards counted on different machines.
+
+    python partial_counts.py count xpath xpathsLists/app1.txt -o app1.counts.json.gz
+    python partial_counts.py count kmeans exports/app1.csv -o app1.counts.json.gz
+    python partial_counts.py merge app1.counts.json.gz app2.counts.json.gz -o all.counts.json.gz
+    python partial_counts.py weigh all.counts.json.gz -o weights/selectorWeight3.properties
+
+An artifact holds the raw counts of its shards (attribute -> occurrences for the XPath approach,
+column -> property value -> occurrences for the K-means approach) and a fingerprint of every input
+file counted. Merging sums the counts, so it is associative: artifacts can be merged in any grouping,
+and merging already merged artifacts is fine. A shard cannot be counted twice: merging two artifacts
+that share an input fingerprint is refused.
+
+weigh applies the normalization of the approach: square root of the frequency, scaled to 0-100
+(pure_python_approch3.compute_weights), or per-column percentages summed over columns
+(kmeans_clustring_approch1.weights_from_counts / combine_weights). The weights are identical to a
+single run over the concatenated shards. Artifacts ending in .gz are gzip-compressed.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+ARTIFACT_FORMAT = "selector-weight-counts"
+ARTIFACT_VERSION = 2
+KIND_XPATH = "xpath"
+KIND_KMEANS = "kmeans"
+KINDS = (KIND_XPATH, KIND_KMEANS)
+# Clé des cellules vides (NaN) : pandas lit une cellule vide comme NaN, "" n'est donc jamais une vraie valeur
+MISSING_VALUE = ""
+KMEANS_FILLER = "n"
+
+
+def shard_info(input_path: str) -> Dict[str, Any]:
+    """
+    Describes one counted input: its name, size and a fingerprint of its content (size plus a hash of every block).
+    """
+    from pure_python_approch3 import prefix_fingerprint
+
+    size = os.path.getsize(input_path)
+    return {"source": os.path.basename(input_path), "size": size,
+            "fingerprint": prefix_fingerprint(input_path, size)}
+
+
+def add_shard(artifact: Dict[str, Any], seen: Dict[str, str], shard: Dict[str, Any]) -> None:
+    """
+    Records a shard in an artifact; seen maps the fingerprints already recorded to their source name.
+
+    Raises:
+        ValueError: If a shard with the same content is already recorded (it would be counted twice).
+    """
+    if shard["fingerprint"] in seen:
+        raise ValueError(f"Shard '{shard['source']}' is already counted (as '{seen[shard['fingerprint']]}').")
+    seen[shard["fingerprint"]] = shard["source"]
+    artifact["shards"].append(shard)
+
+
+def new_artifact(kind: str, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    artifact: Dict[str, Any] = {"format": ARTIFACT_FORMAT, "version": ARTIFACT_VERSION, "kind": kind, "shards": []}
+    if kind == KIND_KMEANS:
+        artifact["columns"] = list(columns or [])
+        artifact["counts"] = {column: {} for column in artifact["columns"]}
+    else:
+        artifact["counts"] = {}
+    return artifact
+
+
+def count_xpath_shards(input_paths: List[str], workers: int = 1) -> Dict[str, Any]:
+    """
+    Counts the attributes of XPath lists (plain, .gz or .zst) into one artifact.
+
+    Raises:
+        ValueError: If two inputs have the same content (see add_shard).
+    """
+    from pure_python_approch3 import count_attributes
+
+    artifact = new_artifact(KIND_XPATH)
+    seen: Dict[str, str] = {}
+    counts: Counter = Counter()
+    for input_path in input_paths:
+        # Doublon refusé avant le comptage, comme à la fusion
+        add_shard(artifact, seen, shard_info(input_path))
+        # L'ordre de première apparition est conservé : il départage les poids égaux comme un calcul unique
+        counts.update(count_attributes(input_path, workers))
+        logging.info(f"Counted {input_path}: {len(counts)} distinct attributes so far.")
+    artifact["counts"] = dict(counts)
+    return artifact
+
+
+def count_kmeans_shards(input_paths: List[str], prop_columns: List[str], chunksize: int = 0) -> Dict[str, Any]:
+    """
+    Counts every property value of every property column of CSV exports into one artifact.
+
+    Raw values are stored, not codes: shards need no shared codebook, and the vocabulary is applied by weigh.
+
+    Raises:
+        ValueError: If an input cannot be loaded, or two inputs have the same content (see add_shard).
+    """
+    from kmeans_clustring_approch1 import discover_value_counts
+    from utils import load_data, load_data_chunks
+
+    artifact = new_artifact(KIND_KMEANS, prop_columns)
+    seen: Dict[str, str] = {}
+    category_dtypes = {prop: 'category' for prop in prop_columns}
+    for input_path in input_paths:
+        add_shard(artifact, seen, shard_info(input_path))
+        if chunksize > 0:
+            chunks = load_data_chunks(input_path, usecols=prop_columns, chunksize=chunksize, dtype=category_dtypes)
+        else:
+            data = load_data(input_path, usecols=prop_columns, dtype=category_dtypes)
+            if data is None:
+                raise ValueError(f"Failed to load data from {input_path}.")
+            chunks = [data]
+        value_counts = discover_value_counts(chunks, prop_columns, MISSING_VALUE)
+        for prop, col_counts in zip(prop_columns, value_counts):
+            column = artifact["counts"][prop]
+            for value, count in col_counts.items():
+                column[value] = column.get(value, 0) + int(count)
+    return artifact
+
+
+def merge_artifacts(artifacts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Sums the counts of artifacts of the same kind (and, for K-means, the same property columns).
+
+    Raises:
+        ValueError: If the artifacts are of different kinds or columns, or share an input shard.
+    """
+    if not artifacts:
+        raise ValueError("Nothing to merge.")
+    first = artifacts[0]
+    merged = new_artifact(first["kind"], first.get("columns"))
+    seen: Dict[str, str] = {}
+    for artifact in artifacts:
+        if artifact["kind"] != merged["kind"]:
+            raise ValueError(f"Cannot merge '{artifact['kind']}' counts into '{merged['kind']}' counts.")
+        if artifact.get("columns") != merged.get("columns"):
+            raise ValueError(f"Cannot merge counts of columns {artifact.get('columns')} and {merged.get('columns')}.")
+        for shard in artifact["shards"]:
+            add_shard(merged, seen, shard)
+        if merged["kind"] == KIND_KMEANS:
+            for column, col_counts in artifact["counts"].items():
+                _add_counts(merged["counts"][column], col_counts)
+        else:
+            _add_counts(merged["counts"], artifact["counts"])
+    return merged
+
+
+def _add_counts(total: Dict[str, int], partial: Dict[str, int]) -> None:
+    for key, count in partial.items():
+        total[key] = total.get(key, 0) + count
+
+
+def load_artifact(path: str) -> Dict[str, Any]:
+    """
+    Reads an artifact written by save_artifact.
+
+    Raises:
+        ValueError: If the file is not a partial-count artifact of a supported version.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        artifact = json.load(f)
+    if not isinstance(artifact, dict) or artifact.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"{path} is not a partial-count artifact.")
+    if artifact.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path} has version {artifact.get('version')}, expected {ARTIFACT_VERSION}.")
+    if artifact.get("kind") not in KINDS:
+        raise ValueError(f"{path} has an unknown kind '{artifact.get('kind')}'.")
+    return artifact
+
+
+def save_artifact(artifact: Dict[str, Any], path: str) -> None:
+    """
+    Writes an artifact atomically (temporary file, then rename), gzip-compressed if path ends in .gz.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    opener = gzip.open if path.endswith(".gz") else open
+    tmp_path = f"{path}.tmp"
+    with opener(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    logging.info(f"Wrote {artifact['kind']} counts of {len(artifact['shards'])} shard(s) to {path}")
+
+
+def weigh_xpath(artifact: Dict[str, Any], output_path: str) -> None:
+    from pure_python_approch3 import compute_weights, write_weights
+
+    if not artifact["counts"]:
+        raise ValueError("No attribute was counted.")
+    write_weights(compute_weights(artifact["counts"]), output_path)
+
+
+def weigh_kmeans(artifact: Dict[str, Any], output_path: str, vocabulary: str = "config",
+                 codebook_path: Optional[str] = None) -> None:
+    """
+    Writes the K-means approach weights of an artifact.
+
+    With the 'config' vocabulary, values outside properties_dict (and empty cells) count in the column
+    totals under the unknown code, as in a direct run. With 'discover', empty cells count as the filler
+    and the codes come from (and extend) the codebook.
+    """
+    import numpy as np
+    from kmeans_clustring_approch1 import (VOCABULARY_DISCOVER, build_codebook, combine_weights,
+                                           counts_from_value_counts, default_codebook_path, load_codebook,
+                                           save_codebook, trim_unknown, weights_from_counts, weights_to_dicts,
+                                           write_to_properties_file)
+    from utils import load_config
+
+    columns = artifact["columns"]
+    value_counts = [Counter(artifact["counts"][column]) for column in columns]
+    if vocabulary == VOCABULARY_DISCOVER:
+        for col_counts in value_counts:
+            missing = col_counts.pop(MISSING_VALUE, 0)
+            if missing:
+                col_counts[KMEANS_FILLER] += missing
+        codebook_path = codebook_path or default_codebook_path(output_path)
+        properties_map = build_codebook(value_counts, KMEANS_FILLER, load_codebook(codebook_path))
+        save_codebook(codebook_path, properties_map, KMEANS_FILLER)
+        counts = counts_from_value_counts(value_counts, properties_map)
+    else:
+        config = load_config(script_dir, 'config_kmeans.txt')
+        if config is None or 'num_clusters' not in config:
+            raise ValueError("Failed to load the K-means configuration.")
+        properties_map = config['properties_dict']
+        num_clusters = config['num_clusters']
+        counts = np.zeros((len(columns), num_clusters + 1), dtype=np.int64)
+        for col_index, col_counts in enumerate(value_counts):
+            for value, count in col_counts.items():
+                counts[col_index, properties_map.get(value, num_clusters)] += count
+        counts = trim_unknown(counts, num_clusters)
+    final_weights = combine_weights(weights_to_dicts(weights_from_counts(counts), columns))
+    write_to_properties_file(final_weights, properties_map, output_path, KMEANS_FILLER)
+
+
+def weigh(artifact: Dict[str, Any], output_path: str, vocabulary: str = "config",
+          codebook_path: Optional[str] = None) -> None:
+    if artifact["kind"] == KIND_KMEANS:
+        weigh_kmeans(artifact, output_path, vocabulary, codebook_path)
+    else:
+        weigh_xpath(artifact, output_path)
+    logging.info(f"Weights of {len(artifact['shards'])} shard(s) written to {output_path}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Count shards separately, merge the counts, then compute the weights.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    count_parser = subparsers.add_parser("count", help="Count one or more input files into a partial-count artifact")
+    count_parser.add_argument("kind", choices=KINDS, help="Approach whose counts are computed")
+    count_parser.add_argument("inputs", nargs="+", help="XPath lists (xpath) or CSV exports (kmeans)")
+    count_parser.add_argument("-o", "--output", required=True, help="Artifact to write (.counts.json[.gz])")
+    count_parser.add_argument("--workers", type=int, default=1, help="Processes used to count XPath attributes")
+    count_parser.add_argument("--chunksize", type=int, default=0,
+                              help="Stream CSV exports in chunks of this many rows (0 loads each file at once)")
+
+    merge_parser = subparsers.add_parser("merge", help="Sum several artifacts into one")
+    merge_parser.add_argument("inputs", nargs="+", help="Artifacts to merge")
+    merge_parser.add_argument("-o", "--output", required=True, help="Merged artifact to write")
+
+    weigh_parser = subparsers.add_parser("weigh", help="Compute the weights of one or more artifacts")
+    weigh_parser.add_argument("inputs", nargs="+", help="Artifacts (merged together first if several)")
+    weigh_parser.add_argument("-o", "--output", required=True, help="Properties file to write")
+    weigh_parser.add_argument("--vocabulary", choices=("config", "discover"), default="config",
+                              help="K-means vocabulary: properties_dict of the config (default) or the discovered values")
+    weigh_parser.add_argument("--codebook", default=None, metavar="PATH",
+                              help="Codebook for --vocabulary discover (default: next to the output file)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command == "count":
+            if args.kind == KIND_KMEANS:
+                from utils import load_config
+
+                config = load_config(script_dir, 'config_kmeans.txt')
+                if config is None or 'prop_columns' not in config:
+                    logging.error("Failed to load the K-means configuration.")
+                    return 1
+                artifact = count_kmeans_shards(args.inputs, config['prop_columns'], args.chunksize)
+            else:
+                artifact = count_xpath_shards(args.inputs, args.workers)
+            save_artifact(artifact, args.output)
+        else:
+            artifact = merge_artifacts([load_artifact(path) for path in args.inputs])
+            if args.command == "merge":
+                save_artifact(artifact, args.output)
+            else:
+                weigh(artifact, args.output, args.vocabulary, args.codebook)
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"{args.command} failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,53 +1,712 @@
 import re
+import os
+import gzip
+import json
 import math
+import mmap
+import sys
+import hashlib
 from collections import Counter
+from multiprocessing import Pool
 import argparse
 
-def process_xpaths(input_filepath, output_filepath):
-    # Lire les lignes depuis le fichier
+from heavy_hitters import SpaceSaving, capacity_for_budget
+from hyperloglog import DEFAULT_PRECISION, MAX_PRECISION, MIN_PRECISION, HyperLogLog
+from instrumentation import recorder_from_env
+
+# Regex pour extraire les attributs (en octets : les noms sont en ASCII, seuls les noms distincts sont décodés)
+attr_regex = re.compile(rb'@([a-zA-Z0-9_-]+)')
+
+# Regex des valeurs de prédicats : [@id='x'], [@id="x"], contains(@class,'x'), starts-with(@id,'x')
+# (sans groupes : findall renvoie la correspondance entière, comptée en C avant le découpage nom / valeur)
+value_regex = re.compile(rb"""@[a-zA-Z0-9_-]+\s*[=,]\s*(?:'[^'\n]*'|"[^"\n]*")""")
+
+# Rapport des cardinalités estimées (mode --values), écrit à côté du fichier de sortie
+CARDINALITY_SUFFIX = ".cardinality.json"
+WEIGHTING_FREQUENCY = "frequency"
+WEIGHTING_SELECTIVITY = "selectivity"
+
+# Intervalles de confiance bootstrap (--bootstrap), écrits à côté du fichier de sortie
+DEFAULT_CONFIDENCE = 0.95
+
+# Mode approché (--approx) : résumé Space-Saving des attributs les plus fréquents, en mémoire bornée
+TOPK_SUFFIX = ".topk.json"
+DEFAULT_MEMORY_BUDGET_MB = 64
+DEFAULT_TOP_N = 1000
+# Part du budget réservée au bloc en cours de comptage (le reste va au résumé), et mémoire occupée par octet
+# de bloc dans le pire cas (correspondances, compteur exact et noms décodés d'un nom distinct par ligne)
+APPROX_BLOCK_SHARE = 0.25
+APPROX_BYTES_PER_BLOCK_BYTE = 16
+APPROX_MIN_BLOCK_BYTES = 64 * 1024
+
+# Familles d'attributs générés par les frameworks, regroupées par --collapse-generated
+GENERATED_FAMILIES = [
+    (r"^data-v-[0-9a-f]{6,}$", "data-v-*"),   # Attributs scoped de Vue
+    (r"^_ngcontent-[a-z0-9-]+$", "_ngcontent-*"),   # Encapsulation des styles Angular
+    (r"^_nghost-[a-z0-9-]+$", "_nghost-*"),
+]
+
+# Taille maximale (en octets) d'une plage lue par un worker : borne la mémoire par processus
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Taille des blocs décompressés lus pour les fichiers .gz / .zst
+STREAM_BLOCK_BYTES = 16 * 1024 * 1024
+
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+# Checkpoint des comptes pour le mode incrémental (fichiers XPath qui ne font que grandir par ajout)
+CHECKPOINT_VERSION = 3
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+# Taille des blocs hachés du préfixe déjà traité : une empreinte par bloc, tout le préfixe est couvert.
+# Par défaut seul le dernier bloc est revérifié ; --verify-prefix les revérifie tous.
+FINGERPRINT_BLOCK_BYTES = 4 * 1024 * 1024
+
+def split_line_ranges(input_filepath, n_ranges, start=0, end=None):
+    """Découpe [start, end) en au plus n_ranges plages d'octets alignées sur les fins de ligne (start doit être un début de ligne)."""
+    if end is None:
+        end = os.path.getsize(input_filepath)
+    boundaries = [start]
+    with open(input_filepath, "rb") as f:
+        for i in range(1, n_ranges):
+            f.seek(start + (end - start) * i // n_ranges)
+            f.readline()  # Avancer jusqu'au début de la ligne suivante
+            pos = f.tell()
+            if boundaries[-1] < pos < end:
+                boundaries.append(pos)
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def decode_counts(byte_counter):
+    """Décode les noms d'attributs (une seule fois par nom distinct) en conservant l'ordre d'apparition."""
+    return Counter({name.decode("ascii"): count for name, count in byte_counter.items()})
+
+def count_attributes_in_range(input_filepath, start, end):
+    """Compte les attributs présents dans la plage d'octets [start, end) du fichier, sans copie (mmap)."""
+    if end <= start:
+        return Counter()
+    with open(input_filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        # Une plage ne coupe jamais une ligne, et la regex ne traverse pas les fins de ligne :
+        # le résultat est le même qu'en traitant les lignes une à une.
+        return decode_counts(Counter(attr_regex.findall(buffer, start, end)))
+
+def open_compressed(input_filepath):
+    """Ouvre un fichier .gz ou .zst en lecture binaire décompressée (flux)."""
+    if input_filepath.endswith(".gz"):
+        return gzip.open(input_filepath, "rb")
     try:
-        with open(input_filepath, "r", encoding="utf-8") as f:
-            lines = [line.strip() for line in f if line.strip()]
-    except FileNotFoundError:
-        print(f"❌ Erreur : Le fichier d'entrée '{input_filepath}' n'a pas été trouvé.")
-        return
+        import zstandard  # Dépendance optionnelle, seulement pour les fichiers .zst
+    except ImportError as e:
+        raise ImportError("Le paquet 'zstandard' est requis pour lire les fichiers .zst (pip install zstandard).") from e
+    return zstandard.ZstdDecompressor().stream_reader(open(input_filepath, "rb"), closefd=True)
 
-    # Regex pour extraire les attributs
-    attr_regex = re.compile(r'@([a-zA-Z0-9_-]+)')
+def iter_stream_block_counts(stream, block_bytes=STREAM_BLOCK_BYTES, limit=None):
+    """
+    Compte les attributs d'un flux binaire bloc par bloc (un Counter par bloc) ; la dernière ligne incomplète d'un bloc est reportée.
+    Au plus `limit` octets sont lus si donné (plage d'un fichier non compressé).
+    """
+    pending = b""
+    remaining = limit
+    while True:
+        size = block_bytes if remaining is None else min(block_bytes, remaining)
+        block = stream.read(size) if size > 0 else b""
+        if not block:
+            break
+        if remaining is not None:
+            remaining -= len(block)
+        block = pending + block
+        cut = block.rfind(b"\n") + 1
+        pending = block[cut:]
+        yield Counter(attr_regex.findall(block, 0, cut))
+    yield Counter(attr_regex.findall(pending))
+
+def count_attributes_in_stream(stream):
+    """Compte les attributs d'un flux binaire lu par blocs ; la dernière ligne incomplète d'un bloc est reportée."""
+    byte_counter = Counter()
+    for block_counter in iter_stream_block_counts(stream):
+        byte_counter.update(block_counter)
+    return decode_counts(byte_counter)
+
+def _count_range(args):
+    return count_attributes_in_range(*args)
+
+def count_attributes(input_filepath, workers=1, start=0, end=None):
+    """Compte les attributs du fichier (ou de la plage [start, end)), en parallèle sur `workers` processus si workers > 1."""
+    if input_filepath.endswith(COMPRESSED_SUFFIXES):
+        # Un flux compressé ne peut pas être découpé en plages : lecture séquentielle
+        if workers > 1:
+            print("ℹ️ Fichier compressé : lecture séquentielle, l'option --workers est ignorée.")
+        with open_compressed(input_filepath) as stream:
+            return count_attributes_in_stream(stream)
+
+    if end is None:
+        end = os.path.getsize(input_filepath)
+    # Plages d'au plus CHUNK_BYTES octets, même en mono-processus, pour borner la liste des correspondances
+    n_ranges = max(workers, math.ceil((end - start) / CHUNK_BYTES))
+    ranges = split_line_ranges(input_filepath, n_ranges, start, end)
 
-    # Compter les attributs
     attribute_counter = Counter()
+    if workers > 1 and len(ranges) > 1:
+        with Pool(processes=workers) as pool:
+            # imap conserve l'ordre des plages : l'ordre de première apparition des attributs
+            # (et donc l'ordre de sortie à poids égal) est le même qu'en mono-processus.
+            for partial_counter in pool.imap(_count_range, [(input_filepath, s, e) for s, e in ranges]):
+                attribute_counter.update(partial_counter)
+    else:
+        for start, end in ranges:
+            attribute_counter.update(count_attributes_in_range(input_filepath, start, end))
+    return attribute_counter
 
-    for line in lines:
-        attrs = attr_regex.findall(line)
-        for attr in attrs:
-            attribute_counter[attr] += 1
+def parse_families(specs, generated=False):
+    """Compile les familles --collapse 'REGEX=FAMILLE' (et les familles générées si demandé) en liste (regex, famille)."""
+    families = list(GENERATED_FAMILIES) if generated else []
+    for spec in specs or []:
+        pattern, sep, family = spec.rpartition("=")
+        if not sep or not pattern or not family:
+            raise ValueError(f"Famille invalide '{spec}' : format attendu REGEX=FAMILLE.")
+        families.append((pattern, family))
+    return [(re.compile(pattern), family) for pattern, family in families]
 
-    if not attribute_counter:
-        print("ℹ️ Aucun attribut trouvé dans le fichier d'entrée. Le fichier de sortie ne sera pas généré.")
-        return
+def collapse_families(attribute_counter, families):
+    """Regroupe les attributs dont le nom correspond à une famille sous le nom de la famille (la première qui correspond)."""
+    if not families:
+        return attribute_counter
+    collapsed = Counter()
+    for attr, count in attribute_counter.items():
+        for pattern, family in families:
+            if pattern.search(attr):
+                attr = family
+                break
+        collapsed[attr] += count
+    return collapsed
+
+def approx_layout(memory_budget_mb, top_n=DEFAULT_TOP_N):
+    """
+    Répartit le budget --memory-budget-mb d'un processus entre le résumé et le bloc lu :
+    renvoie (capacité du résumé, taille des blocs en octets).
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    block_budget = int(budget * APPROX_BLOCK_SHARE)
+    capacity = max(top_n, capacity_for_budget(budget - block_budget))
+    block_bytes = max(APPROX_MIN_BLOCK_BYTES, block_budget // APPROX_BYTES_PER_BLOCK_BYTE)
+    return capacity, block_bytes
+
+def summarize_stream(stream, summary, block_bytes, families=None, limit=None):
+    """Compte le flux par blocs de block_bytes octets (au plus limit octets), chacun regroupé en familles puis fusionné dans le résumé et libéré."""
+    for block_counter in iter_stream_block_counts(stream, block_bytes, limit):
+        summary.update(collapse_families(decode_counts(block_counter), families))
+    return summary
+
+def _summarize_range(args):
+    input_filepath, start, end, capacity, block_bytes, families = args
+    # Lecture par blocs plutôt qu'en mmap : les pages du fichier ne s'accumulent pas dans la mémoire du processus
+    with open(input_filepath, "rb") as f:
+        f.seek(start)
+        return summarize_stream(f, SpaceSaving(capacity), block_bytes, families, end - start)
+
+def count_attributes_approx(input_filepath, workers=1, capacity=None, families=None, block_bytes=None):
+    """
+    Résume les attributs dans un Space-Saving d'au plus `capacity` entrées : le fichier est lu par blocs de
+    block_bytes octets, chacun compté exactement, regroupé en familles, fusionné dans le résumé et libéré.
+    Avec workers > 1, chaque processus résume sa plage et les résumés sont fusionnés (SpaceSaving.merge).
+    La mémoire d'un processus est bornée par `capacity` et block_bytes (voir approx_layout), quelle que soit la taille du fichier.
+    """
+    default_capacity, default_block_bytes = approx_layout(DEFAULT_MEMORY_BUDGET_MB)
+    capacity, block_bytes = capacity or default_capacity, block_bytes or default_block_bytes
+    summary = SpaceSaving(capacity)
+    if input_filepath.endswith(COMPRESSED_SUFFIXES):
+        if workers > 1:
+            print("ℹ️ Fichier compressé : lecture séquentielle, l'option --workers est ignorée.")
+        with open_compressed(input_filepath) as stream:
+            return summarize_stream(stream, summary, block_bytes, families)
+
+    end = os.path.getsize(input_filepath)
+    tasks = [(input_filepath, s, e, capacity, block_bytes, families)
+             for s, e in split_line_ranges(input_filepath, max(workers, 1), 0, end)]
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=workers) as pool:
+            # imap conserve l'ordre des plages (ordre de première apparition des attributs)
+            for partial_summary in pool.imap(_summarize_range, tasks):
+                summary.merge(partial_summary)
+    else:
+        with open(input_filepath, "rb") as f:
+            summarize_stream(f, summary, block_bytes, families)
+    return summary
+
+def top_attributes(summary, top_n):
+    """Comptes estimés des top_n attributs du résumé, dans l'ordre de première apparition (comme count_attributes)."""
+    top = {item for item, _, _, _ in summary.top(top_n)}
+    return Counter({item: count for item, count in summary.counts.items() if item in top})
+
+def write_topk_report(summary, top_n, output_filepath):
+    """Écrit les top_n attributs avec leur compte estimé, leur borne d'erreur et s'ils sont certainement dans le top."""
+    report = {
+        "total": summary.total,
+        "capacity": summary.capacity,
+        "tracked": len(summary.counts),
+        "max_error": round(summary.max_error(), 3),
+        "top": [
+            {"attribute": item, "count": count, "error": error, "lower_bound": count - error,
+             "guaranteed": guaranteed}
+            for item, count, error, guaranteed in summary.top(top_n)
+        ],
+    }
+    report_path = output_filepath + TOPK_SUFFIX
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, report_path)
+    return report_path
+
+def collect_values(data, start, end, valued_counter, values_by_attr):
+    """Ajoute les valeurs des prédicats de data[start:end] : nombre d'occurrences avec valeur et valeurs distinctes par attribut."""
+    for match, count in Counter(value_regex.findall(data, start, end)).items():
+        # match = @nom='valeur' : le guillemet de fin est aussi celui d'ouverture, absent du nom
+        quote_pos = match.index(match[-1:])
+        name = match[1:quote_pos].rstrip(b" \t=,")
+        valued_counter[name] += count
+        values_by_attr.setdefault(name, []).append(match[quote_pos + 1:-1])
+
+def sketch_values(valued_counter, values_by_attr, precision):
+    """Résume les valeurs distinctes de chaque attribut dans un sketch HyperLogLog de taille fixe."""
+    sketches = {}
+    for name, values in values_by_attr.items():
+        sketch = HyperLogLog(precision)
+        sketch.update(values)
+        sketches[name.decode("ascii")] = sketch
+    return decode_counts(valued_counter), sketches
+
+def merge_value_stats(total, partial):
+    """Fusionne les statistiques de valeurs (occurrences avec valeur, sketches) d'une plage dans le total."""
+    valued_counter, sketches = total
+    partial_valued, partial_sketches = partial
+    valued_counter.update(partial_valued)
+    for name, sketch in partial_sketches.items():
+        if name in sketches:
+            sketches[name].merge(sketch)
+        else:
+            sketches[name] = sketch
+
+def count_attributes_and_values_in_range(input_filepath, start, end, precision=DEFAULT_PRECISION):
+    """Comme count_attributes_in_range, avec en plus les statistiques de valeurs des prédicats de la plage."""
+    if end <= start:
+        return Counter(), (Counter(), {})
+    valued_counter, values_by_attr = Counter(), {}
+    with open(input_filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        attribute_counter = decode_counts(Counter(attr_regex.findall(buffer, start, end)))
+        # Les ensembles de valeurs sont bornés par la taille de la plage, puis résumés en sketches
+        collect_values(buffer, start, end, valued_counter, values_by_attr)
+    return attribute_counter, sketch_values(valued_counter, values_by_attr, precision)
+
+def count_attributes_and_values_in_stream(stream, precision=DEFAULT_PRECISION):
+    """Comme count_attributes_in_stream, avec en plus les statistiques de valeurs (un sketch par attribut)."""
+    byte_counter = Counter()
+    value_stats = (Counter(), {})
+    pending = b""
+    while True:
+        block = stream.read(STREAM_BLOCK_BYTES)
+        if not block:
+            break
+        block = pending + block
+        cut = block.rfind(b"\n") + 1
+        pending = block[cut:]
+        byte_counter.update(attr_regex.findall(block, 0, cut))
+        valued_counter, values_by_attr = Counter(), {}
+        collect_values(block, 0, cut, valued_counter, values_by_attr)
+        merge_value_stats(value_stats, sketch_values(valued_counter, values_by_attr, precision))
+    byte_counter.update(attr_regex.findall(pending))
+    valued_counter, values_by_attr = Counter(), {}
+    collect_values(pending, 0, len(pending), valued_counter, values_by_attr)
+    merge_value_stats(value_stats, sketch_values(valued_counter, values_by_attr, precision))
+    return decode_counts(byte_counter), value_stats
+
+def _count_values_range(args):
+    return count_attributes_and_values_in_range(*args)
+
+def count_attributes_and_values(input_filepath, workers=1, precision=DEFAULT_PRECISION):
+    """
+    Compte les attributs comme count_attributes et estime le nombre de valeurs distinctes de chaque attribut.
+
+    Retourne (attribute_counter, (valued_counter, sketches)) : valued_counter compte les occurrences
+    avec une valeur, sketches associe à chaque attribut un HyperLogLog de ses valeurs.
+    """
+    if input_filepath.endswith(COMPRESSED_SUFFIXES):
+        if workers > 1:
+            print("ℹ️ Fichier compressé : lecture séquentielle, l'option --workers est ignorée.")
+        with open_compressed(input_filepath) as stream:
+            return count_attributes_and_values_in_stream(stream, precision)
+
+    end = os.path.getsize(input_filepath)
+    n_ranges = max(workers, math.ceil(end / CHUNK_BYTES))
+    ranges = split_line_ranges(input_filepath, n_ranges, 0, end)
+    tasks = [(input_filepath, s, e, precision) for s, e in ranges]
 
+    attribute_counter, value_stats = Counter(), (Counter(), {})
+    if workers > 1 and len(ranges) > 1:
+        with Pool(processes=workers) as pool:
+            # imap conserve l'ordre des plages, comme count_attributes
+            for partial_counter, partial_stats in pool.imap(_count_values_range, tasks):
+                attribute_counter.update(partial_counter)
+                merge_value_stats(value_stats, partial_stats)
+    else:
+        for task in tasks:
+            partial_counter, partial_stats = _count_values_range(task)
+            attribute_counter.update(partial_counter)
+            merge_value_stats(value_stats, partial_stats)
+    return attribute_counter, value_stats
+
+def attribute_selectivity(attribute_counter, value_stats):
+    """
+    Sélectivité de chaque attribut : valeurs distinctes estimées / occurrences avec valeur, entre 0 et 1.
+
+    Proche de 1 pour id ou data-testid (valeurs presque uniques), faible pour class. Un attribut jamais vu
+    avec une valeur ([@disabled]) n'apporte pas d'information : il reçoit la sélectivité globale
+    (valeurs distinctes / occurrences avec valeur, tous attributs confondus), ou 1 si aucune valeur n'a été vue.
+    """
+    valued_counter, sketches = value_stats
+    estimates = {attr: sketch.estimate() for attr, sketch in sketches.items()}
+    total_valued = sum(valued_counter.values())
+    default = min(1.0, sum(estimates.values()) / total_valued) if total_valued else 1.0
+    selectivity = {}
+    for attr in attribute_counter:
+        valued = valued_counter.get(attr, 0)
+        selectivity[attr] = min(1.0, estimates[attr] / valued) if valued else default
+    return selectivity
+
+def compute_selectivity_weights(attribute_counter, selectivity, exponent=1.0):
+    """Poids entre 0 et 100 : racine de la fréquence multipliée par sélectivité^exponent, normalisés par le maximum."""
+    scores = {attr: math.sqrt(count) * selectivity[attr] ** exponent for attr, count in attribute_counter.items()}
+    max_score = max(scores.values())
+    return {attr: round(score / max_score * 100) if max_score > 0 else 0 for attr, score in scores.items()}
+
+def write_cardinality_report(attribute_counter, value_stats, selectivity, output_filepath):
+    """Écrit, pour chaque attribut, ses occurrences, ses occurrences avec valeur, le nombre estimé de valeurs distinctes et sa sélectivité."""
+    valued_counter, sketches = value_stats
+    report = {
+        attr: {
+            "count": count,
+            "valued": valued_counter.get(attr, 0),
+            "distinct_estimate": round(sketches[attr].estimate()) if attr in sketches else 0,
+            "selectivity": round(selectivity[attr], 4),
+        }
+        for attr, count in sorted(attribute_counter.items(), key=lambda x: -x[1])
+    }
+    report_path = output_filepath + CARDINALITY_SUFFIX
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, report_path)
+    return report_path
+
+def write_weight_intervals(attribute_counter, attribute_weights, output_filepath, n_resamples,
+                           confidence=DEFAULT_CONFIDENCE, selectivity=None, exponent=1.0):
+    """
+    Intervalles de confiance bootstrap des poids, tirés du seul vecteur de comptes (coût indépendant du nombre de lignes).
+    Les tirages multinomiaux suivent la même normalisation que les poids écrits (racine, sélectivité éventuelle).
+    """
+    # numpy n'est importé que pour cette option : le calcul des poids reste en Python pur
+    import numpy as np
+    from bootstrap import INTERVALS_SUFFIX, bootstrap_intervals, sqrt_weights, write_intervals
+
+    attributes = list(attribute_counter)
+    counts = np.array([attribute_counter[attr] for attr in attributes], dtype=np.int64)
+    factors = None
+    if selectivity is not None:
+        factors = np.array([selectivity[attr] ** exponent for attr in attributes])
+    intervals = bootstrap_intervals(counts, lambda resampled: sqrt_weights(resampled, factors), n_resamples, confidence)
+    intervals_path = output_filepath + INTERVALS_SUFFIX
+    key_indices = {attr: index for index, attr in enumerate(attributes)}
+    write_intervals(intervals_path, key_indices, attribute_weights, intervals, n_resamples, confidence)
+    return intervals_path
+
+def checkpoint_path(output_filepath):
+    return output_filepath + CHECKPOINT_SUFFIX
+
+def last_line_end(input_filepath):
+    """Position qui suit le dernier saut de ligne du fichier (0 si aucun) : fin de la partie stable du fichier."""
+    if os.path.getsize(input_filepath) == 0:
+        return 0
+    with open(input_filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return buffer.rfind(b"\n") + 1
+
+def block_fingerprints(input_filepath, offset, known=(), known_offset=0):
+    """
+    Empreintes SHA-256 des blocs de FINGERPRINT_BLOCK_BYTES octets du préfixe [0, offset) (le dernier peut être partiel).
+
+    Les empreintes `known` du préfixe [0, known_offset), déjà vérifié, sont reprises pour ses blocs complets :
+    seuls les octets suivants sont relus.
+    """
+    reused = min(len(known), known_offset // FINGERPRINT_BLOCK_BYTES, offset // FINGERPRINT_BLOCK_BYTES)
+    blocks = list(known[:reused])
+    position = reused * FINGERPRINT_BLOCK_BYTES
+    with open(input_filepath, "rb") as f:
+        f.seek(position)
+        while position < offset:
+            block = f.read(min(FINGERPRINT_BLOCK_BYTES, offset - position))
+            if not block:  # Fichier plus court que offset
+                break
+            blocks.append(hashlib.sha256(block).hexdigest())
+            position += len(block)
+    return blocks
+
+def prefix_fingerprint(input_filepath, offset, blocks=None):
+    """Empreinte de tout le préfixe [0, offset) : sa taille et l'empreinte de chacun de ses blocs."""
+    if blocks is None:
+        blocks = block_fingerprints(input_filepath, offset)
+    digest = hashlib.sha256(str(offset).encode("ascii"))
+    for block in blocks:
+        digest.update(block.encode("ascii"))
+    return digest.hexdigest()
+
+def file_identity(input_filepath):
+    """Périphérique et inode du fichier : changent quand il est remplacé (écriture dans un autre fichier puis renommage)."""
+    stat = os.stat(input_filepath)
+    return [stat.st_dev, stat.st_ino]
+
+def prefix_unchanged(input_filepath, offset, blocks, verify_prefix=False):
+    """
+    Vérifie que le préfixe [0, offset) a toujours les empreintes `blocks`.
+
+    Par défaut seul le dernier bloc est relu et haché (au plus FINGERPRINT_BLOCK_BYTES octets) : le coût
+    reste O(ajout) mais une modification en place plus tôt dans le préfixe n'est pas vue. verify_prefix=True
+    relit et hache tout le préfixe (O(taille du fichier), à la vitesse du hachage).
+    """
+    if offset > os.path.getsize(input_filepath):
+        return False
+    if verify_prefix:
+        return block_fingerprints(input_filepath, offset) == blocks
+    if not blocks:
+        return offset == 0
+    last_block_start = (len(blocks) - 1) * FINGERPRINT_BLOCK_BYTES
+    return block_fingerprints(input_filepath, offset, blocks, last_block_start) == blocks
+
+def load_checkpoint(input_filepath, output_filepath, verify_prefix=False):
+    """Renvoie (offset, compteur, empreintes des blocs) du checkpoint s'il est valide pour ce fichier d'entrée, sinon None."""
+    path = checkpoint_path(output_filepath)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        offset = checkpoint["offset"]
+        # Fichier remplacé, tronqué ou dernier bloc modifié ; avec verify_prefix, toute modification du préfixe
+        if (checkpoint["version"] != CHECKPOINT_VERSION
+                or checkpoint["input_file"] != os.path.abspath(input_filepath)
+                or checkpoint["identity"] != file_identity(input_filepath)
+                or not prefix_unchanged(input_filepath, offset, checkpoint["blocks"], verify_prefix)):
+            print(f"ℹ️ Le checkpoint '{path}' ne correspond plus au fichier d'entrée : recalcul complet.")
+            return None
+        return offset, Counter(checkpoint["counts"]), checkpoint["blocks"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ Checkpoint '{path}' illisible ({e}) : recalcul complet.")
+        return None
+
+def save_checkpoint(input_filepath, output_filepath, offset, attribute_counter, blocks):
+    """Écrit le checkpoint de manière atomique (fichier temporaire puis remplacement)."""
+    path = checkpoint_path(output_filepath)
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "input_file": os.path.abspath(input_filepath),
+        "identity": file_identity(input_filepath),
+        "offset": offset,
+        "blocks": blocks,
+        # L'ordre des clés (ordre de première apparition) est conservé pour une sortie identique au recalcul complet
+        "counts": attribute_counter,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def count_attributes_incremental(input_filepath, output_filepath, workers=1, verify_prefix=False):
+    """
+    Compte les attributs en ne lisant que les octets ajoutés depuis le dernier checkpoint
+    (et tout le préfixe déjà traité avec verify_prefix, voir prefix_unchanged).
+
+    Seules les lignes complètes sont enregistrées dans le checkpoint : une dernière ligne sans
+    saut de ligne est comptée pour ce calcul mais relue au prochain, car elle peut encore être complétée.
+    """
+    stable_end = last_line_end(input_filepath)
+    checkpoint = load_checkpoint(input_filepath, output_filepath, verify_prefix)
+    if checkpoint is not None and checkpoint[0] <= stable_end:
+        start, attribute_counter, blocks = checkpoint
+        print(f"ℹ️ Checkpoint réutilisé : {start} octets déjà traités, {stable_end - start} nouveaux octets à analyser.")
+    else:
+        start, attribute_counter, blocks = 0, Counter(), []
+
+    attribute_counter.update(count_attributes(input_filepath, workers, start, stable_end))
+    blocks = block_fingerprints(input_filepath, stable_end, blocks, start)
+    save_checkpoint(input_filepath, output_filepath, stable_end, attribute_counter, blocks)
+
+    # Dernière ligne incomplète éventuelle
+    attribute_counter.update(count_attributes(input_filepath, 1, stable_end))
+    return attribute_counter
+
+def compute_weights(attribute_counter):
     # Trouver la fréquence max pour le calcul de poids
     max_count = max(attribute_counter.values())
 
     # Calculer les poids entre 1 et 100 avec racine carrée normalisée
-    attribute_weights = {
+    return {
         attr: round((math.sqrt(count) / math.sqrt(max_count)) * 100) if max_count > 0 else 0
         for attr, count in attribute_counter.items()
     }
 
-    # Écrire dans le fichier properties
-    with open(output_filepath, "w", encoding="utf-8") as f:
+def write_weights(attribute_weights, output_filepath):
+    os.makedirs(os.path.dirname(output_filepath) or ".", exist_ok=True)
+    # Écrire dans un fichier temporaire puis le renommer : un lecteur ne voit jamais un fichier partiel
+    tmp_path = f"{output_filepath}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         for attr, weight in sorted(attribute_weights.items(), key=lambda x: -x[1]):
             f.write(f"{attr}={weight}\n")
+    os.replace(tmp_path, output_filepath)
+
+def process_xpaths(input_filepath, output_filepath, workers=1, incremental=False, metrics=None, profile=False,
+                   values=False, weighting=WEIGHTING_FREQUENCY, selectivity_exponent=1.0,
+                   hll_precision=DEFAULT_PRECISION, approx=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                   top_n=DEFAULT_TOP_N, families=None, bootstrap=0, confidence=DEFAULT_CONFIDENCE,
+                   verify_prefix=False):
+    # Mesures par étape (désactivées sauf --metrics ou $SELECTOR_WEIGHT_METRICS)
+    recorder = recorder_from_env("pure_python_approch3", metrics, profile)
+    try:
+        return _process_xpaths(input_filepath, output_filepath, workers, incremental, recorder,
+                        values, weighting, selectivity_exponent, hll_precision,
+                        approx, memory_budget_mb, top_n, families, bootstrap, confidence, verify_prefix)
+    finally:
+        recorder.finish()
+
+def _process_xpaths(input_filepath, output_filepath, workers, incremental, recorder,
+                    values=False, weighting=WEIGHTING_FREQUENCY, selectivity_exponent=1.0,
+                    hll_precision=DEFAULT_PRECISION, approx=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                    top_n=DEFAULT_TOP_N, families=None, bootstrap=0, confidence=DEFAULT_CONFIDENCE,
+                    verify_prefix=False):
+    # La pondération par sélectivité a besoin des valeurs des prédicats
+    values = values or weighting == WEIGHTING_SELECTIVITY
+    if values and (approx or families):
+        print("❌ Erreur : --values / --weighting selectivity ne se combinent pas avec --approx ou --collapse.")
+        return 1
+    value_stats = None
+    # Compter les attributs
+    try:
+        with recorder.stage("count_attributes") as stage:
+            if approx:
+                if incremental:
+                    print("ℹ️ Mode --approx : le mode incrémental n'est pas disponible, recalcul complet.")
+                capacity, block_bytes = approx_layout(memory_budget_mb, top_n)
+                summary = count_attributes_approx(input_filepath, workers, capacity, families, block_bytes)
+                attribute_counter = top_attributes(summary, top_n)
+                report_path = write_topk_report(summary, top_n, output_filepath)
+                print(f"ℹ️ Mode approché : {len(summary.counts)} attributs suivis (capacité {capacity}), "
+                      f"erreur max {summary.max_error():.1f} ; top {top_n} écrit dans '{report_path}'.")
+            elif values:
+                if incremental:
+                    print("ℹ️ Mode --values : le mode incrémental n'est pas disponible, recalcul complet.")
+                attribute_counter, value_stats = count_attributes_and_values(input_filepath, workers, hll_precision)
+            elif incremental and not input_filepath.endswith(COMPRESSED_SUFFIXES):
+                attribute_counter = count_attributes_incremental(input_filepath, output_filepath, workers, verify_prefix)
+            else:
+                if incremental:
+                    print("ℹ️ Fichier compressé : le mode incrémental n'est pas disponible, recalcul complet.")
+                attribute_counter = count_attributes(input_filepath, workers)
+            if not approx:
+                attribute_counter = collapse_families(attribute_counter, families)
+            stage["items"] = sum(attribute_counter.values())
+    except FileNotFoundError:
+        print(f"❌ Erreur : Le fichier d'entrée '{input_filepath}' n'a pas été trouvé.")
+        return 1
+
+    if not attribute_counter:
+        print("ℹ️ Aucun attribut trouvé dans le fichier d'entrée. Le fichier de sortie ne sera pas généré.")
+        return 1
+
+    with recorder.stage("compute_weights") as stage:
+        if value_stats is not None:
+            selectivity = attribute_selectivity(attribute_counter, value_stats)
+            report_path = write_cardinality_report(attribute_counter, value_stats, selectivity, output_filepath)
+            print(f"ℹ️ Cardinalités estimées écrites dans '{report_path}'.")
+        if weighting == WEIGHTING_SELECTIVITY:
+            attribute_weights = compute_selectivity_weights(attribute_counter, selectivity, selectivity_exponent)
+        else:
+            attribute_weights = compute_weights(attribute_counter)
+        stage["items"] = len(attribute_counter)
+    with recorder.stage("write_weights") as stage:
+        write_weights(attribute_weights, output_filepath)
+        stage["items"] = len(attribute_weights)
+    if bootstrap > 0:
+        with recorder.stage("bootstrap_intervals") as stage:
+            intervals_path = write_weight_intervals(
+                attribute_counter, attribute_weights, output_filepath, bootstrap, confidence,
+                selectivity if weighting == WEIGHTING_SELECTIVITY else None, selectivity_exponent)
+            stage["items"] = bootstrap * len(attribute_counter)
+        print(f"ℹ️ Intervalles de confiance à {confidence:.0%} ({bootstrap} tirages) écrits dans '{intervals_path}'.")
 
     print(f"✅ Fichier '{output_filepath}' généré avec succès.")
+    return 0
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Génère un fichier de poids pour les attributs XPath.")
     parser.add_argument("input_file", nargs='?', default="xpathsLists/xpath_GESICO.txt",
                         help="Chemin du fichier XPath en entrée (défaut: xpathsLists/xpath_GESICO.txt)")
     parser.add_argument("output_file", nargs='?', default="weights/selectorWeight3.properties",
                         help="Chemin du fichier properties en sortie (défaut: weights/selectorWeight3.properties)")
-    args = parser.parse_args()
-    process_xpaths(args.input_file, args.output_file)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Nombre de processus pour le comptage des attributs (défaut: 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Réutilise les comptes du checkpoint stocké à côté du fichier de sortie "
+                             "et n'analyse que les lignes ajoutées depuis le dernier calcul. Un fichier remplacé "
+                             "(autre inode), tronqué ou dont le dernier bloc traité a changé est recompté")
+    parser.add_argument("--verify-prefix", action="store_true",
+                        help="Avec --incremental, relit et hache tout le préfixe déjà traité pour détecter aussi une "
+                             "modification en place en début de fichier (coût O(taille du fichier), ~1 Go/s)")
+    parser.add_argument("--metrics", default=None, metavar="PATH",
+                        help="Écrit les temps et la mémoire de chaque étape dans ce fichier JSON "
+                             "(défaut: $SELECTOR_WEIGHT_METRICS, désactivé si absente)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Avec --metrics, enregistre aussi un profil cProfile de l'étape la plus lente (PATH.prof)")
+    parser.add_argument("--values", action="store_true",
+                        help="Extrait aussi les valeurs des prédicats ([@id='x']) et estime le nombre de valeurs "
+                             f"distinctes de chaque attribut (HyperLogLog), écrit dans OUTPUT{CARDINALITY_SUFFIX}")
+    parser.add_argument("--weighting", choices=(WEIGHTING_FREQUENCY, WEIGHTING_SELECTIVITY), default=WEIGHTING_FREQUENCY,
+                        help="'frequency' : racine de la fréquence (défaut) ; 'selectivity' : fréquence combinée "
+                             "à la part de valeurs distinctes (implique --values)")
+    parser.add_argument("--selectivity-exponent", type=float, default=1.0,
+                        help="Importance de la sélectivité dans la pondération 'selectivity' (défaut: 1.0, 0 = fréquence seule)")
+    parser.add_argument("--hll-precision", type=int, default=DEFAULT_PRECISION,
+                        help=f"Précision des sketches HyperLogLog : 2^p octets par attribut, erreur ≈ 1.04/√(2^p) "
+                             f"(défaut: {DEFAULT_PRECISION})")
+    parser.add_argument("--approx", action="store_true",
+                        help="Comptage approché en mémoire bornée (Space-Saving) : seuls les --top attributs les plus "
+                             f"fréquents sont écrits, avec leurs bornes d'erreur dans OUTPUT{TOPK_SUFFIX}")
+    parser.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="Mémoire de travail de --approx en Mo, par processus : le résumé Space-Saving "
+                             f"({1 - APPROX_BLOCK_SHARE:.0%}) et le bloc du fichier en cours de comptage "
+                             f"({APPROX_BLOCK_SHARE:.0%}), hors interpréteur Python (défaut: {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N,
+                        help=f"Nombre d'attributs écrits en mode --approx (défaut: {DEFAULT_TOP_N})")
+    parser.add_argument("--collapse", action="append", default=None, metavar="REGEX=FAMILLE",
+                        help="Regroupe les attributs dont le nom correspond à REGEX sous le nom FAMILLE avant le comptage "
+                             "(répétable), ex. '^data-v-[0-9a-f]+$=data-v-*'")
+    parser.add_argument("--collapse-generated", action="store_true",
+                        help="Regroupe les familles générées connues (data-v-*, _ngcontent-*, _nghost-*)")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="Écrit aussi des intervalles de confiance des poids, tirés de N rééchantillonnages "
+                             f"multinomiaux des comptes, dans OUTPUT.ci.json (défaut: 0, désactivé)")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE,
+                        help=f"Niveau des intervalles --bootstrap (défaut: {DEFAULT_CONFIDENCE})")
+    args = parser.parse_args(argv)
+    if args.bootstrap < 0 or not 0 < args.confidence < 1:
+        parser.error("--bootstrap doit être positif et --confidence entre 0 et 1.")
+    try:
+        families = parse_families(args.collapse, args.collapse_generated)
+    except (ValueError, re.error) as e:
+        parser.error(str(e))
+    if args.top < 1 or args.memory_budget_mb < 1:
+        parser.error("--top et --memory-budget-mb doivent être positifs.")
+    if not MIN_PRECISION <= args.hll_precision <= MAX_PRECISION:
+        parser.error(f"--hll-precision doit être entre {MIN_PRECISION} et {MAX_PRECISION}.")
+    return process_xpaths(args.input_file, args.output_file, args.workers, args.incremental, args.metrics, args.profile,
+                   args.values, args.weighting, args.selectivity_exponent, args.hll_precision,
+                   args.approx, args.memory_budget_mb, args.top, families, args.bootstrap, args.confidence,
+                   args.verify_prefix)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""
+Replay evaluation: measures how well weights files locate the elements of a corpus.
+
+    python replay.py data.csv --weights weights/selectorWeight_data_kmeans_approch1.properties \\
+        --weights weights/selectorWeight_data_gpt.properties
+    python replay.py xpathsLists/xpath_GESICO.txt --weights weights/selectorWeight3.properties --sample 5000
+
+Each element of the corpus is a set of (attribute, value) pairs: the predicates of an XPath line
+([@id='x'], or just [@disabled] for a valueless attribute), or the property cells of a CSV row
+(`attr` or `attr=value`). A lookup picks a target element and records its pairs as a locator. Each
+recorded pair has changed on the target with probability --change-rate: the locator then holds
+another value of the same attribute taken from the corpus (so it now points at other elements), or
+nothing for an attribute with a single value. Every element sharing a locator pair is scored by the
+sum of the weights of the shared attributes. The lookup succeeds when the target scores highest; a
+tie between k elements counts as 1/k. Good weights trust the attributes that still single out the
+target when some of them have changed.
+
+Candidates come from an inverted index (attribute, value) -> elements, so a lookup only touches the
+elements it shares a pair with, instead of scoring the whole corpus. Identical elements are indexed
+once with their multiplicity. Every weights file replays the same lookups, alongside a uniform
+baseline (every attribute weighs 1).
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from itertools import chain
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CHANGE_RATE = 0.3
+DEFAULT_SAMPLE = 2000
+DEFAULT_SEED = 0
+UNIFORM = "uniform"
+CSV_FILLER = "n"
+
+Pair = Tuple[str, str]
+
+
+def load_weights(path: str) -> Dict[str, float]:
+    """
+    Reads a .properties weights file (attribute=weight per line).
+
+    Raises:
+        ValueError: If a non-empty, non-comment line is not attribute=number.
+    """
+    weights: Dict[str, float] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith(("#", "!")):
+                continue
+            key, sep, value = line.partition("=")
+            try:
+                weights[key.strip()] = float(value)
+            except ValueError:
+                raise ValueError(f"{path}:{line_number}: expected attribute=weight, got '{line}'.") from None
+    return weights
+
+
+# Prédicat complet (@id='x', contains(@class,"x")) ou attribut sans valeur ([@disabled])
+xpath_token_regex = re.compile(rb"""@[a-zA-Z0-9_-]+(?:\s*[=,]\s*(?:'[^'\n]*'|"[^"\n]*"))?""")
+
+
+def parse_xpath_token(token: bytes) -> Pair:
+    """
+    Splits @name='value' (or a bare @name) into (name, value).
+    """
+    quote = token[-1:]
+    if quote not in (b"'", b'"'):
+        return token[1:].decode("ascii"), ""
+    # Le guillemet de fin est aussi celui d'ouverture, absent du nom (même découpage que collect_values)
+    quote_pos = token.index(quote)
+    name = token[1:quote_pos].rstrip(b" \t=,")
+    return name.decode("ascii"), token[quote_pos + 1:-1].decode("utf-8", "replace")
+
+
+def parse_csv_token(token: str) -> Pair:
+    name, _, value = token.partition("=")
+    return name.strip(), value.strip()
+
+
+def xpath_elements(path: str) -> Iterator[Tuple[bytes, ...]]:
+    """
+    Yields the raw predicate tokens of every XPath line (see parse_xpath_token).
+
+    A token repeated in a line is kept: ElementIndex indexes every pair of an element once.
+    """
+    from pure_python_approch3 import COMPRESSED_SUFFIXES, open_compressed
+
+    findall = xpath_token_regex.findall
+    stream = open_compressed(path) if path.endswith(COMPRESSED_SUFFIXES) else open(path, "rb")
+    with stream:
+        for line in stream:
+            tokens = findall(line)
+            if tokens:
+                yield tuple(tokens)
+
+
+def csv_elements(path: str, prop_columns: List[str], filler: str = CSV_FILLER) -> Iterator[Tuple[str, ...]]:
+    """
+    Yields the property cells of every CSV row (`attr` or `attr=value`, see parse_csv_token), without duplicates.
+    """
+    from utils import load_data_chunks
+
+    for chunk in load_data_chunks(path, usecols=prop_columns, chunksize=100_000):
+        for row in chunk[prop_columns].itertuples(index=False, name=None):
+            tokens = tuple(dict.fromkeys(cell for cell in row if isinstance(cell, str) and cell != filler))
+            if tokens:
+                yield tokens
+
+
+class _Interner(dict):
+    """Token -> pair id; a new token is parsed once and mapped to the id of its (attribute, value) pair."""
+
+    def __init__(self, parse_token: Callable[[Hashable], Pair]):
+        super().__init__()
+        self.parse_token = parse_token
+        self.pair_ids: Dict[Pair, int] = {}
+
+    def __missing__(self, token: Hashable) -> int:
+        # Deux écritures d'une même paire (guillemets simples ou doubles) partagent un identifiant
+        pair_id = self[token] = self.pair_ids.setdefault(self.parse_token(token), len(self.pair_ids))
+        return pair_id
+
+
+class ElementIndex:
+    """
+    Inverted index (attribute, value) -> ids of the distinct elements carrying that pair.
+
+    Elements are given as tuples of raw tokens; each distinct token is parsed once into an
+    (attribute, value) pair with a dense pair id. Elements with identical tokens share one id,
+    and multiplicity[id] is the number of such elements. The posting lists are stored as one
+    array sorted by pair id with offsets (CSR layout), built with a single argsort.
+
+    Args:
+        elements: Iterable of token tuples, e.g. from xpath_elements or csv_elements.
+        parse_token: Converts a token into its (attribute, value) pair.
+    """
+
+    def __init__(self, elements: Iterable[Tuple[Hashable, ...]], parse_token: Callable[[Hashable], Pair]):
+        element_ids: Dict[Tuple[Hashable, ...], int] = {}
+        interner = _Interner(parse_token)
+        intern = interner.__getitem__
+        self.elements: List[Tuple[int, ...]] = []
+        multiplicity: List[int] = []
+        for tokens in elements:
+            element_id = element_ids.get(tokens)
+            if element_id is None:
+                element_id = element_ids[tokens] = len(multiplicity)
+                multiplicity.append(0)
+                self.elements.append(tuple(map(intern, tokens)))
+            multiplicity[element_id] += 1
+        self.multiplicity = np.array(multiplicity, dtype=np.int64)
+        self.pair_attributes = [name for name, _ in interner.pair_ids]
+        self.attributes = sorted(set(self.pair_attributes))
+
+        lengths = np.fromiter(map(len, self.elements), dtype=np.int64, count=len(self.elements))
+        pair_column = np.fromiter(chain.from_iterable(self.elements), dtype=np.int64, count=int(lengths.sum()))
+        element_column = np.repeat(np.arange(len(self.elements), dtype=np.int64), lengths)
+        # Une paire présente deux fois dans un élément n'y est indexée qu'une fois ; tri par paire, puis par élément
+        keys = np.sort(pair_column * len(self.elements) + element_column)
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        self.posting_elements = keys % max(len(self.elements), 1)
+        counts = np.bincount(keys // max(len(self.elements), 1), minlength=len(self.pair_attributes))
+        self.posting_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    @property
+    def n_elements(self) -> int:
+        return int(self.multiplicity.sum())
+
+    @property
+    def n_pairs(self) -> int:
+        return len(self.pair_attributes)
+
+    def postings(self, pair_id: int) -> np.ndarray:
+        """
+        Returns the sorted ids of the distinct elements carrying a pair.
+        """
+        return self.posting_elements[self.posting_offsets[pair_id]:self.posting_offsets[pair_id + 1]]
+
+    def pair_weights(self, weights: Dict[str, float], default_weight: float = 0.0) -> np.ndarray:
+        """
+        Returns the weight of every pair id: the weight of its attribute.
+        """
+        return np.array([weights.get(name, default_weight) for name in self.pair_attributes], dtype=np.float64)
+
+
+def make_lookups(index: ElementIndex, n_lookups: int, change_rate: float,
+                 seed: int = DEFAULT_SEED) -> List[Tuple[int, List[int]]]:
+    """
+    Draws target elements (identical elements weighted by their multiplicity) and their recorded locators.
+
+    Each pair of a target is replaced, with probability change_rate, by a random other pair of the
+    same attribute (or dropped if the attribute has a single pair).
+
+    Returns:
+        (target element id, locator pair ids) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    pairs_by_attribute: Dict[str, List[int]] = {}
+    position = []
+    for pair_id, name in enumerate(index.pair_attributes):
+        alternatives = pairs_by_attribute.setdefault(name, [])
+        position.append(len(alternatives))
+        alternatives.append(pair_id)
+    targets = rng.choice(len(index.elements), size=n_lookups, p=index.multiplicity / index.multiplicity.sum())
+    lookups = []
+    for target in targets:
+        locator = []
+        for pair_id in dict.fromkeys(index.elements[target]):
+            if rng.random() >= change_rate:
+                locator.append(pair_id)
+                continue
+            alternatives = pairs_by_attribute[index.pair_attributes[pair_id]]
+            if len(alternatives) > 1:
+                # Tirage parmi les autres paires du même attribut (décalage pour exclure la paire d'origine)
+                other = alternatives[(position[pair_id] + 1 + int(rng.integers(len(alternatives) - 1)))
+                                     % len(alternatives)]
+                locator.append(other)
+        lookups.append((int(target), locator))
+    return lookups
+
+
+def replay(index: ElementIndex, lookups: List[Tuple[int, List[int]]], weights: Dict[str, float],
+           default_weight: float = 0.0) -> Dict[str, float]:
+    """
+    Runs the lookups with one set of weights.
+
+    Returns:
+        accuracy (expected top-1 hit rate, ties counted as 1/k), mrr (mean reciprocal of the expected
+        target rank), unresolved (share of locators without any positively weighted pair, counted as misses),
+        mean_candidates (elements scored per lookup) and lookups_per_s.
+    """
+    multiplicity, postings = index.multiplicity, index.postings
+    pair_weights = index.pair_weights(weights, default_weight)
+    n_elements = index.n_elements
+    hits = reciprocal_ranks = 0.0
+    unresolved = candidates = 0
+    start = time.perf_counter()
+    for target, query in lookups:
+        query = [pair for pair in query if pair_weights[pair] > 0]
+        if not query:
+            unresolved += 1
+            continue
+        lists = [postings(pair) for pair in query]
+        element_ids = np.concatenate(lists)
+        element_weights = np.repeat(pair_weights[query], [len(ids) for ids in lists])
+        scored, inverse = np.unique(element_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=element_weights)
+        position = np.searchsorted(scored, target)
+        if position < len(scored) and scored[position] == target:
+            target_score = scores[position]
+            # Tolérance : deux éléments qui partagent les mêmes paires ont des sommes égales à l'arrondi près
+            better = int(multiplicity[scored[scores > target_score + 1e-9]].sum())
+            tied = int(multiplicity[scored[np.abs(scores - target_score) <= 1e-9]].sum())
+        else:
+            # La cible ne partage plus aucune paire du localisateur : à égalité avec tous les éléments non scorés
+            better = int(multiplicity[scored].sum())
+            tied = n_elements - better
+        if better == 0:
+            hits += 1.0 / tied
+        reciprocal_ranks += 1.0 / (better + (tied + 1) / 2)
+        candidates += int(multiplicity[scored].sum())
+    elapsed = time.perf_counter() - start
+    n_lookups = len(lookups)
+    return {
+        "accuracy": round(hits / n_lookups, 4) if n_lookups else 0.0,
+        "mrr": round(reciprocal_ranks / n_lookups, 4) if n_lookups else 0.0,
+        "unresolved": round(unresolved / n_lookups, 4) if n_lookups else 0.0,
+        "mean_candidates": round(candidates / n_lookups, 1) if n_lookups else 0.0,
+        "lookups_per_s": round(n_lookups / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def compare(index: ElementIndex, weight_files: List[str], n_lookups: int = DEFAULT_SAMPLE,
+            change_rate: float = DEFAULT_CHANGE_RATE, seed: int = DEFAULT_SEED,
+            default_weight: float = 0.0) -> List[Dict[str, object]]:
+    """
+    Replays the same lookups with a uniform baseline and with every weights file.
+
+    Returns:
+        One result row per weights set, the uniform baseline first.
+    """
+    lookups = make_lookups(index, n_lookups, change_rate, seed)
+    runs = [(UNIFORM, {name: 1.0 for name in index.attributes})]
+    runs += [(path, load_weights(path)) for path in weight_files]
+    rows: List[Dict[str, object]] = []
+    for name, weights in runs:
+        coverage = sum(1 for attribute in index.attributes if attribute in weights) / max(len(index.attributes), 1)
+        rows.append({"weights": name, "attribute_coverage": round(coverage, 4),
+                     **replay(index, lookups, weights, default_weight)})
+    return rows
+
+
+def format_table(rows: List[Dict[str, object]]) -> str:
+    columns = ("weights", "accuracy", "mrr", "unresolved", "mean_candidates", "lookups_per_s", "attribute_coverage")
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay element lookups on a corpus to compare weights files.")
+    parser.add_argument("corpus", help="XPath list (.txt, .gz, .zst) or CSV export (.csv) of elements")
+    parser.add_argument("--weights", action="append", default=[], metavar="PROPERTIES",
+                        help="Weights file to evaluate (repeatable); a uniform baseline is always included")
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE,
+                        help=f"Number of lookups replayed (default: {DEFAULT_SAMPLE})")
+    parser.add_argument("--change-rate", type=float, default=DEFAULT_CHANGE_RATE,
+                        help=f"Probability that a recorded attribute has changed on the target (default: {DEFAULT_CHANGE_RATE})")
+    parser.add_argument("--default-weight", type=float, default=0.0,
+                        help="Weight of attributes absent from a weights file (default: 0, never matched)")
+    parser.add_argument("--columns", nargs="+", default=None, metavar="COLUMN",
+                        help="Property columns of a CSV corpus (default: prop_columns of config_kmeans.txt)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Random seed of the lookups")
+    parser.add_argument("--output", default=None, metavar="JSON", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if not 0 <= args.change_rate < 1 or args.sample < 1:
+        parser.error("--change-rate must lie in [0, 1) and --sample must be positive.")
+
+    try:
+        build_start = time.perf_counter()
+        if args.corpus.endswith(".csv"):
+            columns = args.columns
+            if columns is None:
+                from utils import load_config
+
+                config = load_config(script_dir, 'config_kmeans.txt')
+                if config is None or 'prop_columns' not in config:
+                    logging.error("Failed to load prop_columns from the K-means configuration; use --columns.")
+                    return 1
+                columns = config['prop_columns']
+            index = ElementIndex(csv_elements(args.corpus, columns), parse_csv_token)
+        else:
+            index = ElementIndex(xpath_elements(args.corpus), parse_xpath_token)
+        if not index.elements:
+            logging.error(f"No element with attributes found in {args.corpus}.")
+            return 1
+        logging.info(f"Indexed {index.n_elements} elements ({len(index.elements)} distinct, "
+                     f"{index.n_pairs} attribute/value pairs) in {time.perf_counter() - build_start:.2f}s.")
+        rows = compare(index, args.weights, args.sample, args.change_rate, args.seed, args.default_weight)
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Replay failed: {e}")
+        return 1
+
+    print(format_table(rows))
+    if args.output:
+        report = {"corpus": args.corpus, "elements": index.n_elements, "distinct_elements": len(index.elements),
+                  "lookups": args.sample, "change_rate": args.change_rate, "seed": args.seed, "results": rows}
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, args.output)
+        logging.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
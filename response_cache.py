@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+# Limites par défaut du cache disque
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+# Une éviction descend sous cette fraction de max_bytes : les écritures suivantes ne rescannent pas le répertoire
+EVICT_TARGET_RATIO = 0.9
+
+
+def make_cache_key(**parts: Any) -> str:
+    """
+    Builds a content-addressed key from the parts that determine a response.
+
+    Args:
+        **parts: JSON-serializable values (model, prompt template, property list, serialized data...).
+
+    Returns:
+        The hex SHA-256 digest of the canonical JSON encoding of the parts.
+    """
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of completions, one JSON file per key, bounded in total size and entry age.
+
+    The total size is scanned once, on the first write, then tracked incrementally: the directory is
+    scanned again only when a write exceeds max_bytes, and eviction then frees space down to
+    EVICT_TARGET_RATIO * max_bytes, so a run of n writes costs O(n) rather than O(n^2) stat calls.
+
+    Args:
+        cache_dir: Directory holding the cache entries (created on first write).
+        max_bytes: Maximum total size of the entries; oldest entries are evicted first.
+        max_age_seconds: Entries older than this are treated as misses and evicted.
+        refresh: If True, lookups always miss but new responses are still stored.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS, refresh: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.refresh = refresh
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._size: Optional[int] = None  # Taille totale des entrées, inconnue avant le premier scan
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response for key, or None on a miss (or in refresh mode).
+        """
+        if self.refresh:
+            self.stats["misses"] += 1
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                self._remove(path)
+                self.stats["misses"] += 1
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                response = json.load(f)["response"]
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores a response atomically, then evicts entries if the size limit is exceeded.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._size is None:
+            self.evict()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "response": response}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self.stats["writes"] += 1
+        except OSError as e:
+            logging.warning(f"Failed to write cache entry {path}: {e}")
+            return
+        self._size += size - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes expired entries, then the oldest ones until the total size fits max_bytes
+        (EVICT_TARGET_RATIO * max_bytes when the limit was exceeded), and resets the tracked size.
+        """
+        now = time.time()
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                if now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * EVICT_TARGET_RATIO)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.stats["evictions"] += 1
+        except FileNotFoundError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+    def log_stats(self) -> None:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        logging.info(f"Response cache: {self.stats['hits']}/{lookups} hits "
+                     f"({self.stats['hits']} API round-trips saved), {self.stats['misses']} misses, "
+                     f"{self.stats['writes']} writes, {self.stats['evictions']} evictions.")
@@ -0,0 +1,169 @@
+"""
+Unified entry point for the three weight computation approaches.
+
+    python selector_weight.py kmeans [options of kmeans_clustring_approch1.py]
+    python selector_weight.py gpt    [options of open_ai_approch2.py]
+    python selector_weight.py xpath  [options of pure_python_approch3.py]
+    python selector_weight.py all    [--skip APPROACH] [--data-cache] [--kmeans-args ...] ...
+    python selector_weight.py watch  [options of weights_daemon.py]
+    python selector_weight.py count|merge|weigh [options of partial_counts.py]
+    python selector_weight.py replay [options of replay.py]
+    python selector_weight.py batch  [options of batch_runner.py]
+
+Only standard library modules are imported up front: pandas, numpy, scikit-learn and openai are imported
+when the approach that needs them actually runs, so `--help` starts in a few milliseconds.
+"""
+import argparse
+import logging
+import shlex
+import sys
+
+APPROACHES = ("kmeans", "gpt", "xpath")
+PARTIAL_COUNT_COMMANDS = ("count", "merge", "weigh")
+
+
+def run_approach(name, argv, data=None):
+    """
+    Imports the module of one approach and runs its main() with the given arguments.
+
+    Args:
+        name: One of APPROACHES.
+        argv: Arguments passed to the approach's own parser.
+        data: Optional DataFrame already loaded for the kmeans and gpt approaches.
+
+    Returns:
+        The exit status of the approach: 0 on success.
+    """
+    if name == "kmeans":
+        import kmeans_clustring_approch1
+        return kmeans_clustring_approch1.main(argv, data=data)
+    elif name == "gpt":
+        import open_ai_approch2
+        return open_ai_approch2.main(argv, data=data)
+    else:
+        import pure_python_approch3
+        return pure_python_approch3.main(argv)
+
+
+def load_shared_data(use_cache=False):
+    """
+    Loads the CSV once for the kmeans and gpt approaches when both configs point to the same file.
+
+    Returns:
+        A DataFrame with the union of both configs' columns, or None if the inputs differ
+        (each approach then loads its own input).
+    """
+    from utils import load_config, load_data
+    from kmeans_clustring_approch1 import script_dir
+
+    kmeans_config = load_config(script_dir, 'config_kmeans.txt')
+    gpt_config = load_config(script_dir, 'config_gpt.txt')
+    if kmeans_config is None or gpt_config is None or kmeans_config['file_path'] != gpt_config['file_path']:
+        return None
+    columns = list(dict.fromkeys(kmeans_config['columns_csv'] + gpt_config['columns_csv']))
+    data = load_data(kmeans_config['file_path'], usecols=columns, use_cache=use_cache)
+    if data is not None:
+        logging.info(f"Loaded {kmeans_config['file_path']} once for the kmeans and gpt approaches.")
+    return data
+
+
+def run_all(args):
+    """
+    Runs every approach not skipped, sharing a single load of the CSV input between kmeans and gpt.
+
+    Returns:
+        The process exit code: 0 if every approach succeeded, 1 otherwise.
+    """
+    selected = [name for name in APPROACHES if name not in (args.skip or [])]
+    approach_args = {
+        "kmeans": shlex.split(args.kmeans_args),
+        "gpt": shlex.split(args.gpt_args),
+        "xpath": shlex.split(args.xpath_args),
+    }
+    if args.data_cache:
+        approach_args["kmeans"].append("--data-cache")
+        approach_args["gpt"].append("--data-cache")
+
+    data = None
+    if "kmeans" in selected and "gpt" in selected:
+        data = load_shared_data(args.data_cache)
+
+    failed = []
+    for name in selected:
+        logging.info(f"=== Running approach '{name}' ===")
+        try:
+            status = run_approach(name, approach_args[name], data=data)
+        except (Exception, SystemExit) as e:
+            # Une approche en échec n'empêche pas les suivantes de tourner
+            logging.error(f"Approach '{name}' failed: {e!r}")
+            failed.append(name)
+            continue
+        if status:
+            # kmeans et xpath journalisent leurs erreurs sans lever d'exception : leur statut de sortie les signale
+            logging.error(f"Approach '{name}' failed with exit status {status}.")
+            failed.append(name)
+    if failed:
+        logging.error(f"Failed approaches: {failed}")
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="selector_weight.py",
+        description="Compute selector property weights with the K-means, GPT or XPath approach.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("kmeans", "K-means / exact counting approach (kmeans_clustring_approch1.py)"),
+                            ("gpt", "OpenAI approach (open_ai_approch2.py)"),
+                            ("xpath", "XPath attribute frequency approach (pure_python_approch3.py)")):
+        # L'aide et les options de chaque approche sont gérées par son propre parser (voir main)
+        subparsers.add_parser(name, help=help_text, add_help=False)
+
+    subparsers.add_parser("watch", help="Keep weights up to date as inputs grow and serve them over HTTP "
+                                        "(weights_daemon.py)", add_help=False)
+    for name, help_text in (("count", "Count input shards into a partial-count artifact (partial_counts.py)"),
+                            ("merge", "Merge partial-count artifacts (partial_counts.py)"),
+                            ("weigh", "Compute weights from partial-count artifacts (partial_counts.py)")):
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    subparsers.add_parser("replay", help="Replay element lookups on a corpus to compare weights files (replay.py)",
+                          add_help=False)
+    subparsers.add_parser("batch", help="Run the K-means approach for many configs on a process pool "
+                                        "(batch_runner.py)", add_help=False)
+
+    all_parser = subparsers.add_parser("all", help="Run every approach, loading the shared CSV input once")
+    all_parser.add_argument("--skip", action="append", choices=APPROACHES,
+                            help="Approach to skip (repeatable)")
+    all_parser.add_argument("--data-cache", action="store_true",
+                            help="Use the columnar binary cache of the parsed CSV")
+    all_parser.add_argument("--kmeans-args", default="", help="Extra options for the kmeans approach (quoted)")
+    all_parser.add_argument("--gpt-args", default="", help="Extra options for the gpt approach (quoted)")
+    all_parser.add_argument("--xpath-args", default="", help="Extra options for the xpath approach (quoted)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    # Les arguments non reconnus (y compris --help après le nom de l'approche) sont transmis à l'approche
+    args, approach_argv = parser.parse_known_args(argv)
+    if args.command == "all":
+        if approach_argv:
+            parser.error(f"unrecognized arguments: {' '.join(approach_argv)}")
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        return run_all(args)
+    if args.command == "watch":
+        import weights_daemon
+        return weights_daemon.main(approach_argv)
+    if args.command in PARTIAL_COUNT_COMMANDS:
+        import partial_counts
+        return partial_counts.main([args.command] + approach_argv)
+    if args.command == "replay":
+        import replay
+        return replay.main(approach_argv)
+    if args.command == "batch":
+        import batch_runner
+        return batch_runner.main(approach_argv)
+    return run_approach(args.command, approach_argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
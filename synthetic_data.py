@@ -0,0 +1,166 @@
+"""
+Synthetic inputs for benchmarks: data.csv-shaped element exports and XPath lists of any size.
+
+    python synthetic_data.py csv   out/data_1e6.csv   --rows 1000000
+    python synthetic_data.py xpath out/xpath_1e6.txt  --lines 1000000
+
+Files are written in chunks, so generating 1e8 rows only needs memory for one chunk.
+"""
+import argparse
+import logging
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Valeurs observées dans data.csv
+LANGAGES = ["Angular JS", "Vue JS", "technoY"]
+TAGS = ["div", "span", "p", "a", "button", "input", "label", "li", "td", "img"]
+# Probabilité qu'une colonne PropN soit renseignée (les suivantes sont de plus en plus souvent "n")
+PROP_FILL_RATES = [0.97, 0.3, 0.08, 0.03, 0.01]
+FILLER = "n"
+
+# Attributs XPath courants, du plus au moins fréquent
+COMMON_XPATH_ATTRIBUTES = [
+    "class", "id", "data-testid", "title", "ng-click", "role", "aria-label", "name", "placeholder",
+    "type", "value", "href", "for", "text", "label", "data-ng-click", "ng-model", "formcontrolname",
+    "aria-checked", "disabled", "ng-show", "ng-if", "ng-repeat", "tabindex", "aria-expanded",
+]
+# Familles d'attributs générés en masse par les frameworks (une infinité de noms distincts possibles)
+GENERATED_ATTRIBUTE_PREFIXES = ["data-", "ng-", "aria-", "data-v-", "_ngcontent-"]
+XPATH_TAGS = ["div", "span", "button", "input", "a", "li", "td", "label", "select", "mat-icon"]
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+
+def zipf_probabilities(n: int, exponent: float = 1.1) -> np.ndarray:
+    """
+    Returns Zipf-like probabilities for n items ranked by frequency, as seen in real attribute usage.
+    """
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def attribute_vocabulary(size: int) -> List[str]:
+    """
+    Returns `size` attribute names: the common ones first, then generated data-*/ng-*/aria-* families.
+    """
+    vocab = list(COMMON_XPATH_ATTRIBUTES[:size])
+    i = 0
+    while len(vocab) < size:
+        prefix = GENERATED_ATTRIBUTE_PREFIXES[i % len(GENERATED_ATTRIBUTE_PREFIXES)]
+        vocab.append(f"{prefix}{i:x}")
+        i += 1
+    return vocab
+
+
+def generate_elements_csv(file_path: str, n_rows: int, properties: Sequence[str],
+                          n_prop_columns: int = 5, seed: int = 0,
+                          chunk_rows: int = DEFAULT_CHUNK_ROWS) -> None:
+    """
+    Writes a semicolon-separated CSV with the columns of data.csv (ElementName, Langage, Tag, Prop1..PropN).
+
+    Args:
+        file_path: Output path.
+        n_rows: Number of element rows.
+        properties: Property vocabulary (e.g. the keys of properties_dict, without the "n" filler),
+                    drawn with Zipf-like frequencies.
+        n_prop_columns: Number of PropN columns.
+        seed: Random seed.
+        chunk_rows: Rows generated and written per chunk (bounds memory use).
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array([p for p in properties if p != FILLER], dtype=object)
+    probabilities = zipf_probabilities(len(vocab))
+    fill_rates = (PROP_FILL_RATES + [PROP_FILL_RATES[-1]] * n_prop_columns)[:n_prop_columns]
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    for start in range(0, n_rows, chunk_rows):
+        size = min(chunk_rows, n_rows - start)
+        chunk = {
+            "ElementName": [f"element{i:09d}" for i in range(start, start + size)],
+            "Langage": rng.choice(np.array(LANGAGES, dtype=object), size),
+            "Tag": rng.choice(np.array(TAGS, dtype=object), size),
+        }
+        for j, rate in enumerate(fill_rates, start=1):
+            values = rng.choice(vocab, size, p=probabilities)
+            chunk[f"Prop{j}"] = np.where(rng.random(size) < rate, values, FILLER)
+        pd.DataFrame(chunk).to_csv(file_path, sep=";", index=False,
+                                   mode="w" if start == 0 else "a", header=start == 0)
+    logging.info(f"Wrote {n_rows} synthetic element rows to {file_path}")
+
+
+def generate_xpath_list(file_path: str, n_lines: int, vocab_size: int = 200, max_predicates: int = 3,
+                        seed: int = 0, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> None:
+    """
+    Writes an XPath list, one XPath per line, such as //div[@id='v12'][@class='v3'].
+
+    Args:
+        file_path: Output path.
+        n_lines: Number of XPath lines.
+        vocab_size: Number of distinct attribute names (Zipf-like frequencies).
+        max_predicates: Maximum number of attribute predicates per XPath (at least 1).
+        seed: Random seed.
+        chunk_rows: Lines generated and written per chunk (bounds memory use).
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array(attribute_vocabulary(vocab_size), dtype=object)
+    probabilities = zipf_probabilities(len(vocab))
+    tags = np.array(XPATH_TAGS, dtype=object)
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        for start in range(0, n_lines, chunk_rows):
+            size = min(chunk_rows, n_lines - start)
+            line_tags = rng.choice(tags, size)
+            n_predicates = rng.integers(1, max_predicates + 1, size)
+            attributes = rng.choice(vocab, int(n_predicates.sum()), p=probabilities)
+            values = rng.integers(0, 10_000, len(attributes))
+            lines = []
+            pos = 0
+            for tag, count in zip(line_tags, n_predicates):
+                predicates = "".join(f"[@{attributes[k]}='v{values[k]}']" for k in range(pos, pos + count))
+                lines.append(f"//{tag}{predicates}\n")
+                pos += count
+            f.writelines(lines)
+    logging.info(f"Wrote {n_lines} synthetic XPath lines to {file_path}")
+
+
+def default_properties(script_dir: Optional[str] = None) -> List[str]:
+    """
+    Returns the property vocabulary of config_kmeans.txt, so generated CSVs run through the K-means pipeline.
+    """
+    from utils import load_config
+    script_dir = script_dir or os.path.dirname(os.path.abspath(__file__))
+    config = load_config(script_dir, 'config_kmeans.txt')
+    if config is None or 'properties_dict' not in config:
+        raise ValueError("config_kmeans.txt is required to pick the default property vocabulary.")
+    properties_dict: Dict[str, int] = config['properties_dict']
+    return [p for p in properties_dict if p != FILLER]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark inputs.")
+    subparsers = parser.add_subparsers(dest="kind", required=True)
+    csv_parser = subparsers.add_parser("csv", help="data.csv-shaped element export")
+    csv_parser.add_argument("output")
+    csv_parser.add_argument("--rows", type=int, required=True)
+    csv_parser.add_argument("--seed", type=int, default=0)
+    xpath_parser = subparsers.add_parser("xpath", help="XPath list, one per line")
+    xpath_parser.add_argument("output")
+    xpath_parser.add_argument("--lines", type=int, required=True)
+    xpath_parser.add_argument("--vocab-size", type=int, default=200)
+    xpath_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind == "csv":
+        generate_elements_csv(args.output, args.rows, default_properties(), seed=args.seed)
+    else:
+        generate_xpath_list(args.output, args.lines, vocab_size=args.vocab_size, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,27 @@
 import configparser
+import hashlib
+import numpy as np
 import pandas as pd
 import os
+import shutil
 import logging
 import json # Pour parser les dictionnaires/listes dans le config
-from typing import List, Dict, Any, Optional, Tuple, Union, TypedDict
+from typing import List, Dict, Any, Optional, Tuple, Union, TypedDict, Iterator
 
 # Configuration du logging (peut être configuré au niveau de l'application principale)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Cache binaire colonne par colonne des CSV déjà analysés (répertoire créé à côté du fichier source)
+DATA_CACHE_SUBDIR = os.path.join('.cache', 'parsed')
+DATA_CACHE_VERSION = 1
+
 # Optionnel: Définir des structures pour les retours de config pour plus de clarté
 class GptConfig(TypedDict):
     file_path: str
     output_file: str
     columns_csv: List[str]
+    prop_columns: List[str]
+    properties: List[str]
 
 class KmeansConfig(TypedDict):
     file_path: str
@@ -21,6 +30,12 @@ class KmeansConfig(TypedDict):
     properties_dict: Dict[str, int]
     prop_columns: List[str]
     num_clusters: int
+    engine: str
+    element_clusters: int
+    chunksize: int
+    vocabulary: str
+    codebook_file: str
+    segment_by: List[str]
 
 def load_config(script_dir: str, config_file_name: str) -> Optional[Union[GptConfig, KmeansConfig]]:
     """
@@ -60,21 +75,42 @@ def load_config(script_dir: str, config_file_name: str) -> Optional[Union[GptCon
 
         # --- Configuration Spécifique ---
         if config_file_name == 'config_gpt.txt':
-            # Pas d'autres clés spécifiques pour GPT dans l'exemple original
+            try:
+                # Colonnes de propriétés et liste des propriétés à pondérer (optionnelles)
+                prop_columns = json.loads(config.get('prop_columns', 'prop_columns', fallback='[]'))
+                properties = json.loads(config.get('properties', 'list', fallback='[]'))
+                if not isinstance(prop_columns, list) or not isinstance(properties, list):
+                    raise ValueError("prop_columns:prop_columns and properties:list should be JSON lists.")
+            except (json.JSONDecodeError, ValueError) as e:
+                logging.error(f"Error reading GPT specific configuration in {config_file_name}: {e}")
+                return None
             return GptConfig(
                 file_path=file_path,
                 output_file=output_file,
-                columns_csv=columns_csv
+                columns_csv=columns_csv,
+                prop_columns=prop_columns,
+                properties=properties
             )
         else: # Supposons que c'est pour K-Means ou autre
             try:
-                num_clusters = config.getint('base', 'num_clusters')
+                # Moteur de calcul des poids ('exact' par défaut, 'kmeans' pour l'ajustement sklearn)
+                engine = config.get('base', 'engine', fallback='exact')
+                # Nombre de groupes d'éléments du moteur 'elements'
+                element_clusters = config.getint('base', 'element_clusters', fallback=8)
+                # Lecture du CSV par blocs de 'chunksize' lignes (0 = tout charger en mémoire)
+                chunksize = config.getint('base', 'chunksize', fallback=0)
+                # Vocabulaire : 'config' (properties_dict) ou 'discover' (découvert dans les données)
+                vocabulary = config.get('base', 'vocabulary', fallback='config')
+                # Fichier du dictionnaire de codes découvert ('' = à côté du fichier de sortie)
+                codebook_file = config.get('base', 'codebook_file', fallback='')
 
                 # Lire le dictionnaire de propriétés en utilisant JSON
                 properties_str = config.get('properties_dict', 'mapping', fallback='{}') # Clé 'mapping' attendue
                 properties_dict_raw = json.loads(properties_str)
                 # Assurer que les valeurs sont bien des entiers
                 properties_dict = {str(k): int(v) for k, v in properties_dict_raw.items()}
+                # num_clusters vaut par défaut la taille du vocabulaire (filler 'n' compris)
+                num_clusters = config.getint('base', 'num_clusters', fallback=len(properties_dict))
 
                 # Lire les colonnes de propriétés en utilisant JSON
                 prop_columns_str = config.get('prop_columns', 'prop_columns', fallback='[]')
@@ -82,13 +118,24 @@ def load_config(script_dir: str, config_file_name: str) -> Optional[Union[GptCon
                 if not isinstance(prop_columns, list):
                     raise ValueError("prop_columns:prop_columns should be a JSON list.")
 
+                # Colonnes de segmentation (ex. ["Langage"]) : un fichier de poids par segment (optionnel)
+                segment_by = json.loads(config.get('segment_by', 'columns', fallback='[]'))
+                if not isinstance(segment_by, list):
+                    raise ValueError("segment_by:columns should be a JSON list.")
+
                 return KmeansConfig(
                     file_path=file_path,
                     output_file=output_file,
                     columns_csv=columns_csv,
                     properties_dict=properties_dict,
                     prop_columns=prop_columns,
-                    num_clusters=num_clusters
+                    num_clusters=num_clusters,
+                    engine=engine,
+                    element_clusters=element_clusters,
+                    chunksize=chunksize,
+                    vocabulary=vocabulary,
+                    codebook_file=codebook_file,
+                    segment_by=segment_by
                 )
             except (configparser.NoSectionError, configparser.NoOptionError, json.JSONDecodeError, ValueError, TypeError) as e:
                 logging.error(f"Error reading K-Means specific configuration in {config_file_name}: {e}")
@@ -98,20 +145,127 @@ def load_config(script_dir: str, config_file_name: str) -> Optional[Union[GptCon
         logging.error(f"Error parsing configuration file {config_file_name}: {e}")
         return None
 
-def load_data(file_path: str, usecols: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+def _data_cache_dir(file_path: str, usecols: Optional[List[str]], dtype: Optional[Dict[str, Any]]) -> str:
+    # Une entrée par (fichier, colonnes, dtypes) : l'entrée est réécrite quand le fichier source change
+    key = json.dumps([os.path.abspath(file_path), usecols, repr(sorted((dtype or {}).items()))])
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), DATA_CACHE_SUBDIR, digest)
+
+
+def _source_signature(file_path: str) -> Dict[str, int]:
+    stat = os.stat(file_path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _read_data_cache(file_path: str, cache_dir: str) -> Optional[pd.DataFrame]:
+    """
+    Loads a DataFrame from its column cache, memory-mapping the arrays, or returns None if stale/missing.
+
+    The arrays are mapped copy-on-write: the frame is writable like a parsed one, and only the pages
+    actually modified are copied in memory (the cache files are never changed). A missing or truncated
+    array (e.g. the entry is being replaced by another process) also returns None, so the CSV is re-parsed.
+    """
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != DATA_CACHE_VERSION or meta.get('source') != _source_signature(file_path):
+        logging.info(f"Data cache for {file_path} is stale, re-parsing the CSV.")
+        return None
+
+    columns = {}
+    try:
+        for i, column in enumerate(meta['columns']):
+            values = np.load(os.path.join(cache_dir, f'{i}.npy'), mmap_mode='c')
+            if column['kind'] == 'array':
+                columns[column['name']] = values
+            else:
+                categorical = pd.Categorical.from_codes(values, categories=column['categories'],
+                                                        ordered=column.get('ordered', False))
+                if column['kind'] == 'factorized':
+                    # Colonne texte : retrouver le dtype d'origine (object ou str)
+                    categorical = pd.Series(categorical).astype(column['dtype']).array
+                columns[column['name']] = categorical
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+        # Entrée incomplète (remplacée en même temps par un autre processus) ou corrompue
+        logging.warning(f"Data cache {cache_dir} is unreadable ({e}), re-parsing the CSV.")
+        return None
+    return pd.DataFrame(columns, copy=False)
+
+
+def _write_data_cache(file_path: str, cache_dir: str, data: pd.DataFrame, signature: Dict[str, int]) -> None:
+    """
+    Writes one .npy array per column: raw values for numpy dtypes, integer codes + categories otherwise.
+    Columns that cannot be represented this way (non-string objects, other extension dtypes) disable the cache.
+    """
+    arrays = []
+    meta_columns = []
+    for name in data.columns:
+        series = data[name]
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufcmM':
+            arrays.append(series.to_numpy())
+            meta_columns.append({'name': name, 'kind': 'array'})
+            continue
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+            column = {'name': name, 'kind': 'categorical', 'ordered': bool(series.cat.ordered)}
+        else:
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            column = {'name': name, 'kind': 'factorized', 'dtype': str(series.dtype)}
+        if not all(isinstance(c, str) for c in categories):
+            logging.info(f"Column '{name}' cannot be cached (non-string values); data cache disabled for {file_path}.")
+            return
+        column['categories'] = list(categories)
+        arrays.append(codes)
+        meta_columns.append(column)
+
+    # Écriture dans un répertoire temporaire puis remplacement, pour ne jamais laisser un cache partiel
+    tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, values in enumerate(arrays):
+        np.save(os.path.join(tmp_dir, f'{i}.npy'), values)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': DATA_CACHE_VERSION, 'source': signature, 'columns': meta_columns}, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    logging.info(f"Wrote data cache for {file_path} to {cache_dir}")
+
+
+def load_data(file_path: str, usecols: Optional[List[str]] = None, dtype: Optional[Dict[str, Any]] = None,
+              use_cache: bool = False) -> Optional[pd.DataFrame]:
     """
     Loads data from a CSV file.
 
     Args:
         file_path: Path to the CSV file.
         usecols: Optional list of columns to read.
+        dtype: Optional column dtypes passed to pandas (e.g. a CategoricalDtype for property columns).
+        use_cache: If True, keep a columnar binary cache of the parsed columns next to the source
+                   (.cache/parsed/). Later loads with the same usecols/dtype memory-map it (copy-on-write,
+                   so the returned frame is writable) instead of parsing the CSV; it is rebuilt
+                   automatically when the source mtime or size changes.
 
     Returns:
         A pandas DataFrame with the loaded data, or None if an error occurs.
     """
     try:
-        data = pd.read_csv(file_path, sep=";", usecols=usecols)
+        if use_cache:
+            signature = _source_signature(file_path)
+            cache_dir = _data_cache_dir(file_path, usecols, dtype)
+            data = _read_data_cache(file_path, cache_dir)
+            if data is not None:
+                logging.info(f"Loaded data from cache {cache_dir}. Shape: {data.shape}")
+                return data
+        data = pd.read_csv(file_path, sep=";", usecols=usecols, dtype=dtype)
         logging.info(f"Successfully loaded data from {file_path}. Shape: {data.shape}")
+        if use_cache:
+            try:
+                _write_data_cache(file_path, cache_dir, data, signature)
+            except OSError as e:
+                logging.warning(f"Failed to write data cache for {file_path}: {e}")
         return data
     except FileNotFoundError:
         logging.error(f"Data file not found: {file_path}")
@@ -130,3 +284,75 @@ def load_data(file_path: str, usecols: Optional[List[str]] = None) -> Optional[p
         logging.error(f"An unexpected error occurred while loading data from {file_path}: {e}", exc_info=True)
         return None
 
+
+def load_data_chunks(file_path: str, usecols: Optional[List[str]] = None, chunksize: int = 100_000,
+                     dtype: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Streams data from a CSV file in chunks of bounded size.
+
+    Unlike load_data, the whole file is never held in memory: only one chunk of
+    at most `chunksize` rows is alive at a time.
+
+    Args:
+        file_path: Path to the CSV file.
+        usecols: Optional list of columns to read.
+        chunksize: Maximum number of rows per chunk.
+        dtype: Optional column dtypes passed to pandas.
+
+    Yields:
+        pandas DataFrames of at most `chunksize` rows.
+
+    Raises:
+        FileNotFoundError, pd.errors.EmptyDataError, pd.errors.ParserError, ValueError:
+        Errors are logged and re-raised, since a partially consumed stream cannot be recovered.
+    """
+    if chunksize <= 0:
+        raise ValueError(f"chunksize must be a positive integer, got {chunksize}.")
+    total_rows = 0
+    n_chunks = 0
+    try:
+        with pd.read_csv(file_path, sep=";", usecols=usecols, chunksize=chunksize, dtype=dtype) as reader:
+            for chunk in reader:
+                total_rows += len(chunk)
+                n_chunks += 1
+                yield chunk
+    except FileNotFoundError:
+        logging.error(f"Data file not found: {file_path}")
+        raise
+    except pd.errors.EmptyDataError:
+        logging.error(f"Data file is empty: {file_path}")
+        raise
+    except pd.errors.ParserError as e:
+        logging.error(f"Error parsing CSV file {file_path}: {e}")
+        raise
+    except ValueError as e:
+        # Peut arriver si usecols contient une colonne inexistante
+        logging.error(f"Error reading CSV {file_path} (check columns?): {e}")
+        raise
+    logging.info(f"Successfully streamed {total_rows} rows in {n_chunks} chunks from {file_path}.")
+
+def count_property_values(data: pd.DataFrame, prop_columns: List[str], filler: Optional[str] = 'n') -> Dict[str, int]:
+    """
+    Counts how often each property value appears across the property columns.
+
+    This is the combined per-code count used by the K-means approach, computed on the
+    raw values: one occurrence per (row, column) cell.
+
+    Args:
+        data: DataFrame holding the property columns.
+        prop_columns: List of property column names.
+        filler: Placeholder value for empty cells ("n" in data.csv), excluded from the counts.
+
+    Returns:
+        A dictionary mapping each property value to its number of occurrences, most frequent first.
+
+    Raises:
+        KeyError: If a column in prop_columns is not found in the DataFrame.
+    """
+    missing = [prop for prop in prop_columns if prop not in data.columns]
+    if missing:
+        raise KeyError(f"Property columns {missing} not found in DataFrame.")
+    counts = data[prop_columns].stack().value_counts()
+    if filler is not None:
+        counts = counts.drop(filler, errors='ignore')
+    return {str(value): int(count) for value, count in counts.items()}
@@ -0,0 +1,559 @@
+"""
+Long-running weights daemon: keeps the counts in memory, folds in appended data and republishes the weights.
+
+    python weights_daemon.py --xpath xpathsLists/xpath_GESICO.txt weights/selectorWeight3.properties
+    python weights_daemon.py --kmeans --xpath drop/ weights/selectorWeight3.properties --interval 10 --port 8765
+
+Each input (a file, or a drop directory whose files are all read) is polled every --interval seconds.
+Only the complete lines appended since the last poll are parsed; a truncated or replaced file is
+recounted from scratch. Each change re-reads only the last processed block; the whole processed
+prefix is re-hashed at most every --verify-interval seconds, to catch in-place edits earlier in a file. A properties file is rewritten (atomically) only when its weights change.
+
+The local HTTP endpoint serves:
+    GET /weights          all current weights as JSON, by pipeline name (output file name without extension)
+    GET /weights/<name>   one pipeline's weights in the .properties format
+    GET /metrics          polling and publishing metrics as JSON
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import peak_rss_bytes
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Intervalle minimal (secondes) entre deux vérifications complètes du préfixe déjà compté d'un fichier
+DEFAULT_VERIFY_INTERVAL = 3600.0
+# Fichiers ignorés dans un répertoire de dépôt (écritures en cours, checkpoints, fichiers cachés)
+IGNORED_SUFFIXES = (".tmp", ".part", ".checkpoint.json")
+
+
+def list_inputs(path: str) -> List[str]:
+    """
+    Returns the files to read for an input: the file itself, or the visible files of a drop directory.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(entry.path for entry in os.scandir(path)
+                  if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(IGNORED_SUFFIXES))
+
+
+class AppendTracker:
+    """
+    Tracks the complete lines appended to one file since the previous poll.
+
+    The processed prefix is identified by the file's device and inode, its size and the fingerprints of
+    all its blocks. If the file is replaced or shrinks, or its last processed block changes, it is recounted
+    from scratch. Every block is re-hashed only every verify_interval seconds (never if 0), so a poll
+    reads O(appended bytes) and an in-place edit earlier in the file is caught by the next full check.
+    Like the incremental mode of pure_python_approch3.py, a last line without a newline is not
+    part of the processed prefix: sources count it provisionally and read it again on the next poll.
+
+    poll() only proposes a range: the offset moves past it when the source calls commit() after
+    counting it, so a range that fails to parse is read again on the next poll instead of being skipped.
+    """
+
+    def __init__(self, path: str, verify_interval: float = DEFAULT_VERIFY_INTERVAL):
+        self.path = path
+        self.verify_interval = verify_interval
+        self.offset = 0
+        self.blocks: List[str] = []
+        self.identity: Optional[Tuple[int, int]] = None
+        self.signature: Optional[Tuple[int, int]] = None
+        self.pending: Optional[Tuple[Tuple[int, int], Tuple[int, int], bool, int, bool]] = None
+        self.verified = time.monotonic()
+
+    def poll(self, start: int = 0) -> Optional[Tuple[bool, int, int, int]]:
+        """
+        Returns None if the file did not change since the last committed poll, else (reset, begin, end, size):
+        reset is True when the counts of this file must be dropped before folding in [begin, end),
+        the byte range of complete lines not processed yet; [end, size) is the incomplete last line.
+        Call commit() once the range is counted.
+
+        Args:
+            start: Offset where a rewritten file is read from again (e.g. the end of a CSV header).
+
+        Raises:
+            FileNotFoundError: If the file no longer exists.
+        """
+        from pure_python_approch3 import last_line_end, prefix_unchanged
+
+        stat = os.stat(self.path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return None
+        identity = (stat.st_dev, stat.st_ino)
+        size = stat.st_size
+        full = bool(self.verify_interval) and time.monotonic() - self.verified >= self.verify_interval
+        reset = False
+        if self.offset and (identity != self.identity
+                            or not prefix_unchanged(self.path, self.offset, self.blocks, verify_prefix=full)):
+            logging.info(f"{self.path} was truncated or rewritten; recounting it from scratch.")
+            reset = True
+        begin = max(0 if reset else self.offset, start)
+        end = max(last_line_end(self.path), begin) if size > begin else begin
+        self.pending = (signature, identity, reset, end, full)
+        return reset, begin, end, max(size, end)
+
+    def commit(self) -> None:
+        """
+        Marks the range returned by the last poll() as counted.
+        """
+        from pure_python_approch3 import block_fingerprints
+
+        signature, identity, reset, end, full = self.pending
+        self.pending = None
+        if reset:
+            self.offset, self.blocks = 0, []
+        if end != self.offset or reset:
+            self.blocks = block_fingerprints(self.path, end, self.blocks, self.offset)
+            self.offset = end
+        self.identity, self.signature = identity, signature
+        if full:
+            self.verified = time.monotonic()
+
+
+class XpathSource:
+    """
+    In-memory attribute counts of one XPath list, updated with the lines appended since the last poll.
+    Compressed files cannot be appended to: they are recounted whenever their size or mtime changes.
+    """
+
+    def __init__(self, path: str, workers: int = 1, verify_interval: float = DEFAULT_VERIFY_INTERVAL):
+        from pure_python_approch3 import COMPRESSED_SUFFIXES
+        self.path = path
+        self.workers = workers
+        self.compressed = path.endswith(COMPRESSED_SUFFIXES)
+        self.tracker = AppendTracker(path, verify_interval)
+        self.signature: Optional[Tuple[int, int]] = None
+        self.counter: Counter = Counter()
+        self.tail: Counter = Counter()
+
+    @property
+    def counts(self) -> Counter:
+        """Counts of the complete lines plus the provisional counts of an incomplete last line."""
+        return self.counter + self.tail if self.tail else self.counter
+
+    def poll(self) -> Tuple[bool, int]:
+        """
+        Folds in the new data. Returns (changed, records): whether the counts changed and
+        how many attribute occurrences were read.
+        """
+        from pure_python_approch3 import count_attributes
+
+        if self.compressed:
+            stat = os.stat(self.path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature == self.signature:
+                return False, 0
+            self.signature = signature
+            self.counter = count_attributes(self.path)
+            return True, sum(self.counter.values())
+
+        polled = self.tracker.poll()
+        if polled is None:
+            return False, 0
+        reset, begin, end, size = polled
+        new_counts = count_attributes(self.path, self.workers, begin, end) if end > begin else Counter()
+        tail = count_attributes(self.path, 1, end, size) if size > end else Counter()
+        self.tracker.commit()
+        if reset:
+            self.counter = Counter()
+        self.counter.update(new_counts)
+        changed = reset or bool(new_counts) or tail != self.tail
+        self.tail = tail
+        return changed, sum(new_counts.values())
+
+
+class KmeansSource:
+    """
+    In-memory property code counts of one CSV export, updated with the rows appended since the last poll.
+    """
+
+    def __init__(self, path: str, properties_map: Dict[str, int], prop_columns: List[str], num_clusters: int,
+                 verify_interval: float = DEFAULT_VERIFY_INTERVAL):
+        self.path = path
+        self.properties_map = properties_map
+        self.prop_columns = prop_columns
+        self.num_clusters = num_clusters
+        self.tracker = AppendTracker(path, verify_interval)
+        self.header: Optional[List[str]] = None
+        self.header_end = 0
+        self.stable_counts = self._empty_counts()
+        self.tail_counts = self._empty_counts()
+
+    @property
+    def counts(self):
+        """Counts of the complete rows plus the provisional counts of an incomplete last row."""
+        return self.stable_counts + self.tail_counts
+
+    def _empty_counts(self):
+        import numpy as np
+        return np.zeros((len(self.prop_columns), self.num_clusters + 1), dtype=np.int64)
+
+    def _read_header(self) -> None:
+        with open(self.path, "rb") as f:
+            line = f.readline()
+        if not line.endswith(b"\n"):
+            self.header, self.header_end = None, 0
+            return
+        self.header = line.decode("utf-8").rstrip("\r\n").split(";")
+        self.header_end = len(line)
+
+    def poll(self) -> Tuple[bool, int]:
+        """
+        Folds in the new complete rows. Returns (changed, records): whether the counts changed and
+        how many rows were read.
+        """
+        import numpy as np
+
+        if self.header is None:
+            self._read_header()
+            if self.header is None:
+                return False, 0
+        polled = self.tracker.poll(start=self.header_end)
+        if polled is None:
+            return False, 0
+        reset, begin, end, size = polled
+        if reset:
+            self._read_header()
+            if self.header is None:
+                self.tracker.commit()
+                self.stable_counts = self._empty_counts()
+                self.tail_counts = self._empty_counts()
+                return True, 0
+            begin, end = max(begin, self.header_end), max(end, self.header_end)
+        new_counts, n_rows = self._count_rows(begin, end)
+        tail_counts, _ = self._count_rows(end, size)
+        self.tracker.commit()
+        if reset:
+            self.stable_counts = self._empty_counts()
+        self.stable_counts += new_counts
+        changed = reset or n_rows > 0 or not np.array_equal(tail_counts, self.tail_counts)
+        self.tail_counts = tail_counts
+        return changed, n_rows
+
+    def _count_rows(self, begin: int, end: int):
+        """
+        Parses the rows in [begin, end) and returns their code counts and their number.
+        """
+        import pandas as pd
+        from kmeans_clustring_approch1 import count_properties, property_dtype
+
+        if end <= begin:
+            return self._empty_counts(), 0
+        with open(self.path, "rb") as f:
+            f.seek(begin)
+            block = f.read(end - begin)
+        dtype = {prop: property_dtype(self.properties_map) for prop in self.prop_columns}
+        rows = pd.read_csv(io.BytesIO(block), sep=";", header=None, names=self.header,
+                           usecols=self.prop_columns, dtype=dtype)
+        return count_properties(rows, self.properties_map, self.prop_columns, self.num_clusters), len(rows)
+
+
+class XpathPipeline:
+    """
+    Approach 3 weights (pure_python_approch3.py) over an XPath list or a drop directory of XPath lists.
+    """
+
+    def __init__(self, input_path: str, output_path: str, workers: int = 1,
+                 verify_interval: float = DEFAULT_VERIFY_INTERVAL):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.workers = workers
+        self.verify_interval = verify_interval
+        self.name = os.path.splitext(os.path.basename(output_path))[0]
+        self.sources: Dict[str, XpathSource] = {}
+
+    def poll(self) -> Tuple[bool, int]:
+        """
+        Polls every input file. Returns (changed, records): whether any count changed and how many
+        attribute occurrences were folded in.
+        """
+        return _sync_sources(self.sources, list_inputs(self.input_path),
+                             lambda path: XpathSource(path, self.workers, self.verify_interval))
+
+    def weights(self) -> List[Tuple[str, int]]:
+        """
+        Returns the weights in the order of the properties file (decreasing weight).
+        """
+        from pure_python_approch3 import compute_weights
+
+        total: Counter = Counter()
+        for source in self.sources.values():
+            total.update(source.counts)
+        if not total:
+            return []
+        return sorted(compute_weights(total).items(), key=lambda x: -x[1])
+
+    def write(self, weights: List[Tuple[str, int]]) -> None:
+        from pure_python_approch3 import write_weights
+        write_weights(dict(weights), self.output_path)
+
+
+class KmeansPipeline:
+    """
+    Approach 1 weights (exact engine of kmeans_clustring_approch1.py) over the configured CSV or a drop directory.
+    """
+
+    def __init__(self, input_path: str, output_path: str, properties_map: Dict[str, int],
+                 prop_columns: List[str], num_clusters: int, filler: str = "n",
+                 verify_interval: float = DEFAULT_VERIFY_INTERVAL):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.properties_map = properties_map
+        self.prop_columns = prop_columns
+        self.num_clusters = num_clusters
+        self.filler = filler
+        self.verify_interval = verify_interval
+        self.name = os.path.splitext(os.path.basename(output_path))[0]
+        self.sources: Dict[str, KmeansSource] = {}
+
+    def poll(self) -> Tuple[bool, int]:
+        return _sync_sources(self.sources, list_inputs(self.input_path),
+                             lambda path: KmeansSource(path, self.properties_map, self.prop_columns,
+                                                       self.num_clusters, verify_interval=self.verify_interval))
+
+    def weights(self) -> List[Tuple[str, int]]:
+        """
+        Returns the weights in the order of the properties file (properties_dict order, filler excluded).
+        """
+        from kmeans_clustring_approch1 import combine_weights, trim_unknown, weights_from_counts
+
+        if not self.sources:
+            return []
+        counts = sum(source.counts for source in self.sources.values())
+        if not counts.any():
+            return []
+        weight_matrix = weights_from_counts(trim_unknown(counts, self.num_clusters))
+        final_weights = combine_weights([{i: float(w) for i, w in enumerate(row)} for row in weight_matrix])
+        return [(key, int(final_weights.get(code, 0))) for key, code in self.properties_map.items()
+                if key != self.filler]
+
+    def write(self, weights: List[Tuple[str, int]]) -> None:
+        from kmeans_clustring_approch1 import write_to_properties_file
+        final_weights = {self.properties_map[key]: float(weight) for key, weight in weights}
+        write_to_properties_file(final_weights, self.properties_map, self.output_path, self.filler)
+
+
+def _sync_sources(sources: Dict[str, Any], paths: List[str], make_source) -> Tuple[bool, int]:
+    """
+    Adds sources for new files, drops the ones whose file disappeared and polls the others.
+    """
+    changed, records = False, 0
+    for path in list(sources):
+        if path not in paths:
+            logging.info(f"{path} disappeared; its counts are dropped.")
+            del sources[path]
+            changed = True
+    for path in paths:
+        source = sources.get(path)
+        if source is None:
+            source = sources[path] = make_source(path)
+        try:
+            source_changed, source_records = source.poll()
+        except FileNotFoundError:
+            del sources[path]
+            changed = True
+            continue
+        changed = changed or source_changed
+        records += source_records
+    return changed, records
+
+
+class WeightsDaemon:
+    """
+    Polls the pipelines, republishes their properties files when the weights change and
+    keeps a snapshot of the current weights and metrics for the HTTP endpoint.
+    """
+
+    def __init__(self, pipelines: List[Any], interval: float = DEFAULT_INTERVAL):
+        self.pipelines = pipelines
+        self.interval = interval
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        # Instantané remplacé en bloc à chaque publication : les lectures HTTP n'ont pas besoin de verrou
+        self.weights: Dict[str, List[Tuple[str, int]]] = {}
+        self.metrics: Dict[str, Dict[str, Any]] = {
+            pipeline.name: {"input": pipeline.input_path, "output": pipeline.output_path, "polls": 0,
+                            "records_folded": 0, "publishes": 0, "last_poll_s": None,
+                            "last_poll": None, "last_publish": None, "n_weights": 0, "errors": 0}
+            for pipeline in pipelines
+        }
+        # Pipelines dont le fichier publié est peut-être en retard sur les comptes (échec de lecture ou d'écriture)
+        self.dirty: set = set()
+
+    def poll_once(self) -> None:
+        for pipeline in self.pipelines:
+            metrics = self.metrics[pipeline.name]
+            wall_start = time.perf_counter()
+            try:
+                changed, records = pipeline.poll()
+                if changed or pipeline.name in self.dirty:
+                    weights = pipeline.weights()
+                    if weights and weights != self.weights.get(pipeline.name):
+                        pipeline.write(weights)
+                        self.weights = {**self.weights, pipeline.name: weights}
+                        metrics["publishes"] += 1
+                        metrics["last_publish"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                        metrics["n_weights"] = len(weights)
+                        logging.info(f"Published {len(weights)} weights to {pipeline.output_path}.")
+                self.dirty.discard(pipeline.name)
+                metrics["records_folded"] += records
+            except Exception as e:
+                # Une erreur de lecture (fichier en cours d'écriture, CSV invalide...) ne doit pas arrêter le démon.
+                # Les comptes ont pu changer sans être publiés : les poids sont recalculés et republiés au prochain passage.
+                self.dirty.add(pipeline.name)
+                metrics["errors"] += 1
+                logging.error(f"Polling '{pipeline.name}' failed: {e!r}")
+            metrics["polls"] += 1
+            metrics["last_poll_s"] = round(time.perf_counter() - wall_start, 6)
+            metrics["last_poll"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def run(self) -> None:
+        """
+        Polls until stop() is called (or SIGINT/SIGTERM is received when run from main()).
+        """
+        while True:
+            self.poll_once()
+            if self.stop_event.wait(self.interval):
+                break
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started, 3),
+            "interval_s": self.interval,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "pipelines": self.metrics,
+        }
+
+
+def make_http_server(daemon: WeightsDaemon, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    Builds the HTTP server serving the daemon's weights and metrics (call serve_forever() in a thread).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: str, content_type: str) -> None:
+            payload = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            path = self.path.split("?", 1)[0].rstrip("/")
+            weights = daemon.weights
+            if path == "/weights":
+                self._send(200, json.dumps({name: dict(w) for name, w in weights.items()}), "application/json")
+            elif path.startswith("/weights/") and path[len("/weights/"):] in weights:
+                body = "".join(f"{key}={value}\n" for key, value in weights[path[len("/weights/"):]])
+                self._send(200, body, "text/plain")
+            elif path == "/metrics":
+                self._send(200, json.dumps(daemon.metrics_snapshot()), "application/json")
+            else:
+                self._send(404, json.dumps({"error": f"unknown path {path or '/'}",
+                                            "weights": sorted(weights)}), "application/json")
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logging.debug(f"HTTP {self.address_string()} {format % args}")
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def kmeans_pipeline_from_config(input_path: Optional[str] = None,
+                                verify_interval: float = DEFAULT_VERIFY_INTERVAL) -> Optional[KmeansPipeline]:
+    """
+    Builds the K-means pipeline from configs/config_kmeans.txt (input defaults to its file_path).
+    """
+    from utils import load_config
+
+    config = load_config(script_dir, 'config_kmeans.txt')
+    if config is None or 'num_clusters' not in config:
+        logging.error("Failed to load the K-means configuration.")
+        return None
+    if config.get('vocabulary', 'config') != 'config' or config.get('segment_by'):
+        logging.warning("The daemon uses properties_dict and writes global weights only; "
+                        "the vocabulary and segment_by options are ignored.")
+    output_path = os.path.join(script_dir, 'weights', config['output_file'])
+    return KmeansPipeline(input_path or config['file_path'], output_path, config['properties_dict'],
+                          config['prop_columns'], config['num_clusters'], verify_interval=verify_interval)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Keep weights up to date as input files grow, and serve them over HTTP.")
+    parser.add_argument("--xpath", nargs=2, action="append", default=[], metavar=("INPUT", "OUTPUT"),
+                        help="XPath list (or drop directory) and the properties file to maintain (repeatable)")
+    parser.add_argument("--kmeans", action="store_true",
+                        help="Also maintain the K-means weights of configs/config_kmeans.txt (exact engine)")
+    parser.add_argument("--kmeans-input", default=None,
+                        help="CSV file or drop directory for --kmeans (default: file_path from the config)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to count XPath attributes")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--verify-interval", type=float, default=DEFAULT_VERIFY_INTERVAL,
+                        help="Minimum seconds between full re-hashes of a file's processed prefix, which catch in-place "
+                             f"edits before its last block (default: {DEFAULT_VERIFY_INTERVAL:g}, 0 disables them)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"HTTP bind address (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"HTTP port (default: {DEFAULT_PORT}, 0 binds an ephemeral port, logged at startup)")
+    parser.add_argument("--no-http", action="store_true", help="Do not start the HTTP endpoint")
+    parser.add_argument("--once", action="store_true",
+                        help="Poll once, publish and exit (status 1 if any pipeline failed)")
+    args = parser.parse_args(argv)
+
+    pipelines: List[Any] = [XpathPipeline(input_path, output_path, args.workers, args.verify_interval)
+                            for input_path, output_path in args.xpath]
+    if args.kmeans:
+        kmeans_pipeline = kmeans_pipeline_from_config(args.kmeans_input, args.verify_interval)
+        if kmeans_pipeline is None:
+            return 1
+        pipelines.append(kmeans_pipeline)
+    if not pipelines:
+        parser.error("nothing to watch: give --xpath INPUT OUTPUT and/or --kmeans.")
+    names = [pipeline.name for pipeline in pipelines]
+    if len(set(names)) != len(names):
+        parser.error(f"output file names must be distinct, got {names}.")
+
+    daemon = WeightsDaemon(pipelines, args.interval)
+    if args.once:
+        daemon.poll_once()
+        # Un pipeline en échec n'a pas publié : le code de sortie le signale (cron)
+        return 1 if daemon.dirty else 0
+
+    server = None
+    if not args.no_http:
+        server = make_http_server(daemon, args.host, args.port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Serving weights on http://{args.host}:{server.server_address[1]}/weights")
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: daemon.stop())
+    logging.info(f"Watching {[p.input_path for p in pipelines]} every {args.interval}s.")
+    try:
+        daemon.run()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    logging.info("Daemon stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())